@@ -0,0 +1,384 @@
+import json
+import yaml
+import random
+import statistics
+import subprocess
+import contextlib
+import platform
+import tempfile
+import shutil
+import os
+import time
+import gc
+from builder import ModelGraph, FlowGraph, BUILDER_VERSION, mergePatch, copyTree
+import instanceimage
+import profiler
+
+
+# ObjectFlow Builder benchmark
+#
+# Generates a synthetic model and flow at a chosen scale and times each phase of the builder pipeline separately,
+# writing the timings as JSON so that runs can be compared between commits
+#
+# The synthetic model is the common.sdf.yml definitions from the Model directory plus generated files with:
+#   resource types   each one a chain of sdfRef refinements, chainDepth deep, down to ObjectFlowResource
+#   object types     each one with resourcesPerObject resources, chained objectChain deep by sdfRef to other
+#                    object types so that resources and sdfRequired lists are inherited and merged
+#
+# The synthetic flow has instances objects of random types. The first hubs objects are link hubs, every other
+# object has an OutputLink to a random hub (fan-in), and each hub has fanOut output links to random objects (fan-out)
+#
+# The merge phases merge a patch tree into a base tree of mergeWidth keys in each dict, mergeDepth deep, once with
+# numbers at the leaves and once with lists of sdfRef pointers, with mergePatch and with the recursive merge it replaced
+#
+# python3 benchmark.py --object-types 2000 --instances 2000 --output before.json
+# python3 benchmark.py --object-types 2000 --instances 2000 --output after.json --compare before.json
+#
+OBJECT_TYPE_BASE = 50000
+RESOURCE_TYPE_BASE = 30000
+VALUE_TYPES = [ "IntegerType", "FloatType", "BooleanType", "TimeType" ]
+
+def _randomValue(rng, valueType):
+  if valueType == "IntegerType":
+    return rng.randint(-1000, 1000)
+  if valueType == "FloatType":
+    return round(rng.uniform(-100, 100), 3)
+  if valueType == "BooleanType":
+    return rng.random() < 0.5
+  return rng.randint(0, 100000)
+
+def _defaultValue(valueType):
+  if valueType == "BooleanType":
+    return False
+  if valueType == "FloatType":
+    return 0.0
+  return 0
+
+def _writeFile(path, content, fileFormat):
+  with open(path, "w") as outfile:
+    if fileFormat == "json":
+      json.dump(content, outfile, indent=1)
+    else:
+      yaml.safe_dump(content, outfile, sort_keys=False)
+
+# write a synthetic model to modelDirectory, returns the resources of each object type (name: [(resource, valueType)])
+def generateModel(modelDirectory, baseModel, objectTypes, resourceTypes, resourcesPerObject, chainDepth, objectChain,
+    fanOut, files, fileFormat="yml", seed=1):
+  rng = random.Random(seed)
+  os.makedirs(modelDirectory, exist_ok=True)
+  shutil.copy(baseModel, os.path.join(modelDirectory, os.path.basename(baseModel)))
+  extension = ".sdf." + fileFormat
+  files = max(1, min(files, objectTypes))
+
+  # resource types and their refinement chains go in the first file
+  resourceValueTypes = []
+  sdfProperty = {}
+  resourceTypeIDs = {}
+  for index in range(resourceTypes):
+    name = "SynResource%d" % index
+    valueType = VALUE_TYPES[index % len(VALUE_TYPES)]
+    resourceValueTypes.append( (name, valueType) )
+    resourceTypeIDs[name] = { "const": RESOURCE_TYPE_BASE + index }
+    sdfProperty[name + "Level0"] = {
+      "description": "Synthetic resource type " + name,
+      "sdfRef": "/#/sdfProperty/ObjectFlowResource",
+      "oma:id": { "sdfRef": "/#/sdfData/TypeID/ResourceType/" + name },
+      "flo:meta": { "ValueType": { "sdfChoice": { valueType: {} } } },
+      "sdfChoice": { valueType: { "default": _defaultValue(valueType) } }
+    }
+    for level in range(1, chainDepth):
+      sdfProperty["%sLevel%d" % (name, level)] = {
+        "description": "Refinement %d of %s" % (level, name),
+        "sdfRef": "/#/sdfProperty/%sLevel%d" % (name, level - 1),
+        "sdfChoice": { valueType: { "default": _defaultValue(valueType) } }
+      }
+  _writeFile( os.path.join(modelDirectory, "synresources" + extension), {
+    "info": { "title": "Synthetic resource types" },
+    "sdfData": { "TypeID": { "ResourceType": resourceTypeIDs } },
+    "sdfProperty": sdfProperty
+  }, fileFormat )
+
+  # object types, split over the model files
+  objectResources = {}
+  perFile = (objectTypes + files - 1) // files
+  for fileIndex in range(files):
+    objectTypeIDs = {}
+    sdfObject = {}
+    for index in range(fileIndex * perFile, min(objectTypes, (fileIndex + 1) * perFile)):
+      name = "SynObject%d" % index
+      objectTypeIDs[name] = { "const": OBJECT_TYPE_BASE + index }
+      resources = rng.sample(resourceValueTypes, min(resourcesPerObject, len(resourceValueTypes)))
+      sdfObject[name] = {
+        "oma:id": { "sdfRef": "/#/sdfData/TypeID/ObjectType/" + name },
+        "sdfRequired": [ "/#/sdfObject/%s/sdfProperty/%s" % (name, resource) for resource, valueType in resources ],
+        "sdfProperty": {}
+      }
+      for resource, valueType in resources:
+        sdfObject[name]["sdfProperty"][resource] = { "sdfRef": "/#/sdfProperty/%sLevel%d" % (resource, chainDepth - 1), "required": True }
+      if index % objectChain == 0: # chain root, with the link resources
+        sdfObject[name]["sdfRef"] = "/#/sdfObject/ObjectFlowObject"
+        for link in range(fanOut):
+          sdfObject[name]["sdfProperty"][ "OutputLink" + (str(link) if link else "") ] = {
+            "sdfRef": "/#/sdfObject/ObjectFlowObject/sdfProperty/OutputLink" }
+        objectResources[name] = list(resources)
+      else: # refines the previous object type
+        sdfObject[name]["sdfRef"] = "/#/sdfObject/SynObject%d" % (index - 1)
+        objectResources[name] = objectResources["SynObject%d" % (index - 1)] + [ resource for resource in resources
+          if resource not in objectResources["SynObject%d" % (index - 1)] ]
+    _writeFile( os.path.join(modelDirectory, "synobjects%d%s" % (fileIndex, extension)), {
+      "info": { "title": "Synthetic object types %d" % fileIndex },
+      "sdfData": { "TypeID": { "ObjectType": objectTypeIDs } },
+      "sdfObject": sdfObject
+    }, fileFormat )
+  return objectResources
+
+# write a synthetic flow spec to flowDirectory
+def generateFlow(flowDirectory, objectResources, instances, hubs, fanOut, fileFormat="yml", seed=1):
+  rng = random.Random(seed + 1)
+  os.makedirs(flowDirectory, exist_ok=True)
+  typeNames = sorted(objectResources)
+  hubs = max(1, min(hubs, instances - 1))
+  flow = {}
+  for index in range(instances):
+    typeName = rng.choice(typeNames)
+    flowObject = { "$type": typeName }
+    for resource, valueType in objectResources[typeName]:
+      if rng.random() < 0.5:
+        flowObject[resource] = _randomValue(rng, valueType)
+    flow["Node%d" % index] = flowObject
+  for index in range(instances):
+    flowObject = flow["Node%d" % index]
+    if index < hubs:
+      for link in range(fanOut):
+        flowObject[ "OutputLink" + (str(link) if link else "") ] = "Node%d" % rng.randrange(hubs, instances)
+    else:
+      flowObject["OutputLink"] = "Node%d" % rng.randrange(hubs)
+  _writeFile( os.path.join(flowDirectory, "FlowSpec.flo." + fileFormat), { "Flow": flow }, fileFormat )
+
+# run a function with the builder's console output discarded, returning (seconds, result)
+def _timed(function):
+  with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+    startTime = time.perf_counter()
+    result = function()
+    return time.perf_counter() - startTime, result
+
+# run a constructor with the builder's console output discarded and a profiler active, without memory tracing so 
+# that it doesn't slow the build down, returning (seconds, result, { builder phase: seconds })
+def _profiled(function):
+  with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), \
+      profiler.profiling( profiler.Profiler(memory=False) ) as profile:
+    startTime = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - startTime
+  return seconds, result, { name: totals["seconds"] for name, totals in profile.report()["phases"].items() }
+
+# time each phase of one build of the model and flow directories, returns { phase: seconds } and the counts
+# the graphs are built with their constructors, and the construction phases are split with the builder's own
+# profiler phases, so the benchmark follows any change to the constructors
+def runPhases(modelDirectory, flowDirectory, workers=1, interned=False):
+  phases = {}
+  seconds, model, modelPhases = _profiled( lambda: ModelGraph(modelDirectory, None, workers) )
+  if model.errors() != 0:
+    raise ValueError("%d errors building the synthetic model" % model.errors())
+  phases["ModelGraph"] = seconds - modelPhases["check pointers"] # loading, parsing and merging the model files
+  phases["checkPointers"] = modelPhases["check pointers"]
+
+  seconds, flow, flowPhases = _profiled( lambda: FlowGraph(model, flowDirectory, None, workers, interned) )
+  phases["loadFlowSpec"] = flowPhases["load flow spec"]
+  phases["resolveFlowGraph"] = flowPhases["resolve flow graph"]
+
+  # emitters
+  phases["resourceHeader"], _ = _timed( model.resourceHeader )
+  phases["objectHeader"], _ = _timed( model.objectHeader )
+  phases["objectFlowHeader"], _ = _timed( flow.objectFlowHeader )
+  phases["flowSpecUML"], _ = _timed( flow.flowSpecUML )
+  phases["objectFlowImage"], _ = _timed( lambda: flow.objectFlowImage(instanceimage.targetABI("arm32")) )
+  phases["idList"], _ = _timed( model.idList )
+
+  # serializers
+  phases["modelJSON"], _ = _timed( model.json )
+  phases["modelYAML"], _ = _timed( model.yaml )
+  phases["flowJSON"], _ = _timed( flow.json )
+  phases["flowYAML"], _ = _timed( flow.yaml )
+
+  counts = {
+    "objectTypes": len( model.resolve("/sdfData/TypeID/ObjectType") ),
+    "resourceTypes": len( model.resolve("/sdfData/TypeID/ResourceType") ),
+    "flowObjects": len( flow.resolve("/sdfThing/Flow/sdfObject") ),
+    "instanceRows": sum( 1 for row in flow.objectFlowRows() ),
+    "closureCache": flow.closureCacheStats(),
+    "flowNodes": _nodeCounts( flow.graph() )
+  }
+  return phases, counts
+
+# the recursive refine merge with a set() list union that mergePatch replaced, as the reference for the merge phases
+def recursiveMerge(base, patch):
+  if not isinstance(base, dict):
+    base = {}
+  if not isinstance(patch, dict):
+    return patch
+  for key, patchItem in patch.items():
+    if isinstance(patchItem, dict):
+      baseValue = base.get(key)
+      if isinstance(baseValue, dict) and "sdfChoice" != key:
+        base[key] = recursiveMerge(baseValue, patchItem)
+      else:
+        base[key] = recursiveMerge({}, patchItem)
+      continue
+    if isinstance(patchItem, list):
+      baseValue = base.get(key)
+      if isinstance(baseValue, list):
+        base[key] = list(set(baseValue + patchItem))
+        continue
+    if None is patchItem:
+      base.pop(key, None)
+      continue
+    if "description" != key:
+      base[key] = patchItem
+  return base
+
+# a tree of width keys in each dict, depth deep, with leaf(n) at the n-th leaf
+def mergeTree(width, depth, leaf, offset=0):
+  if depth == 0:
+    return leaf(offset)
+  return { "Node%d" % index: mergeTree(width, depth - 1, leaf, offset * width + index) for index in range(width) }
+
+# time the merges of a patch tree into a base tree, whose leaves overlap, returns { phase: seconds }
+def runMerges(width, depth):
+  phases = {}
+  trees = {
+    "merge": ( lambda n: n, lambda n: n + 1 ),
+    "mergeLists": ( lambda n: [ "#/sdfData/R%d" % n, "#/sdfData/R%d" % (n + 1) ],
+      lambda n: [ "#/sdfData/R%d" % (n + 1), "#/sdfData/R%d" % (n + 2) ] ),
+  }
+  for name, (baseLeaf, patchLeaf) in trees.items():
+    base = mergeTree(width, depth, baseLeaf)
+    patch = mergeTree(width, depth, patchLeaf)
+    for suffix, merge in ( ("", lambda base: mergePatch(base, patch, refine=True)),
+        ("Recursive", lambda base: recursiveMerge(base, patch)) ):
+      copy = copyTree(base)
+      gc.collect() # so that neither merge pays for collecting the garbage of the other
+      phases[name + suffix], _ = _timed( lambda: merge(copy) )
+  return phases
+
+# dict and list nodes in a tree, counting shared nodes at each place and once
+def _nodeCounts(tree):
+  total = 0
+  distinct = set()
+  stack = [ tree ]
+  while stack:
+    node = stack.pop()
+    total += 1
+    distinct.add(id(node))
+    stack.extend( item for item in (node.values() if isinstance(node, dict) else node) if isinstance(item, (dict, list)) )
+  return { "total": total, "distinct": len(distinct) }
+
+def _gitCommit():
+  try:
+    return subprocess.run( [ "git", "rev-parse", "HEAD" ], cwd=os.path.dirname(os.path.abspath(__file__)),
+      capture_output=True, text=True, check=True ).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+# print the phases of a result next to a previous result, with the ratio of the medians
+def compareResults(result, previous):
+  print ( "\n%-20s %12s %12s %8s" % ("Phase", "Previous", "Current", "Ratio") )
+  for phase in result["phases"]:
+    current = result["phases"][phase]["median"]
+    if phase in previous.get("phases", {}):
+      before = previous["phases"][phase]["median"]
+      print ( "%-20s %12.4f %12.4f %8.2f" % (phase, before, current, current / before if before else float("inf")) )
+    else:
+      print ( "%-20s %12s %12.4f" % (phase, "-", current) )
+  if result["parameters"] != previous.get("parameters"):
+    print ( "Warning: the benchmark parameters differ from the previous result" )
+
+def benchmark(argv=None):
+  import argparse
+  parser = argparse.ArgumentParser(description="ObjectFlow Builder benchmark")
+  parser.add_argument("--object-types", type=int, default=500, help="number of synthetic object types")
+  parser.add_argument("--resource-types", type=int, default=1000, help="number of synthetic resource types")
+  parser.add_argument("--resources-per-object", type=int, default=8, help="resources defined in each object type")
+  parser.add_argument("--chain-depth", type=int, default=6, help="length of the sdfRef refinement chain of each resource type")
+  parser.add_argument("--object-chain", type=int, default=3, help="length of the sdfRef chains between object types")
+  parser.add_argument("--instances", type=int, default=500, help="number of objects in the synthetic flow")
+  parser.add_argument("--hubs", type=int, default=10, help="number of link hub objects in the flow")
+  parser.add_argument("--fan-out", type=int, default=8, help="output links of each hub object")
+  parser.add_argument("--files", type=int, default=10, help="number of model files for the object types")
+  parser.add_argument("--format", choices=["yml", "json"], default="yml", help="format of the generated files")
+  parser.add_argument("--seed", type=int, default=1, help="random seed for the generator")
+  parser.add_argument("--workers", type=int, default=1, help="builder worker processes")
+  parser.add_argument("--intern", action="store_true", help="build the flow graph with the interned node store")
+  parser.add_argument("--merge-width", type=int, default=6, help="keys in each dict of the merge trees")
+  parser.add_argument("--merge-depth", type=int, default=6, help="depth of the merge trees")
+  parser.add_argument("--repeat", type=int, default=3, help="number of timed builds")
+  parser.add_argument("--base-model", default="../Model/common.sdf.yml", help="common definitions to build the synthetic model on")
+  parser.add_argument("--work-dir", help="directory for the generated model and flow, a temporary directory if not given")
+  parser.add_argument("--output", help="file to write the JSON results to")
+  parser.add_argument("--compare", metavar="FILE", help="JSON results of a previous run to compare with")
+  args = parser.parse_args(argv)
+
+  if args.object_types < 1 or OBJECT_TYPE_BASE + args.object_types > 65536:
+    parser.error("--object-types must be between 1 and %d" % (65536 - OBJECT_TYPE_BASE))
+  if args.resource_types < 1 or RESOURCE_TYPE_BASE + args.resource_types > 43000:
+    parser.error("--resource-types must be between 1 and %d" % (43000 - RESOURCE_TYPE_BASE))
+  if args.instances < 2 or args.chain_depth < 1 or args.object_chain < 1 or args.fan_out < 1:
+    parser.error("--instances must be at least 2, --chain-depth, --object-chain and --fan-out at least 1")
+  if args.repeat < 1:
+    parser.error("--repeat must be at least 1")
+  if args.merge_width < 1 or args.merge_depth < 1:
+    parser.error("--merge-width and --merge-depth must be at least 1")
+
+  parameters = { "objectTypes": args.object_types, "resourceTypes": args.resource_types,
+    "resourcesPerObject": args.resources_per_object, "chainDepth": args.chain_depth, "objectChain": args.object_chain,
+    "instances": args.instances, "hubs": args.hubs, "fanOut": args.fan_out, "files": args.files, "format": args.format,
+    "seed": args.seed, "workers": args.workers, "intern": args.intern, "mergeWidth": args.merge_width,
+    "mergeDepth": args.merge_depth }
+
+  workDirectory = args.work_dir or tempfile.mkdtemp(prefix="objectflow-benchmark-")
+  modelDirectory = os.path.join(workDirectory, "Model") + "/"
+  flowDirectory = os.path.join(workDirectory, "Flow") + "/"
+  try:
+    print ( "Generating the synthetic model and flow in", workDirectory )
+    objectResources = generateModel( modelDirectory, args.base_model, args.object_types, args.resource_types,
+      args.resources_per_object, args.chain_depth, args.object_chain, args.fan_out, args.files, args.format, args.seed )
+    generateFlow( flowDirectory, objectResources, args.instances, args.hubs, args.fan_out, args.format, args.seed )
+
+    runs = []
+    for run in range(args.repeat):
+      phases, counts = runPhases(modelDirectory, flowDirectory, args.workers, args.intern)
+      phases.update( runMerges(args.merge_width, args.merge_depth) )
+      print ( "Run %d: %.3f s" % (run + 1, sum(phases.values())) )
+      runs.append(phases)
+  finally:
+    if not args.work_dir:
+      shutil.rmtree(workDirectory, ignore_errors=True)
+
+  result = {
+    "builderVersion": BUILDER_VERSION,
+    "commit": _gitCommit(),
+    "python": platform.python_version(),
+    "platform": platform.platform(),
+    "parameters": parameters,
+    "counts": counts,
+    "phases": { phase: { "min": min( run[phase] for run in runs ), "median": statistics.median( run[phase] for run in runs ),
+      "runs": [ run[phase] for run in runs ] } for phase in runs[0] }
+  }
+
+  print ( "\n%-20s %12s %12s" % ("Phase", "Min", "Median") )
+  for phase, timing in result["phases"].items():
+    print ( "%-20s %12.4f %12.4f" % (phase, timing["min"], timing["median"]) )
+  print ( "Counts", json.dumps(counts) )
+
+  if args.output:
+    with open(args.output, "w") as outfile:
+      json.dump(result, outfile, indent=2)
+    print ( "Results in", args.output )
+
+  if args.compare:
+    with open(args.compare, "r") as comparefile:
+      compareResults(result, json.load(comparefile))
+  return result
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,61 @@
+
+import json
+import hashlib
+import os
+
+
+# ObjectFlow Builder cache
+# content addressed store for intermediate build products, kept in a directory as JSON files
+#
+# entries are named by kind and a sha256 key computed from the input content and the builder version,
+# so changing a model or flow file, or upgrading the builder, selects new entries and stale ones are
+# simply never read again. Entries are written to a temporary file and renamed into place so that an
+# interrupted build can't leave a partial entry behind
+#
+class BuildCache():
+  def __init__(self, cachePath, version):
+    self._cachePath = cachePath
+    self._version = version
+    self._stats = { "hits": 0, "misses": 0, "stores": 0 }
+    os.makedirs(self._cachePath, exist_ok=True)
+
+  def key(self, *parts):
+    # key for a list of JSON serializable parts, the builder version is always included
+    digest = hashlib.sha256()
+    digest.update(self._version.encode("utf-8"))
+    for part in parts:
+      digest.update(b"\0")
+      digest.update(json.dumps(part, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+  def contentKey(self, files):
+    # key for a list of (file name, file contents) in load order
+    return self.key( [ [ os.path.basename(name), hashlib.sha256(text.encode("utf-8")).hexdigest() ] for name, text in files ] )
+
+  def load(self, kind, key):
+    try:
+      with open(self._entryPath(kind, key), "r") as entryfile:
+        value = json.load(entryfile)
+    except (OSError, ValueError):
+      self._stats["misses"] += 1
+      return None
+    self._stats["hits"] += 1
+    return value
+
+  def store(self, kind, key, value):
+    try:
+      text = json.dumps(value)
+    except (TypeError, ValueError):
+      print("Build cache can't store", kind, key) # not JSON serializable, just don't cache it
+      return
+    tempPath = self._entryPath(kind, key) + ".%d.tmp" % os.getpid()
+    with open(tempPath, "w") as entryfile:
+      entryfile.write(text)
+    os.replace(tempPath, self._entryPath(kind, key))
+    self._stats["stores"] += 1
+
+  def stats(self):
+    return dict(self._stats)
+
+  def _entryPath(self, kind, key):
+    return os.path.join(self._cachePath, kind + "-" + key + ".json")
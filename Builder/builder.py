@@ -1,123 +1,518 @@
 
 import json
+import bisect
 import yaml
 import glob
 from jsonpointer import resolve_pointer
-import copy
 import subprocess
+import filecmp
+import sys
+import os
+import time
+import multiprocessing
+import concurrent.futures
+from buildcache import BuildCache
+import instanceimage
+import memorybudget
+import lookuptables
+import flowdelta
+import profiler
+from flowtopology import FlowTopology, stronglyConnectedComponents
+from nodestore import NodeStore, assignPaths
+
+# bump when a change to the builder changes the resolved graphs, to select new build cache entries
+BUILDER_VERSION = "0.5"
+
+
+# normalize the sdfRef pointer forms "/#/path", "#/path", and "/path" to a plain JSON pointer "/path"
+def normalizePointer(sdfPointer):
+  if sdfPointer.startswith("/#"):
+    return sdfPointer[2:]
+  if sdfPointer.startswith("#"):
+    return sdfPointer[1:]
+  return sdfPointer
+
+# copy a JSON tree of dicts and lists, sharing the immutable leaf values
+# much cheaper than copy.deepcopy because there is no memo or type dispatch
+def copyTree(value):
+  if isinstance(value, dict):
+    return { key: copyTree(item) for key, item in value.items() }
+  if isinstance(value, list):
+    return [ copyTree(item) for item in value ]
+  return value
+
+
+# read a list of files, returning (file name, text) in the same order
+def readFiles(fileList):
+  files = []
+  for file in fileList:
+    with open(file, "r") as sourcefile:
+      files.append( (file, sourcefile.read()) )
+  return files
+
+# the libyaml C loader is several times faster than the pure Python loader, use it when PyYAML was built with it
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# parse JSON or YAML text by file name
+def parseFile(file, text):
+  if file.endswith(".json"):
+    return json.loads(text)
+  return yaml.load(text, Loader=YamlLoader)
+
+def _parseFileItem(item):
+  return parseFile(*item)
+
+# parse a list of (file name, text), returning the parsed files in the same order
+# with more than one worker the files are parsed in a process pool, which pays off for large model directories
+def parseFiles(files, workers=1):
+  if workers > 1 and len(files) > 1:
+    chunksize = max(1, len(files) // (workers * 4))
+    with concurrent.futures.ProcessPoolExecutor( max_workers=min(workers, len(files)) ) as executor:
+      return list( executor.map(_parseFileItem, files, chunksize=chunksize) )
+  return [ parseFile(file, text) for file, text in files ]
+
+# the multiprocessing context for worker pools that take the model graph, fork where it is available so that the
+# workers share the model graph with this process instead of unpickling it
+def _processContext():
+  if "fork" in multiprocessing.get_all_start_methods():
+    return multiprocessing.get_context("fork")
+  return multiprocessing.get_context()
+
+# a model bundle is the merged and checked model graph of a model directory in a single JSON file
+# produced once with ModelGraph.writeBundle, and loaded by ModelGraph without any YAML parsing or checking
+MODEL_BUNDLE_FORMAT = "objectflow-model-bundle"
+
+# return the pointers of the nodes that differ between two JSON trees, stopping at the first difference on each path
+def diffPointers(old, new):
+  changed = []
+  stack = [ (old, new, "") ]
+  while stack:
+    old, new, pointer = stack.pop()
+    if old is new:
+      continue # shared subtree, as in interned graphs
+    if isinstance(old, dict) and isinstance(new, dict):
+      for key in set(old) | set(new):
+        itemPointer = pointer + "/" + escapePointerToken(key)
+        if key not in old or key not in new:
+          changed.append(itemPointer)
+        else:
+          stack.append( (old[key], new[key], itemPointer) )
+    elif old != new:
+      changed.append(pointer)
+  return sorted(changed)
+
+# true if a change at any of the changed pointers touches the node at pointer, its ancestors, or its descendants
+def pointerAffected(pointer, changed):
+  for changedPointer in changed:
+    if changedPointer == pointer or pointer.startswith(changedPointer + "/") or changedPointer.startswith(pointer + "/"):
+      return True
+  return False
+
+# Merge engine shared by Graph and FlowGraph
+#
+# RFC7386 style merge-patch with a uniqueItems list merge. Dicts in the patch are merged in place into matching dicts
+# in the base, and new dicts are only made where the base has none. None in the patch removes the node from the base.
+# Lists are merged as an ordered union, base items first, so the result is the same from run to run
+#
+# refine=True selects the refine merge used to expand models: an sdfChoice in the patch replaces the sdfChoice in 
+# the base instead of merging with it, and description values are filtered out
+#
+# Returns the merged base, which is a new dict if the base wasn't a dict, or the patch itself if it isn't a dict
+#
+# This is the inner loop of model expansion. The patch is walked recursively, which visits the nodes in the order
+# they were made, down to MERGE_RECURSION levels. Deeper dicts are left on an explicit stack and walked from there,
+# so deeply nested models can't hit the recursion limit. Each key is looked up in the base once, and nodes are told
+# apart by their class, as the YAML and JSON loaders and copyTree only make plain dicts and lists
+MERGE_RECURSION = 64
+
+def mergePatch(base, patch, refine=False):
+  if not isinstance(base, dict):
+    base = {}
+  if not isinstance(patch, dict):
+    return patch
+  deep = []
+  _mergeNode(base, patch, refine, MERGE_RECURSION, deep)
+  while deep:
+    node, patchNode = deep.pop()
+    _mergeNode(node, patchNode, refine, MERGE_RECURSION, deep)
+  profiler.active.count("merge")
+  return base
+
+# merge patchNode into node, recursing depth more levels and leaving the dicts below that on deep
+def _mergeNode(node, patchNode, refine, depth, deep):
+  get = node.get
+  for key, patchItem in patchNode.items():
+    itemClass = patchItem.__class__
+    if itemClass is dict:
+      baseValue = get(key)
+      if baseValue.__class__ is not dict or refine and "sdfChoice" == key:
+        baseValue = node[key] = {}
+      if depth:
+        _mergeNode(baseValue, patchItem, refine, depth - 1, deep)
+      else:
+        deep.append( (baseValue, patchItem) )
+    elif itemClass is list:
+      baseValue = get(key)
+      node[key] = unionList(baseValue, patchItem) if baseValue.__class__ is list else patchItem
+    elif None is patchItem:
+      node.pop(key, None)
+    elif not refine or "description" != key:
+      node[key] = patchItem
+
+# ordered union of two lists, the base items as they are, then the patch items that aren't in it yet
+# the base list is either a union from an earlier merge or a list from the model, whose items are unique
+#
+# items are the same if they are equal and of the same type, so 1, 1.0 and True are three items, as they are three
+# JSON values. Dicts and lists are the same if their canonical JSON is. Short lists, which is most of them, are
+# searched, longer lists are hashed
+SHORT_LIST = 16
+
+def unionList(baseList, patchList):
+  if len(baseList) + len(patchList) > SHORT_LIST:
+    return _unionHashed(baseList, patchList)
+  merged = list(baseList)
+  for item in patchList:
+    if item in merged:
+      # an equal item, which is the same unless it is of another type, or holds values of other types
+      itemClass = item.__class__
+      if itemClass is str:
+        continue
+      if merged[merged.index(item)].__class__ is itemClass and itemClass is not dict and itemClass is not list:
+        continue
+      itemKey = _itemKey(item)
+      if any( _itemKey(kept) == itemKey for kept in merged ):
+        continue
+    merged.append(item)
+  return merged
+
+def _unionHashed(baseList, patchList):
+  merged = list(baseList)
+  seen = set( map(_itemKey, baseList) )
+  for item in patchList:
+    itemKey = _itemKey(item)
+    if itemKey not in seen:
+      seen.add(itemKey)
+      merged.append(item)
+  return merged
+
+def _itemKey(item):
+  if isinstance(item, (dict, list)):
+    return (item.__class__, json.dumps(item, sort_keys=True))
+  return (item.__class__, item)
+
+# escape a dict key for use as a JSON pointer reference token (RFC6901)
+def escapePointerToken(key):
+  return str(key).replace("~", "~0").replace("/", "~1")
 
 
 class Graph():
 # class Graph(dict):
-  def __init__(self, spec={}):
+  def __init__(self, spec={}, indexed=False, interned=False):
     self._graph = {}
+    # optional flat index of JSON pointer to node, built on the first resolve and patched by add()
+    # None means the index is enabled but not built yet
+    self._indexed = indexed
+    self._index = None
+    # optional store of interned nodes, where subclasses keep identical subtrees once, see nodestore.py
+    # interned nodes are shared and are changed with _assignPaths, which copies the paths it changes
+    self._store = NodeStore() if interned else None
     self.add(spec)
 
   def add(self, model):
     self._merge(model) 
+    if self._index is not None:
+      self._patchIndex(self._graph, model, "")
 
   def _merge(self, model):
   # RFC7386 style merge-patch + uniqueItem list merge
-  # recursive descent merge JSON, extend trees and set values
+  # descend the patch and the graph together, extend trees and set values
   # for each item in the model, check the position in the graph
   # add to graph if not present until the end value is reached 
   # set the end value (const doubles with default as they are dicts)
-  # arrays are merged assuming uniqueItems, leaving the set union
-    self._graph = self._mergeObject(self._graph, model) # kick off the recursion
+  # arrays are merged assuming uniqueItems, leaving the ordered union
+    self._graph = self._mergeObject(self._graph, model)
 
   def _mergeObject(self, base, patch):
-    if not isinstance(base, dict):
-      base = {}
-
-    if not isinstance( patch, dict):
-      return patch
-
-    for key, patchItem in patch.items():
-      if isinstance(patchItem, dict): 
-        baseValue = base.get(key) # key error safe this way
-        if isinstance(baseValue, dict): # see if there is a matching dict in the base
-          self._mergeObject(base[key], patchItem) # if so, merge the patch value into the base
-          continue
-        base[key] = {} # if there isn't a dict there, make a new empty node merge dict into it
-        self._mergeObject(base[key], patchItem)
-        continue
-      if isinstance(patchItem, list):      
-        baseValue = base.get(key) # key error safe this way
-        if isinstance(baseValue, list): # see if there is a matching list
-          baseValue = list(set(baseValue + patchItem)) # merge lists with unique values
-          continue
-      if None is patchItem: # if the patch contains None, remove the matching node in the base
-        base.pop(key, None)
-        continue
-      base[key] = patchItem # replace empty or plain value with value from the patch
-    return base
+    return mergePatch(base, patch)
 
   def graph(self):
     return self._graph
 
   def resolve(self, pointer):
+    profiler.active.count("resolve")
+    if self._indexed:
+      if self._index is None:
+        self._buildIndex()
+      if pointer in self._index:
+        return self._index[pointer]
+    # list items and pointers that don't resolve are left to jsonpointer
     return resolve_pointer(self._graph, pointer)
 
+  # the index maps the pointer of every node reachable through dicts to the node
+  # list items are not indexed, their pointers fall through to jsonpointer in resolve()
+  def _buildIndex(self):
+    self._index = { "": self._graph }
+    self._indexSubtree(self._graph, "")
+
+  def _indexSubtree(self, node, pointer):
+    stack = [ (node, pointer) ]
+    while stack:
+      node, pointer = stack.pop()
+      for key, item in node.items():
+        itemPointer = pointer + "/" + escapePointerToken(key)
+        self._index[itemPointer] = item
+        if isinstance(item, dict):
+          stack.append( (item, itemPointer) )
+
+  # update the index after a merge, following the patch down the merged graph
+  # dicts merged into existing dicts keep their identity, so only new or replaced nodes are re-indexed
+  def _patchIndex(self, node, patch, pointer):
+    if not isinstance(patch, dict) or not isinstance(node, dict):
+      self._index = None # the graph root was replaced, rebuild on the next resolve
+      return
+    self._index[""] = self._graph
+    stack = [ (node, patch, pointer) ]
+    while stack:
+      node, patch, pointer = stack.pop()
+      for key, patchItem in patch.items():
+        itemPointer = pointer + "/" + escapePointerToken(key)
+        indexedItem = self._index.get(itemPointer)
+        item = node.get(key)
+        if key not in node:
+          if itemPointer in self._index:
+            self._dropIndexSubtree(itemPointer) # removed by a None in the patch
+          continue
+        if isinstance(patchItem, dict) and item is indexedItem:
+          stack.append( (item, patchItem, itemPointer) ) # merged in place, follow the patch down
+          continue
+        if isinstance(indexedItem, dict):
+          self._dropIndexSubtree(itemPointer) # a dict was replaced, its old descendants are stale
+        self._index[itemPointer] = item
+        if isinstance(item, dict):
+          self._indexSubtree(item, itemPointer)
+
+  def _dropIndexSubtree(self, pointer):
+    prefix = pointer + "/"
+    for stale in [ key for key in self._index if key.startswith(prefix) ]:
+      del self._index[stale]
+    self._index.pop(pointer, None)
+
+  def _invalidateIndex(self):
+    # call after changing the graph in place outside of add()
+    self._index = None
+
+  def _intern(self, node):
+    # the interned copy of a node, or the node itself when there is no node store
+    if self._store is None:
+      return node
+    return self._store.intern(node)
+
+  def _assignPaths(self, node, assignments):
+    # set values inside a node, copying the paths to them when the node may be shared, returns the new node
+    return assignPaths(node, assignments, copyOnWrite=self._store is not None)
+
+  def nodeStoreStats(self):
+    # interned and shared node counts, None when there is no node store
+    if self._store is None:
+      return None
+    return self._store.stats()
+
   def json(self):
     # options go here
     return json.dumps( self.graph() ) 
 
   def yaml(self):
     # options go here
-    return yaml.dump( self.graph() ) 
+    return yaml.dump( self.graph(), Dumper=_NoAliasDumper ) 
+
+# write shared nodes out in full instead of as YAML anchors and aliases, the graphs are trees to their readers
+class _NoAliasDumper(yaml.Dumper):
+  def ignore_aliases(self, data):
+    return True
 
 
 class ModelGraph(Graph):
-  def __init__(self, modelPath):
-    Graph.__init__(self)
-    # read in all of the SDF files in the model directory
-    for file in glob.glob( modelPath + "*.sdf.json" ):
-      print(file)
-      self.add( json.loads( open(file,"r").read() ) )
-    for file in glob.glob( modelPath + "*.sdf.yml" ):
-      print(file)
-      self.add( yaml.safe_load( open(file,"r").read() ) )
-    self._checkPointers()
+  def __init__(self, modelPath, cache=None, workers=1, include=None, registry=None):
+    Graph.__init__(self, indexed=True)
+    self._cacheKey = None
+
+    # references to other namespaces are resolved in the models of a NamespaceRegistry
+    self._registry = registry
+
+    # a model path naming a file is a compiled model bundle
+    if os.path.isfile(modelPath):
+      self._loadBundle(modelPath, cache)
+      return
+
+    # read in all of the SDF files in the model directory, or only the files in include
+    with profiler.active.phase("load model files"):
+      files = readFiles( [ file for file in modelFiles(modelPath) if include is None or file in include ] )
+
+    # with a build cache, a model set that has been merged and checked before is loaded from the cache
+    if cache is not None:
+      self._cacheKey = self._contentKey(cache, files)
+      cached = cache.load("model", self._cacheKey)
+      if cached is not None:
+        print("Model graph from cache", self._cacheKey[:12])
+        self._graph = cached
+        self._invalidateIndex()
+        self._errors = 0
+        return
 
-  # validate that all of the sdfRef and sdfRequired resolve to some place in the merged graph
-  # recursive scan for instances of these keys and resolve the references
+    with profiler.active.phase("parse model files"):
+      models = parseFiles(files, workers)
+    with profiler.active.phase("merge models"):
+      for (file, text), model in zip( files, models ):
+        print(file)
+        self.add( model )
+    with profiler.active.phase("check pointers"):
+      self._checkPointers()
+
+    if cache is not None and self._errors == 0:
+      cache.store("model", self._cacheKey, self._graph)
+
+  def _loadBundle(self, bundlePath, cache):
+    print(bundlePath)
+    with profiler.active.phase("load model bundle"):
+      files = readFiles( [ bundlePath ] )
+      bundle = json.loads( files[0][1] )
+    if not isinstance(bundle, dict) or bundle.get("format") != MODEL_BUNDLE_FORMAT:
+      print("Not a model bundle:", bundlePath)
+      raise ValueError(bundlePath)
+    # a bundle is loaded without the pointer and cycle checks, which are only as good as the builder version that
+    # ran them, so bundles from other versions are rebuilt from the model files
+    if bundle.get("builderVersion") != BUILDER_VERSION:
+      print("Model bundle built by builder version", bundle.get("builderVersion"), "not", BUILDER_VERSION + ",",
+        "rebuild it with --write-bundle:", bundlePath)
+      raise ValueError(bundlePath)
+    self._graph = bundle["graph"]
+    self._invalidateIndex()
+    self._errors = 0 # bundles are only written from checked model graphs
+    if cache is not None:
+      self._cacheKey = self._contentKey(cache, files)
+
+  def _contentKey(self, cache, files):
+    # the model depends on the registry models too, when it refers to them
+    if self._registry is not None and self._registry.cacheKey() is not None:
+      return cache.key( cache.contentKey(files), self._registry.cacheKey() )
+    return cache.contentKey(files)
+
+  def writeBundle(self, bundlePath):
+    # write the merged model graph as a bundle for fast loading
+    bundle = { "format": MODEL_BUNDLE_FORMAT, "builderVersion": BUILDER_VERSION, "graph": self.graph() }
+    with open(bundlePath, "w") as bundlefile:
+      json.dump(bundle, bundlefile)
+
+  def cacheKey(self):
+    # content key of the model files, None if the model wasn't built with a cache
+    return self._cacheKey
+
+  # validate that all of the sdfRef and sdfRequired resolve to some place in the merged graph, and that no sdfRef
+  # chain leads back into itself. Expanding a cycle would never end, so cycles are errors like unresolved pointers
+  #
+  # one scan collects every reference with its source location, each unique target is resolved once, and the 
+  # reference graph is checked for cycles. Every error is reported with all of the places it comes from
   # allow sdfRef in any object type node of the instance
   # 
   def _checkPointers(self):
     self._errors = 0
-    self._check(self.graph())
-
-  def _check(self, value):
-    if isinstance(value, dict):
-      if "sdfRef" in value:
-        self._checkResolve(value["sdfRef"])
-      if "sdfRequired" in value:
-        for ref in value["sdfRequired"]:
-          self._checkResolve(ref)
-      for item in value:
-        self._check(value[item])
-
-  def _checkResolve(self, sdfPointer):
-    self._pointer = sdfPointer
-    if self._pointer.startswith("/#"):
-      self._pointer = self._pointer[2:]
-    elif self._pointer.startswith("#"):
-      self._pointer = self._pointer[1:]
-    if self._pointer.startswith("/"):
+    references = self._collectReferences(self.graph())
+
+    # resolve each unique target once, and report each unresolved target with all of its sources
+    unresolved = {}
+    resolved = set()
+    for source, ref in references:
+      pointer = normalizePointer(ref)
+      if pointer in resolved:
+        continue
+      if pointer in unresolved:
+        unresolved[pointer].append(source)
+        continue
       try:
-        target = self.resolve(self._pointer)
-      except:
-        print("sdfPointer doesn't resolve:", self._pointer)
-        self._errors += 1
-        return
-      return(target)
-    else:
-      return(self._resolveNamespaceReference(self._pointer)) # resolve curie
+        self.resolveReference(pointer)
+        resolved.add(pointer)
+      except Exception:
+        unresolved[pointer] = [ source ]
+    for pointer, sources in unresolved.items():
+      print("sdfPointer doesn't resolve:", pointer, "from", ", ".join(sources))
+      self._errors += len(sources)
+
+    for cycle in self._referenceCycles(references, resolved):
+      print("sdfRef cycle:", ", ".join(cycle))
+      self._errors += 1
+
+  # scan the graph for references, returning (source pointer, reference) in graph order
+  def _collectReferences(self, graph):
+    references = []
+    stack = [ (graph, "") ]
+    while stack:
+      node, pointer = stack.pop()
+      if "sdfRef" in node:
+        references.append( (pointer + "/sdfRef", node["sdfRef"]) )
+      if "sdfRequired" in node:
+        for index, ref in enumerate(node["sdfRequired"]):
+          references.append( (pointer + "/sdfRequired/%d" % index, ref) )
+      for key in reversed(node):
+        item = node[key]
+        if isinstance(item, dict):
+          stack.append( (item, pointer + "/" + escapePointerToken(key)) )
+    return references
+
+  # find the sdfRef cycles in the resolved references, as lists of sdfRef source pointers
+  #
+  # expanding a node with an sdfRef expands the target, and with it every sdfRef located in the target's subtree, 
+  # so the reference graph has an edge from each sdfRef to its target, and from each target to the sdfRefs in 
+  # its subtree, including one on the target itself. An sdfRef to one of its own ancestors is a cycle of one
+  def _referenceCycles(self, references, resolved):
+    sites = {} # node pointer of each sdfRef to its normalized target
+    for source, ref in references:
+      if source.endswith("/sdfRef") and normalizePointer(ref) in resolved:
+        sites[source[:-len("/sdfRef")]] = normalizePointer(ref)
+    sortedSites = sorted(sites)
+    below = {}
+    for target in set(sites.values()):
+      # the sites in the target's subtree are the target itself and a contiguous run of the sorted site pointers
+      first = bisect.bisect_left(sortedSites, target + "/")
+      last = bisect.bisect_left(sortedSites, target + "0") # "0" is the character after "/"
+      if target in sites or first < last:
+        below[target] = ( [ ("site", target) ] if target in sites else [] ) + [ ("site", site) for site in sortedSites[first:last] ]
+
+    # a target without sdfRefs below it ends the chain, so only sites with targets in below can be on a cycle
+    successors = {}
+    for site, target in sites.items():
+      if target in below:
+        successors[("site", site)] = [ ("target", target) ]
+        successors[("target", target)] = [ node for node in below[target] if sites[node[1]] in below ]
+
+    cycles = []
+    for component in stronglyConnectedComponents(list(successors), successors):
+      if len(component) > 1:
+        # walk the cycle from its first sdfRef, as "source -> target" steps
+        members = set(component)
+        site = min( site for kind, site in component if kind == "site" )
+        path = []
+        while site not in path:
+          path.append(site)
+          site = min( node for node in successors[("target", sites[site])] if node in members )[1]
+        cycles.append( [ site + "/sdfRef -> " + sites[site] for site in path[path.index(site):] ] )
+    return sorted(cycles)
+
+  def resolveReference(self, sdfPointer):
+    # resolve a local model pointer in this graph, or a reference to another namespace in the registry
+    pointer = normalizePointer(sdfPointer)
+    if pointer.startswith("/"):
+      return self.resolve(pointer)
+    return self._resolveNamespaceReference(pointer) # resolve curie
 
   def _resolveNamespaceReference(self, sdfPointer):
-    print("Namespace not supported: ", sdfPointer)
-    raise 
-    return # feature
+    if self._registry is None:
+      print("Namespace not supported: ", sdfPointer)
+      raise ValueError(sdfPointer)
+    return self._registry.resolve( sdfPointer, self.namespaces() )
+
+  def namespaces(self):
+    # prefix: namespace URI for the CURIE references in this model
+    return self.graph().get("namespace") or {}
 
   def errors(self):
     # collect pointer errors after the pointer check is done
@@ -147,11 +542,19 @@ class ModelGraph(Graph):
   # #define InputLowReference 27008
   # #define InputHighReference 27009
 
+    return "".join( self.resourceHeaderLines() )
+
+  def resourceHeaderLines(self):
+    # generate the resource-types.h fragment a line at a time
+    yield "// Resource Types generated by ObjectFlow Builder\n"
+    for name, typeID in self.resourceRows():
+      yield "#define %s %d\n" % (name, typeID)
+
+  def resourceRows(self):
+    # generate (name, TypeID) for each resource type
     resourceType = (self.resolve("/sdfData/TypeID/ResourceType"))
-    resourceHeaderCode = "// Resource Types generated by ObjectFlow Builder\n"
     for type in resourceType:
-      resourceHeaderCode += "#define %s %d\n" % (type, resourceType[type]["const"])
-    return resourceHeaderCode
+      yield (type, resourceType[type]["const"])
 
   def objectHeader(self):
     # return a C++ code fragment that creates new objects using application handler names 
@@ -169,23 +572,334 @@ class ModelGraph(Graph):
     #    };
     # FIXME implement a way to do this with a struct in a header, use a better template pattern
     # there should be separate source files for handlers
-    objectHeaderCode = """// Generated by ObjectFlow builder
+    return "".join( self.objectHeaderLines() )
+
+  def objectHeaderLines(self):
+    # generate the application-object.cpp fragment a line at a time
+    yield """// Generated by ObjectFlow builder
 // Select an application Object based on its typeID
 Object* ObjectList::applicationObject(uint16_t type, uint16_t instance, Object* firstObject) {
   switch (type) {\n"""
+    for objectTypeName, objectTypeID in self.objectRows():
+      yield "    case %d: return new %s(type, instance, firstObject);\n" % (objectTypeID, objectTypeName)
+    yield """    default: return new Object(type, instance, firstObject);
+  }
+};"""
+
+  def objectRows(self):
+    # generate (name, TypeID) for each application object type
     objectTypeList = self.resolve("/sdfData/TypeID/ObjectType")
     for objectTypeName in objectTypeList:
-      objectTypeID = objectTypeList[objectTypeName]["const"]
-      objectHeaderCode += "    case %d: return new %s(type, instance, firstObject);\n" % (objectTypeID, objectTypeName)
-    objectHeaderCode += """    default: return new Object(type, instance, firstObject);
+      yield (objectTypeName, objectTypeList[objectTypeName]["const"])
+
+  def objectDispatch(self):
+    # return a C++ code fragment that creates new objects by binary search of a table of object types sorted by
+    # TypeID, to include in handlers.cpp in place of application-object.cpp
+    #
+    # object-dispatch.cpp
+    #    const ObjectTypeEntry objectTypeTable[] = {
+    #      { 43000, newApplicationObject<TimeSource> },
+    #      { 43001, newApplicationObject<AnalogInput> },
+    #    ...
+    return "".join( self.objectDispatchLines() )
+
+  def objectDispatchLines(self):
+    # generate the object-dispatch.cpp fragment a line at a time
+    objectTypes = sorted( self.objectRows(), key=lambda row: row[1] )
+    for (name, typeID), (nextName, nextTypeID) in zip(objectTypes, objectTypes[1:]):
+      if typeID == nextTypeID:
+        print("Duplicate object TypeID:", typeID, name, nextName)
+        raise ValueError(typeID)
+    yield """// Generated by ObjectFlow builder
+// Object types sorted by TypeID
+template <class T> Object* newApplicationObject(uint16_t type, uint16_t instance, Object* firstObject) {
+  return new T(type, instance, firstObject);
+};
+
+struct ObjectTypeEntry {
+  uint16_t typeID;
+  Object* (*newObject)(uint16_t type, uint16_t instance, Object* firstObject);
+};
+
+const ObjectTypeEntry objectTypeTable[] = {\n"""
+    for objectTypeName, objectTypeID in objectTypes:
+      yield "  { %d, newApplicationObject<%s> },\n" % (objectTypeID, objectTypeName)
+    yield """};
+
+// Select an application Object based on its typeID
+Object* ObjectList::applicationObject(uint16_t type, uint16_t instance, Object* firstObject) {
+  unsigned int low = 0;
+  unsigned int high = sizeof(objectTypeTable) / sizeof(ObjectTypeEntry);
+  while (low < high) {
+    unsigned int middle = (low + high) / 2;
+    if (objectTypeTable[middle].typeID < type) {
+      low = middle + 1;
+    }
+    else {
+      high = middle;
+    }
+  };
+  if (low < sizeof(objectTypeTable) / sizeof(ObjectTypeEntry) && objectTypeTable[low].typeID == type) {
+    return objectTypeTable[low].newObject(type, instance, firstObject);
   }
+  return new Object(type, instance, firstObject);
 };"""
-    return objectHeaderCode
+
+
+# the SDF files of a model directory, in load order
+def modelFiles(modelPath):
+  return glob.glob( modelPath + "*.sdf.json" ) + glob.glob( modelPath + "*.sdf.yml" )
+
+# Model manifest
+# maps each definition in a model directory to the files that define it, and lists the model pointers each file
+# refers to, so that the files a flow needs can be found without merging the whole model library
+#
+# definitions are the named entries of the sdf sections, /sdfObject/TimeSource or /sdfData/ValueType, and the 
+# entries of the TypeID registry, /sdfData/TypeID/ObjectType/TimeSource. A pointer is defined by the files of 
+# its longest matching definition, all of them when several files merge into the same definition
+#
+# the entry for each file is kept in the build cache by file content, so only new and changed files are parsed
+MANIFEST_SECTIONS = [ "sdfObject", "sdfData", "sdfProperty", "sdfThing", "sdfAction", "sdfEvent" ]
+
+class ModelManifest():
+  def __init__(self, modelPath, cache=None, workers=1):
+    self._definitions = {} # definition pointer: [ files ]
+    self._references = {} # file: [ model pointers ]
+    files = readFiles( modelFiles(modelPath) )
+    entries = [ None ] * len(files)
+    if cache is not None:
+      keys = [ cache.contentKey( [ item ] ) for item in files ]
+      entries = [ cache.load("manifest", key) for key in keys ]
+    toParse = [ index for index, entry in enumerate(entries) if entry is None ]
+    for index, model in zip( toParse, parseFiles( [ files[index] for index in toParse ], workers ) ):
+      entries[index] = self._fileEntry(model)
+      if cache is not None:
+        cache.store("manifest", keys[index], entries[index])
+    for (file, text), entry in zip(files, entries):
+      for definition in entry["definitions"]:
+        self._definitions.setdefault(definition, []).append(file)
+      self._references[file] = entry["references"]
+
+  def _fileEntry(self, model):
+    definitions = []
+    for section in MANIFEST_SECTIONS:
+      for name in model.get(section) or {}:
+        definitions.append( "/" + section + "/" + escapePointerToken(name) )
+    typeIDs = (model.get("sdfData") or {}).get("TypeID") or {}
+    for kind in typeIDs:
+      for name in typeIDs[kind] or {}:
+        definitions.append( "/sdfData/TypeID/" + escapePointerToken(kind) + "/" + escapePointerToken(name) )
+    return { "definitions": definitions, "references": sorted(set( referencePointers(model) )) }
+
+  def definingFiles(self, pointer):
+    # the files of the longest definition that contains the pointer
+    tokens = pointer.split("/")
+    for length in range(len(tokens), 2, -1):
+      files = self._definitions.get( "/".join(tokens[:length]) )
+      if files is not None:
+        return files
+    return []
+
+  def filesFor(self, pointers):
+    # the files that define the pointers and everything they refer to, through their sdfRef chains
+    files = set()
+    seen = set()
+    toVisit = [ normalizePointer(pointer) for pointer in pointers ]
+    while toVisit:
+      pointer = toVisit.pop()
+      if pointer in seen:
+        continue
+      seen.add(pointer)
+      for file in self.definingFiles(pointer):
+        if file not in files:
+          files.add(file)
+          toVisit.extend(self._references[file])
+    return files
+
+# the local model pointers of the sdfRef and sdfRequired references in a JSON tree
+def referencePointers(tree):
+  stack = [ tree ]
+  while stack:
+    node = stack.pop()
+    if "sdfRef" in node and isinstance(node["sdfRef"], str):
+      yield normalizePointer(node["sdfRef"])
+    for ref in node.get("sdfRequired") or []:
+      if isinstance(ref, str):
+        yield normalizePointer(ref)
+    stack.extend( item for item in node.values() if isinstance(item, dict) )
+
+# the model pointers a flow spec needs: the object types, the value type binding for the emitters, the link type
+# for the topology, and any references in the flow spec itself
+def flowModelPointers(flowSpec):
+  pointers = [ "/sdfData/ValueTypeString", "/sdfData/TypeID/ResourceType/InputLink" ]
+  flowObjects = flowSpec.graph().get("Flow") or {}
+  for flowObject in flowObjects:
+    pointers.append( "/sdfObject/" + escapePointerToken( flowObjects[flowObject].get("$type", flowObject) ) )
+    pointers.extend( referencePointers(flowObjects[flowObject]) )
+  return pointers
+
+# load a model graph for building the flows in flowPaths
+# with lazy, only the model files reachable from the types the flows use are loaded, found with the manifest
+def loadModel(modelPath, flowPaths, cache=None, workers=1, lazy=False, registry=None):
+  if not lazy or os.path.isfile(modelPath):
+    return ModelGraph( modelPath, cache, workers, registry=registry )
+  with profiler.active.phase("model manifest"):
+    manifest = ModelManifest( modelPath, cache, workers )
+    pointers = []
+    for flowPath in flowPaths:
+      pointers.extend( flowModelPointers( loadFlowSpec(flowPath, workers) ) )
+    include = manifest.filesFor(pointers)
+  print ( "Loading", len(include), "of", len(modelFiles(modelPath)), "model files" )
+  return ModelGraph( modelPath, cache, workers, include, registry )
+
+# Namespace registry
+# a directory of model sets for other namespaces, one per subdirectory, for sdfRefs to definitions that are not in 
+# the local model. Each model set declares its namespace with namespace and defaultnamespace, like the local model
+#
+# a reference names its namespace with a CURIE prefix declared in the referring model, acme:#/sdfObject/Sensor, 
+# or directly with the namespace URI, https://example.com/acme#/sdfObject/Sensor. The model set of a namespace is 
+# built on the first reference to it, and is kept in the build cache by content like the local model, so it is 
+# merged and checked once. Nodes from other namespaces are returned with their own references qualified with 
+# their namespace URI, so that expanding them keeps resolving in the namespace they came from
+#
+class NamespaceRegistry():
+  def __init__(self, registryPath, cache=None, workers=1):
+    self._cache = cache
+    self._workers = workers
+    self._directories = {} # namespace URI: model directory
+    self._models = {} # namespace URI: ModelGraph, built on first reference
+    self._loading = set()
+    contentKeys = []
+    for name in sorted(os.listdir(registryPath)) if os.path.isdir(registryPath) else []:
+      directory = os.path.join(registryPath, name) + "/"
+      files = readFiles( modelFiles(directory) ) if os.path.isdir(directory) else []
+      if not files:
+        continue
+      uri = self._namespaceURI(directory, files)
+      if uri is None:
+        print("Registry model set without a default namespace:", directory)
+        continue
+      if uri in self._directories:
+        print("Namespace", uri, "is defined by both", self._directories[uri], "and", directory)
+        raise ValueError(uri)
+      self._directories[uri] = directory
+      contentKeys.append( [ uri, cache.contentKey(files) if cache is not None else None ] )
+    self._cacheKey = cache.key(contentKeys) if cache is not None else None
+
+  def _namespaceURI(self, directory, files):
+    # the URI of the default namespace of a model set, from the build cache or by parsing the files
+    if self._cache is not None:
+      key = self._cache.contentKey(files)
+      cached = self._cache.load("namespace", key)
+      if cached is not None:
+        return cached["uri"]
+    namespaces = {}
+    default = None
+    for model in parseFiles(files, self._workers):
+      namespaces.update( model.get("namespace") or {} )
+      default = model.get("defaultnamespace") or default
+    uri = namespaces.get(default)
+    if self._cache is not None and uri is not None:
+      self._cache.store("namespace", key, { "uri": uri })
+    return uri
+
+  def cacheKey(self):
+    # content key of all of the registry model sets, None without a build cache
+    return self._cacheKey
+
+  def namespaceURIs(self):
+    return sorted(self._directories)
+
+  def model(self, uri):
+    # the model graph of a namespace, built on the first reference
+    if uri not in self._models:
+      if uri not in self._directories:
+        print("Namespace not in the registry:", uri)
+        raise KeyError(uri)
+      if uri in self._loading:
+        print("Namespaces refer to each other while loading:", uri)
+        raise ValueError(uri)
+      self._loading.add(uri)
+      try:
+        model = ModelGraph( self._directories[uri], self._cache, self._workers, registry=self )
+      finally:
+        self._loading.discard(uri)
+      if model.errors() != 0:
+        print(model.errors(), "errors in the model of namespace", uri)
+        raise ValueError(uri)
+      self._models[uri] = model
+    return self._models[uri]
+
+  def resolve(self, reference, namespaces):
+    # resolve a CURIE or URI reference from a model with the namespaces prefix map, returning a copy of the node
+    # with its references qualified with its namespace URI
+    uri, pointer = splitReference(reference, namespaces)
+    model = self.model(uri)
+    return qualifyReferences( copyTree( model.resolve(pointer) ), uri, model.namespaces() )
+
+# split a reference to another namespace into the namespace URI and the pointer in that namespace
+# acme:#/sdfObject/Sensor and acme:/sdfObject/Sensor use a prefix from namespaces, a reference with :// in it
+# starts with the namespace URI
+def splitReference(reference, namespaces):
+  if "#" in reference:
+    namespace, pointer = reference.split("#", 1)
+  else:
+    namespace, pointer = reference.split(":", 1) if "://" not in reference else (reference, "")
+    namespace += ":"
+  if "://" in namespace:
+    return namespace, pointer
+  prefix = namespace[:-1] if namespace.endswith(":") else namespace
+  if prefix not in namespaces:
+    print("Namespace prefix not declared:", prefix)
+    raise KeyError(prefix)
+  return namespaces[prefix], pointer
+
+# qualify the references in a node from another namespace: local pointers get the namespace URI, and CURIEs get
+# the URI of their prefix in that namespace's model
+def qualifyReferences(node, uri, namespaces):
+  def qualified(reference):
+    pointer = normalizePointer(reference)
+    if pointer.startswith("/"):
+      return uri + "#" + pointer
+    if "://" in pointer.split("#", 1)[0]:
+      return pointer
+    return "%s#%s" % splitReference(pointer, namespaces)
+  stack = [ node ] if isinstance(node, dict) else []
+  while stack:
+    item = stack.pop()
+    if isinstance(item.get("sdfRef"), str):
+      item["sdfRef"] = qualified(item["sdfRef"])
+    if isinstance(item.get("sdfRequired"), list):
+      item["sdfRequired"] = [ qualified(ref) if isinstance(ref, str) else ref for ref in item["sdfRequired"] ]
+    stack.extend( value for value in item.values() if isinstance(value, dict) )
+  return node
+
+# the sdfRef of a flow object type: a local type name, or prefix:Name for a type from another namespace
+def typeReference(typeName):
+  if ":" in typeName:
+    prefix, name = typeName.split(":", 1)
+    return prefix + ":#/sdfObject/" + escapePointerToken(name)
+  return "/sdfObject/" + typeName
+
+# read and merge the flow spec files of a flow directory, or a single flow spec file
+def loadFlowSpec(flowPath, workers=1):
+  with profiler.active.phase("load flow spec"):
+    flowSpec = Graph()
+    if os.path.isfile(flowPath): # a single flow spec file
+      files = readFiles( [ flowPath ] )
+    else:
+      files = readFiles( glob.glob( flowPath + "*.flo.json" ) + glob.glob( flowPath + "*.flo.yml" ) )
+    for (file, text), spec in zip( files, parseFiles(files, workers) ):
+      print(file)
+      flowSpec.add( spec )
+  return flowSpec
 
 
 class FlowGraph(Graph):
-  def __init__(self, modelGraph, flowPath):
-    Graph.__init__(self, self._baseFlowTemplate())
+  def __init__(self, modelGraph, flowPath, cache=None, workers=1, interned=False):
+    # not indexed, the emitters resolve only the flow object map, and the ID and link passes replace the objects, so
+    # a pointer index of the flow graph would be rebuilt on every build and update for a few lookups
+    Graph.__init__(self, self._baseFlowTemplate(), interned=interned)
     # 
     # Flow Graph construction involves three graphs
     #
@@ -216,24 +930,47 @@ class FlowGraph(Graph):
     # When extracting values from the FLow Graph, it is necessary to override "default" values with "const" 
     # values, if "const" is defined
     #
+    # With interned=True the resolved flow objects are interned in a node store, so the sdfChoice blocks, flo:meta
+    # schemas and other subtrees that are the same in many objects and resources are held once. The ID and link 
+    # passes then copy the paths they change instead of changing the shared nodes
+    #
+    self._initResolver(modelGraph)
+
+    # resolved flow objects are cached by model content, object name, and flow spec entry
+    self._cache = cache
+    if modelGraph.cacheKey() is None:
+      self._cache = None
+
+    # with more than one worker, flow objects are expanded and configured in a process pool
+    self._workers = workers
+
+    self._flowSpec = self._loadFlowSpec(flowPath, workers) # for the JSON DSL spec, merge these also
+
+    with profiler.active.phase("resolve flow graph"):
+      self._resolveFlowGraph() 
+
+  # the state needed to resolve flow objects, also set up in the workers of a parallel build
+  def _initResolver(self, modelGraph):
     self._modelGraph = modelGraph
+    self._flowBasePath = "/sdfThing/Flow/sdfObject"
 
-    self._flowSpec = Graph() # for the JSON DSL spec, merge these also
+    # closure cache of fully expanded and refined model definitions, keyed by normalized pointer
+    # each sdfRef chain is expanded once and copies of the closure are handed out to each reference
+    self._closureCache = {}
+    self._closureStats = { "hits": 0, "misses": 0 }
 
-    for file in glob.glob( flowPath + "*.flo.json" ):
-      print(file)
-      self._flowSpec.add( json.loads( open(file,"r").read() ) )
-    for file in glob.glob( flowPath + "*.flo.yml" ):
-      print(file)
-      self._flowSpec.add( yaml.safe_load( open(file,"r").read() ) )
+    # model pointers each closure and each flow object was expanded from, to find the objects affected by a model change
+    self._closureDeps = {}
+    self._objectDeps = {}
+    self._depStack = []
 
-    self._resolveFlowGraph() 
+  def _loadFlowSpec(self, flowPath, workers=1):
+    return loadFlowSpec(flowPath, workers)
 
   def _resolveFlowGraph(self):
     # build a flow graph from the flow spec; resolve all required items and default values from the model graph
     #
     # the flow graph is initialized with the base template when created
-    self._flowBasePath = "/sdfThing/Flow/sdfObject"
     self._flowBase = self.resolve(self._flowBasePath)
     self._flowSpecBase = self._flowSpec.graph()["Flow"]
 
@@ -242,102 +979,246 @@ class FlowGraph(Graph):
     # if there is no Type specified in the flow, the object name will be used as type
 
     for flowObject in self._flowSpecBase:
-      self._flowBase[flowObject] = {}
       if not "$type" in self._flowSpecBase[flowObject]:
         self._flowSpecBase[flowObject]["$type"] = flowObject # use the name as type
-      self._flowBase[flowObject]["sdfRef"] = "/sdfObject/" + self._flowSpecBase[flowObject]["$type"]
-
-      # Expand-Merge the named objects in the flow graph from corresponding objects in the model graph
-      # Expands all of the Resources in the Model graph for each object, will not add resources that are not 
-      # defined for the object type.
-      #
-      print("Resolving ",flowObject)
-      # expand and merge all sdfRefs recursively
-      self._expandMergeAll(self._flowBase[flowObject])
- 
-      # Remove the unneeded resources and other noise from the flow template
-    
-      # transform the "required" array to resource names
-      # assumes "sdfRequired" appears in the context of Object definitions
-      self._flowBase[flowObject]["requiredResources"] = []
-      if "sdfRequired" in self._flowBase[flowObject]:
-        for path in self._flowBase[flowObject]["sdfRequired"]:
-          self._flowBase[flowObject]["requiredResources"].append( path.split("/")[-1] ) # last path segment is the resource name
-      # remove properties not required or specified in the flow object
-      toRemove = []
-      for resource in self._flowBase[flowObject]["sdfProperty"]:
-        if not resource in self._flowSpecBase[flowObject] and not resource in self._flowBase[flowObject]["requiredResources"]:
-          toRemove.append(resource)
-      for resource in toRemove:
-        self._flowBase[flowObject]["sdfProperty"].pop(resource, None)
-      #remove sdfAction and required lists
-      self._flowBase[flowObject].pop("sdfAction", None)
-      self._flowBase[flowObject].pop("sdfRequired", None)
-      self._flowBase[flowObject].pop("requiredResources", None)
-
-
-      # merge the predefined resource values from the flow spec resources to the graph resources 
-      # FIXME should use mergeRefine { const: <resource> } instead of assignment to overlay const on existing definition
-
-      for resource in self._flowBase[flowObject]["sdfProperty"]: # for each property in the sdf graph
-        if resource in self._flowSpecBase[flowObject]: # if there is matching resource in the flow spec
-          if isinstance(self._flowSpecBase[flowObject][resource], dict ): # merge in qualities verbatim from object value
-            self._flowBase[flowObject]["sdfProperty"][resource] = self._mergeRefine(
-              self._flowBase[flowObject]["sdfProperty"][resource], 
-              self._flowSpecBase[flowObject][resource]
-            )
-          # apply as constant value - array needs to be handled when we add multi-instance support
-          elif "IntegerType" in self._flowBase[flowObject]["sdfProperty"][resource]["sdfChoice"]:
-            self._flowBase[flowObject]["sdfProperty"][resource]["sdfChoice"]["IntegerType"]["const"] = self._flowSpecBase[flowObject][resource]
-          elif "FloatType" in self._flowBase[flowObject]["sdfProperty"][resource]["sdfChoice"]:
-            self._flowBase[flowObject]["sdfProperty"][resource]["sdfChoice"]["FloatType"]["const"] = self._flowSpecBase[flowObject][resource]
-          elif "StringType" in self._flowBase[flowObject]["sdfProperty"][resource]["sdfChoice"]:
-            self._flowBase[flowObject]["sdfProperty"][resource]["sdfChoice"]["StringType"]["const"] = self._flowSpecBase[flowObject][resource]
-          elif "BooleanType" in self._flowBase[flowObject]["sdfProperty"][resource]["sdfChoice"]:
-            self._flowBase[flowObject]["sdfProperty"][resource]["sdfChoice"]["BooleanType"]["const"] = self._flowSpecBase[flowObject][resource]
-          elif "TimeType" in self._flowBase[flowObject]["sdfProperty"][resource]["sdfChoice"]:
-            self._flowBase[flowObject]["sdfProperty"][resource]["sdfChoice"]["TimeType"]["const"] = self._flowSpecBase[flowObject][resource]
-          elif "InstanceLinkType" in self._flowBase[flowObject]["sdfProperty"][resource]["sdfChoice"]:
-            self._flowBase[flowObject]["sdfProperty"][resource]["flo:meta"]["InstanceGraphLink"]["properties"]["InstancePointer"] = { "const": self._flowBasePath + "/" + self._flowSpecBase[flowObject][resource] }
-          else:
-            print("non conforming value type for flow Object:", flowObject, ", Resource:", resource, ", Value:", self._flowSpecBase[flowObject][resource])
+    self._flowBase.update( self._resolveFlowObjects( list(self._flowSpecBase) ) )
+
+    self._linkFlowGraph()
+
+    # fini
+
+  def _linkFlowGraph(self):
+    with profiler.active.phase("assign IDs"):
+      self._assignInstanceIDs()
+    with profiler.active.phase("flow topology"):
+      self._buildTopology()
+    with profiler.active.phase("resolve links"):
+      self._resolveObjectLinks()
+
+    if self._store is not None:
+      with profiler.active.phase("intern"):
+        for flowObject in self._flowBase:
+          self._flowBase[flowObject] = self._intern(self._flowBase[flowObject])
+
+  # update the resolved flow graph after the model or the flow spec changed, for the resident builder
+  # only flow objects that are new, have a changed flow spec entry, or were expanded from a changed model
+  # definition are resolved again, then IDs and links are reassigned for the whole flow.
+  # Returns the names of the flow objects that were resolved again or removed
+  def update(self, modelGraph=None, changedPointers=[], flowPath=None):
+    affected = set()
+    if modelGraph is not None:
+      self._modelGraph = modelGraph
+      if modelGraph.cacheKey() is None:
+        self._cache = None
+      for key in [ key for key in self._closureCache if any( pointerAffected(dep, changedPointers) for dep in self._closureDeps[key] ) ]:
+        self._closureCache.pop(key)
+        self._closureDeps.pop(key)
+      for flowObject in self._objectDeps:
+        if any( pointerAffected(dep, changedPointers) for dep in self._objectDeps[flowObject] ):
+          affected.add(flowObject)
+
+    oldSpecBase = self._flowSpecBase
+    if flowPath is not None:
+      self._flowSpec = self._loadFlowSpec(flowPath, self._workers)
+      self._flowSpecBase = self._flowSpec.graph()["Flow"]
+      for flowObject in self._flowSpecBase:
+        if not "$type" in self._flowSpecBase[flowObject]:
+          self._flowSpecBase[flowObject]["$type"] = flowObject # use the name as type
+        if flowObject not in oldSpecBase or oldSpecBase[flowObject] != self._flowSpecBase[flowObject]:
+          affected.add(flowObject)
+      for flowObject in oldSpecBase:
+        if flowObject not in self._flowSpecBase:
+          affected.add(flowObject)
+          self._objectDeps.pop(flowObject, None)
+
+    # rebuild the flow object map in flow spec order, keeping the objects that are not affected
+    resolved = dict(self._flowBase)
+    resolved.update( self._resolveFlowObjects( [ flowObject for flowObject in self._flowSpecBase if flowObject in affected or flowObject not in resolved ] ) )
+    self._flowBase.clear()
+    for flowObject in self._flowSpecBase:
+      self._flowBase[flowObject] = resolved[flowObject]
+
+    self._linkFlowGraph()
+    if self._store is not None:
+      self._store.retain( self._flowBase.values() ) # let the replaced versions of the flow objects go
+    return affected
 
+  def _assignInstanceIDs(self):
     # assign instance IDs starting at 0, over-write any existing defaults or const 
     # FIXME allow for pre-defined instance numbers
 
     instanceCount = {}
     for flowObject in self._flowBase:
-      omaType = self._flowBase[flowObject]["oma:id"]["const"]
+      flowNode = self._flowBase[flowObject]
+      omaType = flowNode["oma:id"]["const"]
       if omaType not in instanceCount:
         instanceCount[omaType] = 0
       else:
         instanceCount[omaType] += 1
-      if "flo:meta" not in self._flowBase[flowObject]:
-        self._flowBase[flowObject]["flo:meta"] = {}
-      self._flowBase[flowObject]["flo:meta"]["TypeID"] = { "const": omaType }
-      self._flowBase[flowObject]["flo:meta"]["InstanceID"] = { "const": instanceCount[omaType] }
-      # now do the resources
-      instanceCount = {}
-      for resource in self._flowBase[flowObject]["sdfProperty"]:
-        omaType = self._flowBase[flowObject]["sdfProperty"][resource]["oma:id"]["const"]
-        if omaType not in instanceCount:
-          instanceCount[omaType] = 0
+      assignments = [ 
+        ( ("flo:meta", "TypeID"), { "const": omaType } ),
+        ( ("flo:meta", "InstanceID"), { "const": instanceCount[omaType] } ) ]
+      # now do the resources, counted per object, the object counts go on across the flow objects
+      resourceCount = {}
+      for resource in flowNode["sdfProperty"]:
+        omaType = flowNode["sdfProperty"][resource]["oma:id"]["const"]
+        if omaType not in resourceCount:
+          resourceCount[omaType] = 0
         else:
-          instanceCount[omaType] += 1
-        self._flowBase[flowObject]["sdfProperty"][resource]["flo:meta"]["TypeID"] = { "const": omaType }
-        self._flowBase[flowObject]["sdfProperty"][resource]["flo:meta"]["InstanceID"] = { "const": instanceCount[omaType] }
-
-    #   resolve oma objlinks from sdf object links
-
-    for flowObject in self._flowBase:
-      for resource in self._flowBase[flowObject]["sdfProperty"]:
-        if "InstanceGraphLink" in self._flowBase[flowObject]["sdfProperty"][resource]["flo:meta"]:
-          objectPointer = self._flowBase[flowObject]["sdfProperty"][resource]["flo:meta"]["InstanceGraphLink"]["properties"]["InstancePointer"]["const"]
-          targetObject = self.resolve(objectPointer) # this is the flow graph (self) resolve
-          self._flowBase[flowObject]["sdfProperty"][resource]["sdfChoice"]["InstanceLinkType"]["properties"]["TypeID"] = targetObject["flo:meta"]["TypeID"]
-          self._flowBase[flowObject]["sdfProperty"][resource]["sdfChoice"]["InstanceLinkType"]["properties"]["InstanceID"] = targetObject["flo:meta"]["InstanceID"]
-
-    # fini
+          resourceCount[omaType] += 1
+        assignments.append( ( ("sdfProperty", resource, "flo:meta", "TypeID"), { "const": omaType } ) )
+        assignments.append( ( ("sdfProperty", resource, "flo:meta", "InstanceID"), { "const": resourceCount[omaType] } ) )
+      self._flowBase[flowObject] = self._assignPaths(flowNode, assignments)
+
+  def _buildTopology(self):
+    # index the links between the flow objects, and check for links to objects that aren't in the flow
+    inputLinkTypeID = self._modelGraph.resolve("/sdfData/TypeID/ResourceType/InputLink")["const"]
+    self._topology = FlowTopology(self._flowBase, self._flowBasePath, inputLinkTypeID)
+    dangling = self._topology.danglingLinks()
+    for flowObject, resource, pointer in dangling:
+      print("Link doesn't resolve to a flow object:", flowObject, resource, "->", pointer)
+    if dangling:
+      raise ValueError("%d dangling links in the flow" % len(dangling))
+    for cycle in self._topology.cycles():
+      print("Link cycle:", " -> ".join(cycle))
+
+  def _resolveObjectLinks(self):
+    #   resolve oma objlinks from sdf object links, the targets were found when the topology was built
+
+    assignments = {}
+    for flowObject, resource, target in self._topology.links():
+      targetObject = self._flowBase[target]
+      properties = ("sdfProperty", resource, "sdfChoice", "InstanceLinkType", "properties")
+      assignments.setdefault(flowObject, []).extend( [
+        ( properties + ("TypeID",), targetObject["flo:meta"]["TypeID"] ),
+        ( properties + ("InstanceID",), targetObject["flo:meta"]["InstanceID"] ) ] )
+    for flowObject in assignments:
+      self._flowBase[flowObject] = self._assignPaths(self._flowBase[flowObject], assignments[flowObject])
+
+  # resolve a list of flow objects from the flow spec, returning a map of object name to resolved object in list order
+  # objects that were resolved before are taken from the build cache. The resolved object only depends on the model 
+  # and the object's own entry in the flow spec, so the rest can be resolved independently in a process pool
+  def _resolveFlowObjects(self, flowObjects):
+    resolved = {}
+    for flowObject in flowObjects:
+      resolved[flowObject] = self._loadFlowObject(flowObject)
+    toResolve = [ flowObject for flowObject in flowObjects if resolved[flowObject] is None ]
+
+    if self._workers > 1 and len(toResolve) > 1:
+      # the phases within each object are not recorded in the worker processes
+      with profiler.active.phase("resolve objects in parallel", objects=len(toResolve)):
+        results = self._resolveParallel(toResolve)
+      for flowObject, flowNode, deps, hits, misses in results:
+        resolved[flowObject] = flowNode
+        self._objectDeps[flowObject] = set(deps)
+        self._closureStats["hits"] += hits
+        self._closureStats["misses"] += misses
+    else:
+      for flowObject in toResolve:
+        resolved[flowObject] = self._trackedFlowObject(flowObject)
+
+    for flowObject in toResolve:
+      self._storeFlowObject(flowObject, resolved[flowObject])
+    if self._store is not None:
+      for flowObject in resolved:
+        resolved[flowObject] = self._intern(resolved[flowObject])
+    return resolved
+
+  def _resolveParallel(self, flowObjects):
+    chunksize = max(1, len(flowObjects) // (self._workers * 4))
+    with concurrent.futures.ProcessPoolExecutor( max_workers=self._workers, mp_context=_processContext(), 
+        initializer=_initResolveWorker, initargs=(self._modelGraph, self._flowSpecBase) ) as executor:
+      return list( executor.map(_resolveWorkerObject, flowObjects, chunksize=chunksize) )
+
+  def _flowObjectKey(self, flowObject):
+    return self._cache.key(self._modelGraph.cacheKey(), self._flowBasePath, flowObject, self._flowSpecBase[flowObject])
+
+  def _loadFlowObject(self, flowObject):
+    # return the resolved object from the build cache, or None
+    if self._cache is None:
+      return None
+    cached = self._cache.load("object", self._flowObjectKey(flowObject))
+    if cached is None:
+      return None
+    self._objectDeps[flowObject] = set(cached["deps"])
+    return cached["object"]
+
+  def _storeFlowObject(self, flowObject, flowNode):
+    if self._cache is not None:
+      self._cache.store("object", self._flowObjectKey(flowObject), { "object": flowNode, "deps": sorted(self._objectDeps[flowObject]) })
+
+  # resolve a flow object and record the model pointers it was expanded from
+  def _trackedFlowObject(self, flowObject):
+    self._depStack = [ set() ]
+    flowNode = self._resolveFlowObject(flowObject)
+    self._objectDeps[flowObject] = self._depStack.pop()
+    return flowNode
+
+  # add a named sdfObject with an sdfRef to the application object type, expand it, and configure it from the flow spec
+  def _resolveFlowObject(self, flowObject):
+    flowNode = { "sdfRef": typeReference( self._flowSpecBase[flowObject]["$type"] ) }
+
+    # Expand-Merge the named objects in the flow graph from corresponding objects in the model graph
+    # Expands all of the Resources in the Model graph for each object, will not add resources that are not 
+    # defined for the object type.
+    #
+    print("Resolving ",flowObject)
+    # expand and merge all sdfRefs recursively
+    with profiler.active.phase("expand", object=flowObject):
+      self._expandMergeAll(flowNode)
+    with profiler.active.phase("prune", object=flowObject):
+      self._pruneResources(flowObject, flowNode)
+    with profiler.active.phase("apply constants", object=flowObject):
+      self._applyFlowSpecValues(flowObject, flowNode)
+    return flowNode
+
+  def _pruneResources(self, flowObject, flowNode):
+    # Remove the unneeded resources and other noise from the flow template
+  
+    # transform the "required" array to resource names
+    # assumes "sdfRequired" appears in the context of Object definitions
+    flowNode["requiredResources"] = []
+    if "sdfRequired" in flowNode:
+      for path in flowNode["sdfRequired"]:
+        flowNode["requiredResources"].append( path.split("/")[-1] ) # last path segment is the resource name
+    # remove properties not required or specified in the flow object
+    toRemove = []
+    for resource in flowNode["sdfProperty"]:
+      if not resource in self._flowSpecBase[flowObject] and not resource in flowNode["requiredResources"]:
+        toRemove.append(resource)
+    for resource in toRemove:
+      flowNode["sdfProperty"].pop(resource, None)
+    #remove sdfAction and required lists
+    flowNode.pop("sdfAction", None)
+    flowNode.pop("sdfRequired", None)
+    flowNode.pop("requiredResources", None)
+
+  def _applyFlowSpecValues(self, flowObject, flowNode):
+    # merge the predefined resource values from the flow spec resources to the graph resources 
+    # FIXME should use mergeRefine { const: <resource> } instead of assignment to overlay const on existing definition
+
+    for resource in flowNode["sdfProperty"]: # for each property in the sdf graph
+      if resource in self._flowSpecBase[flowObject]: # if there is matching resource in the flow spec
+        if isinstance(self._flowSpecBase[flowObject][resource], dict ): # merge in qualities verbatim from object value
+          flowNode["sdfProperty"][resource] = self._mergeRefine(
+            flowNode["sdfProperty"][resource], 
+            self._flowSpecBase[flowObject][resource]
+          )
+        # apply as constant value - array needs to be handled when we add multi-instance support
+        elif "IntegerType" in flowNode["sdfProperty"][resource]["sdfChoice"]:
+          flowNode["sdfProperty"][resource]["sdfChoice"]["IntegerType"]["const"] = self._flowSpecBase[flowObject][resource]
+        elif "FloatType" in flowNode["sdfProperty"][resource]["sdfChoice"]:
+          flowNode["sdfProperty"][resource]["sdfChoice"]["FloatType"]["const"] = self._flowSpecBase[flowObject][resource]
+        elif "StringType" in flowNode["sdfProperty"][resource]["sdfChoice"]:
+          flowNode["sdfProperty"][resource]["sdfChoice"]["StringType"]["const"] = self._flowSpecBase[flowObject][resource]
+        elif "BooleanType" in flowNode["sdfProperty"][resource]["sdfChoice"]:
+          flowNode["sdfProperty"][resource]["sdfChoice"]["BooleanType"]["const"] = self._flowSpecBase[flowObject][resource]
+        elif "TimeType" in flowNode["sdfProperty"][resource]["sdfChoice"]:
+          flowNode["sdfProperty"][resource]["sdfChoice"]["TimeType"]["const"] = self._flowSpecBase[flowObject][resource]
+        elif "InstanceLinkType" in flowNode["sdfProperty"][resource]["sdfChoice"]:
+          flowNode["sdfProperty"][resource]["flo:meta"]["InstanceGraphLink"]["properties"]["InstancePointer"] = { "const": self._flowBasePath + "/" + self._flowSpecBase[flowObject][resource] }
+        else:
+          print("non conforming value type for flow Object:", flowObject, ", Resource:", resource, ", Value:", self._flowSpecBase[flowObject][resource])
 
   # recursive expand-refine all dictionary nodes
   def _expandMergeAll(self, value): 
@@ -355,49 +1236,41 @@ class FlowGraph(Graph):
       value["sdfRefFrom"] = [ref] # this will result in set merge of sdfRef strings for breadcrumbs
        # expand all the way down the chain, making deep copies to merge into
        # then mergeRefine in reverse order on the nested closure and return the fully resolved object
-      refined = self._mergeRefine(self._expandReference(copy.deepcopy(self._resolveModel(ref))), value)
+      refined = self._mergeRefine(self._expandClosure(ref), value)
       return refined
     return value
 
+  # return a private copy of the fully expanded closure of a model reference
+  # the closure is built on the first reference to a pointer and copied from the cache after that
+  def _expandClosure(self, ref):
+    key = normalizePointer(ref)
+    if key in self._closureCache:
+      self._closureStats["hits"] += 1
+    else:
+      self._closureStats["misses"] += 1
+      self._depStack.append( { key } )
+      profiler.active.count("copyTree")
+      self._closureCache[key] = self._expandReference(copyTree(self._resolveModel(ref)))
+      self._closureDeps[key] = self._depStack.pop()
+    if self._depStack:
+      self._depStack[-1] |= self._closureDeps[key]
+    profiler.active.count("copyTree")
+    return copyTree(self._closureCache[key])
+
+  def closureCacheStats(self):
+    # hit and miss counts for sdfRef closure expansion, for diagnostics
+    return { "hits": self._closureStats["hits"], "misses": self._closureStats["misses"], "entries": len(self._closureCache) }
+
   # special refine merge that handles array set merge and sdfChoice refinement. sdfChoice is refined by replacing
   # the entire sdfChoice with the patch value. If extension is desired, an sdfRef to the base sdfChoice contents
   # should be included in the patch. Descriptions are also filtered out as they are encountered, to reduce noise 
   #
   def _mergeRefine(self, base, patch):
-    if not isinstance(base, dict):
-      base = {}
-    if not isinstance( patch, dict):
-      return patch
-    for key, patchItem in patch.items():
-      if isinstance(patchItem, dict): # merge dict into base
-        baseValue = base.get(key) # key error safe this way
-        if isinstance(baseValue, dict): # see if there is also a dict in the base
-          if "sdfChoice" == key: # if the item is sdfChoice, refine by copying into an empty dict
-            base[key] = {} 
-          base[key] = self._mergeRefine(base[key], patchItem) # if both are dicts, merge the item into the base
-          continue
-        base[key] = {} # if there isn't a dict there, or if it is sdfChoice, make a new empty node merge dict into it
-        self._mergeRefine(base[key], patchItem) # merge new item or sdfChoice into empty dict
-        continue
-      if isinstance(patchItem, list):      
-        baseValue = base.get(key) # key error safe this way
-        if isinstance(baseValue, list): # see if there is a matching list
-          base[key] = list(set(baseValue + patchItem)) # merge lists with unique values
-          continue
-      if None is patchItem: # if the patch contains None, remove the matching node in the base
-        base.pop(key, None)
-        continue
-      if "description" != key: # filter out descriptions from resolved models used in the builder
-        base[key] = patchItem # replace empty or plain value with value from the patch
-    return base
+    return mergePatch(base, patch, refine=True)
 
   # Model graph resolve
   def _resolveModel(self, sdfPointer):
-    self._pointer = sdfPointer
-    if self._pointer.startswith("/#"):
-      self._pointer = self._pointer[2:]
-    elif self._pointer.startswith("#"):
-      self._pointer = self._pointer[1:]
+    self._pointer = normalizePointer(sdfPointer)
     if self._pointer.startswith("/"):
       try:
         target = self._modelGraph.resolve(self._pointer)
@@ -409,13 +1282,15 @@ class FlowGraph(Graph):
       return(self._resolveNamespaceReference(self._pointer)) # resolve curie
 
   def _resolveNamespaceReference(self, sdfPointer):
-    print("Namespace not supported: ", sdfPointer)
-    raise
-    return # namespace feature
+    return self._modelGraph.resolveReference(sdfPointer) # the model graph knows the namespaces and the registry
 
   def flowGraph(self):
     return self.graph()
 
+  def topology(self):
+    # the FlowTopology of the object links
+    return self._topology
+
   def flowSpecUML(self):
     umlString = "@startuml\n"
     for flowObject in self._flowSpecBase:
@@ -452,12 +1327,31 @@ class FlowGraph(Graph):
   # }
   # '''
   def objectFlowHeader(self):
-    return self._header( self.resolve("/sdfThing/Flow/sdfObject") ) 
+    return "".join( self.objectFlowHeaderLines() )
 
-  def _header(self, Flow):
+  def objectFlowHeaderLines(self, topoOrder=False, lookupTables=False):
+    # generate the instances.h contents a line at a time, including lookup-tables.h when it is generated too
+    return self._headerLines( self._flowObjects(topoOrder), lookupTables )
 
-    headerString = "// Generated by ObjectFlow builder\nnamespace ObjectFlow\n{\n  const InstanceTemplate instanceList[] = {\n"
+  # objectFlowRows()
+  # generate one row per resource of the resolved flow, in instanceList order, for other consumers of the
+  # instance table. Each row is a dict with the InstanceTemplate fields, objectTypeID, objectInstanceID, 
+  # resourceTypeID, resourceInstanceID, valueType (the model type name, e.g. FloatType) and value, plus the 
+  # objectName and resourceName in the flow. InstanceLinkType values are [TypeID, InstanceID]
+  #
+  # the instance list is in flow spec order, or with topoOrder in the topological order of the links so that 
+  # each object comes after the objects it takes values from, and the device builds link targets first
+  #
+  def objectFlowRows(self, topoOrder=False):
+    return self._rows( self._flowObjects(topoOrder) )
+
+  def _flowObjects(self, topoOrder=False):
+    Flow = self.resolve("/sdfThing/Flow/sdfObject")
+    if not topoOrder:
+      return Flow
+    return { flowObject: Flow[flowObject] for flowObject in self._topology.order() }
 
+  def _rows(self, Flow):
     for flowObject in Flow:
       oid = Flow[flowObject]["flo:meta"]["TypeID"]["const"]
       oinst = Flow[flowObject]["flo:meta"]["InstanceID"]["const"]
@@ -478,27 +1372,222 @@ class FlowGraph(Graph):
         else: 
           value = Flow[flowObject]["sdfProperty"][resource]["sdfChoice"][rtype]
 
-        if rtype == "BooleanType":
-          valueString = "%d" % value
-        elif rtype == "IntegerType":
-          valueString = "%d" % value
-        elif rtype == "FloatType":
-          valueString = "%f" % value
-        elif rtype == "StringType":
-          valueString = "%s" % value
-        elif rtype == "TimeType":
-          valueString = "%d" % value
-        elif rtype == "InstanceLinkType":
-          valueString = "{%d,%d}" % (value["properties"]["TypeID"]["const"], value["properties"]["InstanceID"]["const"])
-        else:
-          print("Unimplemented resource type:", rtype)
-          raise
+        if rtype == "InstanceLinkType":
+          value = [ value["properties"]["TypeID"]["const"], value["properties"]["InstanceID"]["const"] ]
+
+        yield {
+          "objectName": flowObject,
+          "resourceName": resource,
+          "objectTypeID": oid,
+          "objectInstanceID": oinst,
+          "resourceTypeID": rid,
+          "resourceInstanceID": rinst,
+          "valueType": rtype,
+          "value": value
+        }
+
+  def _headerLines(self, Flow, lookupTables=False):
+
+    yield "// Generated by ObjectFlow builder\n"
+    if lookupTables:
+      yield "#include \"lookup-tables.h\"\n"
+    yield "namespace ObjectFlow\n{\n  const InstanceTemplate instanceList[] = {\n"
+
+    for row in self._rows(Flow):
+      rtype = row["valueType"]
+      value = row["value"]
+      if rtype == "BooleanType":
+        valueString = "%d" % value
+      elif rtype == "IntegerType":
+        valueString = "%d" % value
+      elif rtype == "FloatType":
+        valueString = "%f" % value
+      elif rtype == "StringType":
+        valueString = "%s" % value
+      elif rtype == "TimeType":
+        valueString = "%d" % value
+      elif rtype == "InstanceLinkType":
+        valueString = "{%d,%d}" % (value[0], value[1])
+      else:
+        print("Unimplemented resource type:", rtype)
+        raise
+
+      headerType = self._headerType(rtype)
+      yield "    { %d, %d, %d, %d, %s, (AnyValueType){.%s = %s } },\n" % (
+        row["objectTypeID"], row["objectInstanceID"], row["resourceTypeID"], row["resourceInstanceID"], headerType, headerType, valueString ) 
 
-        headerString += "    { %d, %d, %d, %d, %s, (AnyValueType){.%s = " % (oid, oinst, rid, rinst, self._headerType(rtype), self._headerType(rtype) ) 
-        headerString += valueString + " } },\n"
+    yield "  };\n}"
 
-    headerString +=   "  };\n}"
-    return headerString
+  def objectFlowImage(self, abi, topoOrder=False):
+    # the instance list packed as a binary image for a target ABI, see instanceimage.py
+    return instanceimage.packInstanceImage( self.objectFlowRows(topoOrder), abi, self._headerType )
+
+  # objectFlowCompactHeader()
+  # instances.h with the compact tables of memorybudget.py in place of instanceList, for ObjectList::buildInstances 
+  # built with OBJECTFLOW_COMPACT_INSTANCES, which the header defines
+  #
+  #   const int integerValues[] PROGMEM = { 0, 7 };
+  #   ...
+  #   const InstanceResource instanceResources[] PROGMEM = {
+  #     { 27005, 0, 0, linkType },
+  #   ...
+  #   const InstanceObject instanceObjects[] PROGMEM = {
+  #     { 43000, 0, 0, 5 },
+  #
+  def objectFlowCompactHeader(self):
+    return "".join( self.objectFlowCompactHeaderLines() )
+
+  def objectFlowCompactHeaderLines(self, topoOrder=False, lookupTables=False):
+    # generate the compact instances.h contents a line at a time
+    tables = memorybudget.compactTables( self.objectFlowRows(topoOrder), self._headerType )
+    yield "// Generated by ObjectFlow builder\n#define OBJECTFLOW_COMPACT_INSTANCES\n"
+    if lookupTables:
+      yield "#include \"lookup-tables.h\"\n"
+    yield "namespace ObjectFlow\n{\n"
+
+    # value arrays, with a placeholder for an unused type since C++ has no empty arrays
+    for index, text in enumerate(tables["values"]["stringType"]):
+      yield "  const char stringValue%d[] PROGMEM = %s;\n" % (index, self._cString(text))
+    arrays = [ ("booleanType", "bool", "booleanValues", lambda value: "%d" % value),
+      ("integerType", "int", "integerValues", lambda value: "%d" % value),
+      ("floatType", "double", "floatValues", lambda value: "%f" % value),
+      ("stringType", "char* const", "stringValues", None),
+      ("linkType", "InstanceLink", "linkValues", lambda value: "{%d,%d}" % (value[0], value[1])),
+      ("timeType", "time_t", "timeValues", lambda value: "%d" % value) ]
+    for valueType, cType, arrayName, valueString in arrays:
+      values = tables["values"][valueType]
+      if valueType == "stringType":
+        valueStrings = [ "stringValue%d" % index for index in range(len(values)) ]
+      else:
+        valueStrings = [ valueString(value) for value in values ]
+      yield "  const %s %s[] PROGMEM = { %s };\n" % (cType, arrayName, ", ".join(valueStrings) if valueStrings else "0" )
+
+    yield "  const InstanceResource instanceResources[] PROGMEM = {\n"
+    for resourceTypeID, resourceInstanceID, valueType, valueIndex in tables["resources"]:
+      yield "    { %d, %d, %d, %s },\n" % (resourceTypeID, resourceInstanceID, valueIndex, valueType)
+    yield "  };\n"
+
+    yield "  const InstanceObject instanceObjects[] PROGMEM = {\n"
+    for objectTypeID, objectInstanceID, firstResource, resourceCount in tables["objects"]:
+      yield "    { %d, %d, %d, %d },\n" % (objectTypeID, objectInstanceID, firstResource, resourceCount)
+    yield "  };\n}"
+
+  def _cString(self, text):
+    # a C string literal
+    escaped = str(text).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+    return '"%s"' % escaped
+
+  # objectLookupHeader()
+  # lookup-tables.h, perfect hash tables of the objects and resources in the instance list, see lookuptables.py,
+  # with objectIndexByID(type, instance) returning the object index and resourceIndexByID(objectIndex, type,
+  # instance) returning the resource index, or -1 for IDs that aren't in the flow. instances.h includes it when the
+  # tables are generated, and objectflow.cpp then fills objectTable and resourceTable in buildInstances and looks
+  # objects and resources up through the tables
+  #
+  def objectLookupHeader(self):
+    return "".join( self.objectLookupLines() )
+
+  def objectLookupLines(self, topoOrder=False):
+    # generate the lookup-tables.h contents a line at a time
+    tables = lookuptables.instanceLookupTables( self.objectFlowRows(topoOrder) )
+    objectDisplacements, objectSlots = tables["objectHash"]
+    resourceDisplacements, resourceSlots = tables["resourceHash"]
+
+    yield """// Generated by ObjectFlow builder
+#ifndef OBJECTFLOW_LOOKUP_TABLES
+#define OBJECTFLOW_LOOKUP_TABLES
+namespace ObjectFlow
+{
+  struct ObjectLookup {
+    uint16_t typeID;
+    uint16_t instanceID;
+    uint16_t index; // %d for an empty slot
+  };
+
+  struct ResourceLookup {
+    uint16_t objectIndex;
+    uint16_t typeID;
+    uint16_t instanceID;
+    uint16_t index; // %d for an empty slot
+  };
+
+  // sizes of the Object and Resource pointer tables, in instance list order
+  const uint16_t lookupObjectCount = %d;
+  const uint16_t lookupResourceCount = %d;
+
+  inline uint32_t lookupMix(uint32_t x) {
+    x *= 0x%Xu;
+    return x ^ (x >> 15);
+  };
+
+  inline uint32_t lookupHash(uint16_t a, uint16_t b, uint32_t seed) {
+    return lookupMix(lookupMix(seed ^ a) ^ b);
+  };
+
+  inline uint32_t lookupHash(uint16_t a, uint16_t b, uint16_t c, uint32_t seed) {
+    return lookupMix(lookupHash(a, b, seed) ^ c);
+  };
+\n""" % (lookuptables.EMPTY_SLOT, lookuptables.EMPTY_SLOT, len(tables["objects"]), len(tables["resources"]),
+      lookuptables.MIX_MULTIPLIER)
+
+    yield "  const uint16_t objectDisplacements[] = { %s };\n" % ", ".join( "%d" % value for value in objectDisplacements )
+    yield "  const ObjectLookup objectLookup[] = {\n"
+    for slot in objectSlots:
+      if slot is None:
+        yield "    { 0, 0, %d },\n" % lookuptables.EMPTY_SLOT
+      else:
+        objectTypeID, objectInstanceID = tables["objects"][slot][:2]
+        yield "    { %d, %d, %d },\n" % (objectTypeID, objectInstanceID, slot)
+    yield "  };\n"
+
+    yield "  const uint16_t resourceDisplacements[] = { %s };\n" % ", ".join( "%d" % value for value in resourceDisplacements )
+    yield "  const ResourceLookup resourceLookup[] = {\n"
+    for slot in resourceSlots:
+      if slot is None:
+        yield "    { 0, 0, 0, %d },\n" % lookuptables.EMPTY_SLOT
+      else:
+        objectIndex, resourceTypeID, resourceInstanceID = tables["resources"][slot][:3]
+        yield "    { %d, %d, %d, %d },\n" % (objectIndex, resourceTypeID, resourceInstanceID, slot)
+    yield "  };\n"
+
+    yield """
+  // the index of an object in the instance list, -1 if it isn't in the flow
+  inline int objectIndexByID(uint16_t type, uint16_t instance) {
+    uint32_t bucket = lookupHash(type, instance, 0) %% %d;
+    const ObjectLookup* entry = &objectLookup[lookupHash(type, instance, objectDisplacements[bucket]) %% %d];
+    if (entry -> index == %d || entry -> typeID != type || entry -> instanceID != instance) {
+      return -1;
+    }
+    return entry -> index;
+  };
+
+  // the index of a resource in the instance list, -1 if it isn't in the object
+  inline int resourceIndexByID(uint16_t objectIndex, uint16_t type, uint16_t instance) {
+    uint32_t bucket = lookupHash(objectIndex, type, instance, 0) %% %d;
+    const ResourceLookup* entry = &resourceLookup[lookupHash(objectIndex, type, instance, resourceDisplacements[bucket]) %% %d];
+    if (entry -> index == %d || entry -> objectIndex != objectIndex || entry -> typeID != type || entry -> instanceID != instance) {
+      return -1;
+    }
+    return entry -> index;
+  };
+}
+#endif
+""" % (len(objectDisplacements), len(objectSlots), lookuptables.EMPTY_SLOT,
+      len(resourceDisplacements), len(resourceSlots), lookuptables.EMPTY_SLOT)
+
+  def flowDelta(self, oldRows, topoOrder=False):
+    # the create, write and delete operations that reconfigure a device from the old flow to this one, see
+    # flowdelta.py. oldRows are the objectFlowRows() of the old flow, taken before it was updated
+    return flowdelta.flowDelta( oldRows, self.objectFlowRows(topoOrder), self._headerType )
+
+  def flowPatch(self, oldRows, abi, topoOrder=False):
+    # the flow delta as a binary patch for a target ABI, identifying the old flow by its instance image
+    base = instanceimage.packInstanceImage( oldRows, abi, self._headerType )
+    return flowdelta.packFlowPatch( self.flowDelta(oldRows, topoOrder), abi, base )
+
+  def memoryBudget(self, abi, memory, topoOrder=False):
+    # the flash and RAM of the instance tables on a target, see memorybudget.py
+    return memorybudget.memoryBudget( self.objectFlowRows(topoOrder), abi, memory, self._headerType )
 
   def _headerType(self, modelType):
     # look up the C++ type string binding in /sdfData/ValueTypeString
@@ -515,60 +1604,450 @@ class FlowGraph(Graph):
       }
     )
 
+# Parallel flow object resolution
+# each worker process gets its own resolver over the model graph and flow spec, and returns resolved objects 
+# with their model dependencies and closure cache counts. IDs and links are assigned afterwards in the main process
+_resolveWorker = None
+
+def _initResolveWorker(modelGraph, flowSpecBase):
+  global _resolveWorker
+  _resolveWorker = FlowGraph.__new__(FlowGraph)
+  _resolveWorker._initResolver(modelGraph)
+  _resolveWorker._flowSpecBase = flowSpecBase
+
+def _resolveWorkerObject(flowObject):
+  hits = _resolveWorker._closureStats["hits"]
+  misses = _resolveWorker._closureStats["misses"]
+  flowNode = _resolveWorker._trackedFlowObject(flowObject)
+  return ( flowObject, flowNode, sorted(_resolveWorker._objectDeps[flowObject]),
+    _resolveWorker._closureStats["hits"] - hits, _resolveWorker._closureStats["misses"] - misses )
+
 # ObjectFlow Builder
-def build():
-  import sys
+def build(argv=None):
+  import argparse
   print("ObjectFlow Builder")
-  
-  modelDirectory = "../Model/"
-  flowDirectory = "../Flow/"
-  outputDirectory = "../Test/"
-  documentDirectory = "../Flow/"
+
+  parser = argparse.ArgumentParser(description="ObjectFlow Builder")
+  parser.add_argument("--model", default="../Model/", help="model directory, or a model bundle file")
+  parser.add_argument("--flow", default="../Flow/", help="flow spec directory")
+  parser.add_argument("--output", default="../Test/", help="directory for the generated code")
+  parser.add_argument("--docs", default="../Flow/", help="directory for the generated documentation")
+  parser.add_argument("--lazy", action="store_true", help="load only the model files that the flow's object types need, found with the model manifest")
+  parser.add_argument("--registry", metavar="DIR", help="namespace registry directory, with a model set for each namespace that sdfRefs can refer to")
+  parser.add_argument("--write-bundle", metavar="FILE", help="write the checked model graph to a model bundle file")
+  parser.add_argument("--image-target", choices=sorted(instanceimage.TARGET_ABI), help="also write the instance list as a binary image for this target ABI")
+  parser.add_argument("--image-byte-order", choices=["little", "big"], help="override the byte order of the image target")
+  parser.add_argument("--image-double-size", type=int, choices=[4, 8], help="override the size of double on the image target")
+  parser.add_argument("--image-pointer-size", type=int, choices=[2, 4, 8], help="override the pointer size of the image target")
+  parser.add_argument("--topo-order", action="store_true", help="order the instance list so that each object comes after the objects it takes values from")
+  parser.add_argument("--compact", action="store_true", help="write instances.h as compact object, resource and value tables in PROGMEM, in place of instanceList")
+  parser.add_argument("--intern", action="store_true", help="hold the resolved flow graph in an interned node store, sharing identical subtrees, to save memory on large flows")
+  parser.add_argument("--lookup-tables", action="store_true", help="also write object-dispatch.cpp, a sorted object type table, and lookup-tables.h, perfect hash tables of the flow objects and resources")
+  parser.add_argument("--delta-from", metavar="FLOW", help="also write flow-delta.json, the operations that reconfigure a device from this flow to the built flow, and flow-delta.bin for the image target. In watch mode each rebuild writes the delta from the previous build")
+  parser.add_argument("--budget", choices=sorted(memorybudget.TARGET_MEMORY), help="report the flash and RAM of the instance tables on this target, for both instances.h formats")
+  parser.add_argument("--profile", metavar="FILE", help="record the time and peak memory of each build phase and write them to a JSON file")
+  parser.add_argument("--profile-trace", metavar="FILE", help="also write the profiled phases as a Chrome trace event file, for flame graph viewers")
+  parser.add_argument("--batch", nargs="+", metavar="FLOW", help="build many flow directories or flow spec files against the model")
+  parser.add_argument("--batch-output", default="../Batch/", help="directory for the per-flow output directories of a batch build")
+  parser.add_argument("--cache-dir", default="../.buildcache/", help="directory for the build cache")
+  parser.add_argument("--no-cache", action="store_true", help="rebuild everything without reading or writing the build cache")
+  parser.add_argument("--workers", type=int, default=1, help="processes for parsing files and resolving flow objects, 0 for one per CPU")
+  parser.add_argument("--watch", action="store_true", help="keep running and rebuild the affected outputs when model or flow files change")
+  parser.add_argument("--interval", type=float, default=1.0, help="seconds between checks for changed files in watch mode")
+  args = parser.parse_args(argv)
+  if args.batch:
+    # a batch writes the outputs of each flow, the options that work on the one flow of --flow don't apply
+    for option, value in ( ("--delta-from", args.delta_from), ("--budget", args.budget), ("--watch", args.watch) ):
+      if value:
+        parser.error(option + " can't be used with --batch")
+
+  modelDirectory = args.model
+  flowDirectory = args.flow
+  outputDirectory = args.output
+  documentDirectory = args.docs
+  workers = args.workers or os.cpu_count()
 
   print ( "Model files in", modelDirectory )
   print ( "Flow files in", flowDirectory )
   print ( "Output files in", outputDirectory )
   print ( "Document files in", documentDirectory )
 
+  if args.profile or args.profile_trace:
+    profiler.enable()
+
+  cache = None
+  if not args.no_cache:
+    print ( "Build cache in", args.cache_dir )
+    cache = BuildCache( args.cache_dir, BUILDER_VERSION )
+
   # test with local files, make the model graph first
-  model = ModelGraph( modelDirectory )
+  with profiler.active.phase("model graph"):
+    registry = None
+    if args.registry:
+      print ( "Namespace registry in", args.registry )
+      registry = NamespaceRegistry( args.registry, cache, workers )
+    model = loadModel( modelDirectory, args.batch or [ flowDirectory ], cache, workers, args.lazy, registry )
   if model.errors() != 0:
     print (model.errors(), " Errors building models")
     sys.exit(1)
 
-  flow = FlowGraph( model, flowDirectory )
+  if args.write_bundle:
+    print ( "Model bundle", args.write_bundle )
+    model.writeBundle( args.write_bundle )
+
+  imageABI = None
+  if args.image_target:
+    imageABI = instanceimage.targetABI( args.image_target, byteOrder=args.image_byte_order, 
+      doubleSize=args.image_double_size, pointerSize=args.image_pointer_size )
+
+  if args.batch:
+    print ( "Batch output in", args.batch_output )
+    with profiler.active.phase("batch build"):
+      summaries = buildBatch( model, args.batch, args.batch_output, workers, cache, imageABI, args.topo_order, args.compact, args.lookup_tables, args.intern )
+    writeProfile(args.profile, args.profile_trace)
+    if printBatchSummary(summaries) != 0:
+      sys.exit(1)
+    return
+
+  with profiler.active.phase("flow graph"):
+    flow = FlowGraph( model, flowDirectory, cache, workers, args.intern )
+  print ( "Closure cache", flow.closureCacheStats() )
+  if flow.nodeStoreStats() is not None:
+    print ( "Node store", flow.nodeStoreStats() )
+  if cache is not None:
+    print ( "Build cache", cache.stats() )
 
   # Display the flow spec
   print( "\nFlow Spec\n", flow.flowSpec().yaml() )
 
-  print( "\n" + documentDirectory + "flowSpec.uml.txt\n", flow.flowSpecUML() )
-  umlfile = open( documentDirectory + "flowSpec.uml.txt", "w" )
-  umlfile.write(flow.flowSpecUML()) 
-  umlfile.close()
-
   # Display the object and resource list sorted by ID for diagnostics
   print ( "\nTypes by ID\n", model.idList())
 
+  writeOutputs( model, flow, outputDirectory, documentDirectory, ALL_OUTPUTS, imageABI, args.topo_order, args.compact, args.lookup_tables )
+
+  if args.delta_from:
+    print ( "\nFlow delta from", args.delta_from )
+    with profiler.active.phase("delta flow graph"):
+      oldFlow = FlowGraph( model, args.delta_from, cache, workers, args.intern )
+    writeDelta( flow, list(oldFlow.objectFlowRows(args.topo_order)), outputDirectory, imageABI, args.topo_order )
+
+  if args.budget:
+    budget = flow.memoryBudget( instanceimage.targetABI(args.budget), memorybudget.TARGET_MEMORY[args.budget], args.topo_order )
+    print ( "\nMemory budget for", args.budget, budget["target"] )
+    print ( memorybudget.budgetSummary(budget) )
+  writeProfile(args.profile, args.profile_trace)
+
+  if args.watch:
+    watch( model, flow, modelDirectory, flowDirectory, outputDirectory, documentDirectory, cache, args.interval, workers, imageABI, args.topo_order, args.lazy, registry, args.compact, args.lookup_tables, args.intern, bool(args.delta_from) )
+
+# stop the active profiler and write its results, if profiling was enabled
+def writeProfile(profilePath, tracePath):
+  if not profiler.active.enabled:
+    return
+  profile = profiler.disable()
+  print ( "\nProfile\n" + profile.summary() )
+  if profilePath:
+    profile.writeJSON(profilePath)
+    print ( "Profile in", profilePath )
+  if tracePath:
+    profile.writeTrace(tracePath)
+    print ( "Profile trace in", tracePath )
+
+# output files generated from the model and flow graphs
+UML_OUTPUT = "flowSpec.uml.txt"
+OBJECT_OUTPUT = "application-object.cpp"
+RESOURCE_OUTPUT = "resource-types.h"
+INSTANCE_OUTPUT = "instances.h"
+IMAGE_OUTPUT = "instances.bin"
+DISPATCH_OUTPUT = "object-dispatch.cpp"
+LOOKUP_OUTPUT = "lookup-tables.h"
+DELTA_OUTPUT = "flow-delta.json"
+PATCH_OUTPUT = "flow-delta.bin"
+ALL_OUTPUTS = { UML_OUTPUT, OBJECT_OUTPUT, RESOURCE_OUTPUT, INSTANCE_OUTPUT }
+
+# stream the generated lines to a file, echoing them to the console
+# the lines go to a temporary file next to the output, which replaces the output only when its content changed, so
+# an unchanged output keeps its timestamp and doesn't trigger a recompile, and a reader never sees a partial file.
+# Returns True when the output was written
+def writeOutput(path, lines, echo=True):
+  if echo:
+    print( "\n" + path )
+  # the emitters are generators, so the emit phase covers generating the lines and writing them
+  with profiler.active.phase("emit " + os.path.basename(path)):
+    tempPath = path + ".%d.tmp" % os.getpid()
+    try:
+      with open( tempPath, "w" ) as outfile:
+        for line in lines:
+          outfile.write(line)
+          if echo:
+            sys.stdout.write(line)
+    except BaseException:
+      removeTemp(tempPath) # an emitter failed partway, leave the output as it was
+      raise
+    changed = replaceIfChanged(tempPath, path)
+  if echo:
+    sys.stdout.write("\n")
+    if not changed:
+      print( path, "unchanged" )
+  return changed
+
+def writeBinaryOutput(path, data):
+  tempPath = path + ".%d.tmp" % os.getpid()
+  try:
+    with open( tempPath, "wb" ) as outfile:
+      outfile.write(data)
+  except BaseException:
+    removeTemp(tempPath)
+    raise
+  return replaceIfChanged(tempPath, path)
+
+def removeTemp(tempPath):
+  try:
+    os.remove(tempPath)
+  except OSError:
+    pass # not made, the open failed
+
+# move a temporary file over the output if their contents differ, otherwise remove it
+def replaceIfChanged(tempPath, path):
+  if os.path.isfile(path) and filecmp.cmp(tempPath, path, shallow=False):
+    os.remove(tempPath)
+    return False
+  os.replace(tempPath, path)
+  return True
+
+# start plantuml on the UML file, it renders next to the file with the .txt extension replaced by .png
+# returns the running process, or None when plantuml isn't installed
+def startPlantUML(umlPath):
+  try:
+    return subprocess.Popen([ "plantuml", umlPath ])
+  except OSError as error:
+    print ( "Can't run plantuml, the UML image isn't rendered:", error )
+    return None
+
+def plantUMLImage(umlPath):
+  return os.path.splitext(umlPath)[0] + ".png"
+
+def writeOutputs(model, flow, outputDirectory, documentDirectory, outputs=ALL_OUTPUTS, imageABI=None, topoOrder=False, compact=False, lookupTables=False, echo=True):
+  # each output is generated once and streamed to its file, outputs whose content didn't change aren't touched
+  written = []
+  def output(path, lines):
+    if writeOutput(path, lines, echo):
+      written.append(path)
+
+  # the UML is written first, so that plantuml renders it while the other outputs are generated. It is rendered
+  # only when the UML changed or its image is missing
+  render = None
+  if UML_OUTPUT in outputs:
+    umlPath = documentDirectory + UML_OUTPUT
+    output( umlPath, [ flow.flowSpecUML() ] )
+    if umlPath in written or not os.path.isfile( plantUMLImage(umlPath) ):
+      render = startPlantUML(umlPath)
+
   # application-object.cpp
-  print ( "\n" + outputDirectory + "application-object.cpp\n", model.objectHeader() )
-  objectfile = open( outputDirectory + "application-object.cpp", "w" )
-  objectfile.write(model.objectHeader()) 
-  objectfile.close()
+  if OBJECT_OUTPUT in outputs:
+    output( outputDirectory + OBJECT_OUTPUT, model.objectHeaderLines() )
+
+  # object-dispatch.cpp, the object types as a sorted table
+  if OBJECT_OUTPUT in outputs and lookupTables:
+    output( outputDirectory + DISPATCH_OUTPUT, model.objectDispatchLines() )
 
   # resource-types.h
-  print ( "\n" + outputDirectory + "resource-types.h\n",model.resourceHeader() )
-  resourcefile = open( outputDirectory + "resource-types.h", "w" )
-  resourcefile.write(model.resourceHeader()) 
-  resourcefile.close()
+  if RESOURCE_OUTPUT in outputs:
+    output( outputDirectory + RESOURCE_OUTPUT, model.resourceHeaderLines() )
 
   # instances.h
-  print ( "\n" + outputDirectory + "instances.h\n", flow.objectFlowHeader() )
-  instancefile = open( outputDirectory + "instances.h", "w" )
-  instancefile.write(flow.objectFlowHeader()) 
-  instancefile.close()
+  if INSTANCE_OUTPUT in outputs:
+    if compact:
+      output( outputDirectory + INSTANCE_OUTPUT, flow.objectFlowCompactHeaderLines(topoOrder, lookupTables) )
+    else:
+      output( outputDirectory + INSTANCE_OUTPUT, flow.objectFlowHeaderLines(topoOrder, lookupTables) )
+
+  # lookup-tables.h, the flow objects and resources by ID
+  if INSTANCE_OUTPUT in outputs and lookupTables:
+    output( outputDirectory + LOOKUP_OUTPUT, flow.objectLookupLines(topoOrder) )
+
+  # instances.bin, the instance list as a binary image for the target ABI
+  if INSTANCE_OUTPUT in outputs and imageABI is not None:
+    with profiler.active.phase("emit " + IMAGE_OUTPUT):
+      image = flow.objectFlowImage(imageABI, topoOrder)
+      if writeBinaryOutput( outputDirectory + IMAGE_OUTPUT, image ):
+        written.append( outputDirectory + IMAGE_OUTPUT )
+    print ( "\n" + outputDirectory + IMAGE_OUTPUT, len(image), "bytes for", imageABI )
+
+  # wait for the UML image
+  if render is not None:
+    with profiler.active.phase("plantuml"):
+      if render.wait() != 0:
+        print ( "plantuml failed with exit status", render.returncode )
+  return written
+
+# write the flow delta from the old rows as a write list, one operation a line, and as a binary patch when there is
+# an image target ABI
+def writeDelta(flow, oldRows, outputDirectory, imageABI=None, topoOrder=False, echo=True):
+  with profiler.active.phase("flow delta"):
+    operations = flow.flowDelta(oldRows, topoOrder)
+  writeOutput( outputDirectory + DELTA_OUTPUT, 
+    [ "[\n", ",\n".join( json.dumps(operation) for operation in operations ), "\n]\n" ], echo )
+  patchSize = None
+  if imageABI is not None:
+    with profiler.active.phase("emit " + PATCH_OUTPUT):
+      patch = flow.flowPatch(oldRows, imageABI, topoOrder)
+      writeBinaryOutput( outputDirectory + PATCH_OUTPUT, patch )
+    patchSize = len(patch)
+  print ( "Flow delta", flowdelta.deltaSummary(operations, patchSize) )
+  return operations
+
+# Batch builder
+# build many flow variants against one model graph. The model is loaded and checked once, then each flow directory
+# or flow spec file is resolved in a worker process and its outputs are written to its own directory under the 
+# batch output directory, with the console output of the variant in build.log. Returns a summary for each flow
+_batchModel = None
+
+def _initBatchWorker(model):
+  global _batchModel
+  _batchModel = model
+
+def flowVariantName(flowPath):
+  name = os.path.basename( os.path.normpath(flowPath) )
+  for suffix in [ ".flo.yml", ".flo.json" ]:
+    if name.endswith(suffix):
+      return name[:-len(suffix)]
+  return name
+
+def _buildVariant(flowPath, outputDirectory, cache, imageABI, topoOrder, compact, lookupTables, interned):
+  import contextlib
+  startTime = time.time()
+  summary = { "flow": flowPath, "output": outputDirectory, "objects": 0, "error": None }
+  os.makedirs(outputDirectory, exist_ok=True)
+  with open( os.path.join(outputDirectory, "build.log"), "w" ) as logfile, contextlib.redirect_stdout(logfile):
+    try:
+      flow = FlowGraph( _batchModel, flowPath, cache, interned=interned )
+      summary["objects"] = len( flow.flowGraph()["sdfThing"]["Flow"]["sdfObject"] )
+      writeOutputs( _batchModel, flow, outputDirectory + "/", outputDirectory + "/", ALL_OUTPUTS, imageABI, topoOrder, compact, lookupTables, echo=False )
+    except Exception as error:
+      print ( "Build failed:", repr(error) )
+      summary["error"] = repr(error)
+  summary["seconds"] = time.time() - startTime
+  return summary
+
+def buildBatch(model, flowPaths, outputRoot, workers=1, cache=None, imageABI=None, topoOrder=False, compact=False, lookupTables=False, interned=False):
+  names = [ flowVariantName(flowPath) for flowPath in flowPaths ]
+  duplicates = set( name for name in names if names.count(name) > 1 )
+  if duplicates:
+    print ( "Flow variants with the same name:", sorted(duplicates) )
+    raise ValueError(sorted(duplicates))
+  outputDirectories = [ os.path.join(outputRoot, name) for name in names ]
+
+  if workers > 1 and len(flowPaths) > 1:
+    with concurrent.futures.ProcessPoolExecutor( max_workers=workers, mp_context=_processContext(),
+        initializer=_initBatchWorker, initargs=(model,) ) as executor:
+      futures = [ executor.submit(_buildVariant, flowPath, outputDirectory, cache, imageABI, topoOrder, compact, lookupTables, interned) 
+        for flowPath, outputDirectory in zip(flowPaths, outputDirectories) ]
+      return [ future.result() for future in futures ]
+
+  _initBatchWorker(model)
+  return [ _buildVariant(flowPath, outputDirectory, cache, imageABI, topoOrder, compact, lookupTables, interned) for flowPath, outputDirectory in zip(flowPaths, outputDirectories) ]
+
+def printBatchSummary(summaries):
+  print ( "\n%-32s %8s %9s  %s" % ("Flow", "Objects", "Seconds", "Result") )
+  for summary in summaries:
+    print ( "%-32s %8d %9.3f  %s" % (flowVariantName(summary["flow"]), summary["objects"], summary["seconds"], 
+      "error " + summary["error"] if summary["error"] else "ok " + summary["output"]) )
+  errors = len( [ summary for summary in summaries if summary["error"] ] )
+  print ( "%d flows, %d errors, %.3f s total build time" % (len(summaries), errors, sum( summary["seconds"] for summary in summaries )) )
+  return errors
+
+# modification time and size of each file matching the patterns, to poll for changes
+def fileSignatures(directory, patterns):
+  signatures = {}
+  for pattern in patterns:
+    for file in glob.glob( directory + pattern ):
+      try:
+        status = os.stat(file)
+      except OSError:
+        continue # removed while scanning, the next poll will see it
+      signatures[file] = (status.st_mtime_ns, status.st_size)
+  return signatures
+
+# Resident builder
+# keep the model and flow graphs in memory and poll the model and flow directories for changes
+# a model change is diffed against the previous model graph, and only the flow objects that were expanded from 
+# the changed definitions are resolved again. A flow spec change resolves only the new and changed objects. 
+# Only the output files that depend on the change are written
+def watch(model, flow, modelDirectory, flowDirectory, outputDirectory, documentDirectory, cache=None, interval=1.0, workers=1, imageABI=None, topoOrder=False, lazy=False, registry=None, compact=False, lookupTables=False, interned=False, delta=False):
+  modelPatterns = [ "*.sdf.json", "*.sdf.yml" ]
+  if os.path.isfile(modelDirectory):
+    modelPatterns = [ "" ] # watch the model bundle file
+  flowPatterns = [ "*.flo.json", "*.flo.yml" ]
+  modelFiles = fileSignatures(modelDirectory, modelPatterns)
+  flowFiles = fileSignatures(flowDirectory, flowPatterns)
+  rebuild = False # set after a failed update, when the graphs in memory can't be trusted
+
+  print ( "\nWatching", modelDirectory, "and", flowDirectory, "for changes, Ctrl-C to stop" )
+  try:
+    while True:
+      time.sleep(interval)
+      newModelFiles = fileSignatures(modelDirectory, modelPatterns)
+      newFlowFiles = fileSignatures(flowDirectory, flowPatterns)
+      if newModelFiles == modelFiles and newFlowFiles == flowFiles:
+        continue
+      startTime = time.time()
+      modelChanged = newModelFiles != modelFiles
+      flowChanged = newFlowFiles != flowFiles
+      modelFiles = newModelFiles
+      flowFiles = newFlowFiles
+      # the flow is updated in place, so the delta base is taken before
+      oldRows = list( flow.objectFlowRows(topoOrder) ) if delta and not rebuild else None
 
-  # process the UML file to a graphic image
-  subprocess.run([ "plantuml", (documentDirectory + "flowSpec.uml.txt") ])
+      try:
+        if rebuild:
+          newModel = loadModel( modelDirectory, [ flowDirectory ], cache, workers, lazy, registry )
+          if newModel.errors() != 0:
+            print (newModel.errors(), " Errors building models")
+            continue
+          model = newModel
+          flow = FlowGraph( model, flowDirectory, cache, workers, interned )
+          outputs = ALL_OUTPUTS
+          affected = set(flow.flowGraph()["sdfThing"]["Flow"]["sdfObject"])
+          rebuild = False
+        else:
+          outputs = set()
+          newModel = None
+          changedPointers = []
+          if modelChanged or (lazy and flowChanged): # a lazy model depends on the types the flow uses
+            newModel = loadModel( modelDirectory, [ flowDirectory ], cache, workers, lazy, registry )
+            if newModel.errors() != 0:
+              print (newModel.errors(), " Errors building models, keeping the previous model")
+              continue
+            changedPointers = diffPointers( model.graph(), newModel.graph() )
+            print ( "Changed model definitions", changedPointers )
+            if pointerAffected("/sdfData/TypeID", changedPointers):
+              outputs |= { OBJECT_OUTPUT, RESOURCE_OUTPUT }
+            if pointerAffected("/sdfData/ValueTypeString", changedPointers):
+              outputs.add(INSTANCE_OUTPUT)
+          affected = flow.update( newModel, changedPointers, flowDirectory if flowChanged else None )
+          if newModel is not None:
+            model = newModel
+          if affected:
+            outputs.add(INSTANCE_OUTPUT)
+          if flowChanged:
+            outputs.add(UML_OUTPUT)
+      except Exception as error:
+        print ( "Build failed:", repr(error) )
+        rebuild = True
+        continue
+
+      print ( "Resolved flow objects", sorted(affected) )
+      try:
+        written = writeOutputs( model, flow, outputDirectory, documentDirectory, outputs, imageABI, topoOrder, compact, lookupTables )
+        if oldRows is not None and INSTANCE_OUTPUT in outputs:
+          writeDelta( flow, oldRows, outputDirectory, imageABI, topoOrder )
+      except Exception as error:
+        print ( "Writing outputs failed:", repr(error) )
+        continue
+      print ( "Rebuilt", sorted(outputs), "in %.3f s," % (time.time() - startTime), "changed", sorted(written) )
+  except KeyboardInterrupt:
+    print ( "\nStopped watching" )
 
 if __name__ == '__main__':
     build()
@@ -0,0 +1,247 @@
+import struct
+import zlib
+import instanceimage
+
+
+# ObjectFlow flow delta
+#
+# the difference between the instance lists of two resolved flows, as the operations that reconfigure a device
+# running the old flow to the new one, so that a changed IntervalTime or a rewired OutputLink costs a few bytes
+# over the air instead of a new instances.h and a full reflash
+#
+# Instance rows are keyed by (objectTypeID, objectInstanceID, resourceTypeID, resourceInstanceID), which is how the
+# device finds them with getObjectByID and getResourceByID. The operations follow the LWM2M paths of the keys,
+# /objectTypeID/objectInstanceID for an object and /objectTypeID/objectInstanceID/resourceTypeID/resourceInstanceID
+# for a resource:
+#
+#   create  an object, or a resource with its value type and value; a new object is created before its resources
+#   write   the value of a resource that is in both flows, with its value type, which may have changed
+#   delete  a resource of an object that is in both flows, or a whole object with its resources
+#
+# The creates come first, then the writes, then the deletes, so that links are written after the objects they
+# point to exist, and objects are deleted after the links to them were written away
+#
+# Instance IDs are counted per object type in flow spec order, so adding an object ahead of others of its type
+# moves their instance IDs, and the delta rewrites them. Adding objects after the others of their type keeps it small
+#
+# Binary patch layout, all fields in the target byte order:
+#
+#   header      magic "OFDP", format version, flags, int and double sizes, operation count (uint16), and the CRC-32 of
+#               the instance image of the old flow for the target ABI, which identifies the configuration it applies to
+#   operations  one record each, without padding:
+#                 operation code (uint8), objectTypeID, objectInstanceID (uint16)
+#                 resource operations: resourceTypeID, resourceInstanceID (uint16)
+#                 resource creates and writes: valueType (uint8, enum ValueType) and the value, a boolean in one byte,
+#                 an int or a double in its target size, a string as its length (uint16) and UTF-8 bytes, a link as
+#                 typeID, instanceID (uint16), a time as uint32
+#
+PATCH_MAGIC = b"OFDP"
+PATCH_VERSION = 1
+PATCH_HEADER = "4sBBBBHI"
+FLAG_BIG_ENDIAN = 0x01
+FLAG_FLOAT_DOUBLE = 0x02 # double is 32 bits on the target
+
+# operation codes, with RESOURCE_PATH set for operations on a resource
+OPERATIONS = { "create": 1, "write": 2, "delete": 3 }
+RESOURCE_PATH = 0x80
+
+def rowKey(row):
+  return (row["objectTypeID"], row["objectInstanceID"], row["resourceTypeID"], row["resourceInstanceID"])
+
+def lwm2mPath(key):
+  return "/" + "/".join( "%d" % field for field in key )
+
+def parsePath(path):
+  return tuple( int(field) for field in path.strip("/").split("/") )
+
+# index instance rows by key, keeping the instance list order
+# typeNames maps the model value type name to the C++ ValueType name, the values are (valueType, value), with the
+# value converted to its C type
+def _indexRows(rows, typeNames):
+  index = {}
+  for row in rows:
+    key = rowKey(row)
+    if key in index:
+      print("Duplicate resource in the instance list:", lwm2mPath(key), row["objectName"], row["resourceName"])
+      raise ValueError(lwm2mPath(key))
+    valueType = typeNames(row["valueType"])
+    index[key] = (valueType, _cValue(valueType, row["value"]))
+  return index
+
+# a value as the device holds it in AnyValueType, so that e.g. a floatType 0 from YAML equals 0.0
+# links are (typeID, instanceID) tuples
+C_VALUES = { "booleanType": bool, "integerType": int, "floatType": float, "stringType": str, "linkType": tuple,
+  "timeType": int }
+
+def _cValue(valueType, value):
+  if valueType not in C_VALUES:
+    return tuple(value) if isinstance(value, list) else value
+  return C_VALUES[valueType](value)
+
+# the operations that turn the old rows into the new rows, as a write list of dicts like
+#   { "op": "write", "path": "/43000/0/27007/0", "type": "timeType", "value": 1000 }
+# rows are dicts like FlowGraph.objectFlowRows()
+def flowDelta(oldRows, newRows, typeNames):
+  old = _indexRows(oldRows, typeNames)
+  new = _indexRows(newRows, typeNames)
+  oldObjects = { key[:2] for key in old }
+  newObjects = { key[:2] for key in new }
+
+  creates = []
+  writes = []
+  deletes = []
+  created = set()
+  deleted = set()
+  for key, (valueType, value) in new.items():
+    entry = { "path": lwm2mPath(key), "type": valueType, "value": list(value) if isinstance(value, tuple) else value }
+    if key[:2] not in oldObjects and key[:2] not in created:
+      creates.append( { "op": "create", "path": lwm2mPath(key[:2]) } )
+      created.add(key[:2])
+    if key not in old:
+      creates.append( dict(op="create", **entry) )
+    elif not _sameValue(old[key], (valueType, value)):
+      writes.append( dict(op="write", **entry) )
+  for key in old:
+    if key[:2] not in newObjects:
+      if key[:2] not in deleted:
+        deletes.append( { "op": "delete", "path": lwm2mPath(key[:2]) } )
+        deleted.add(key[:2])
+    elif key not in new:
+      deletes.append( { "op": "delete", "path": lwm2mPath(key) } )
+  return creates + writes + deletes
+
+def _sameValue(a, b):
+  # the values are converted to the C type of their value type, a changed value type is a change
+  # floats are compared by their bits, so that a change of sign of zero is written
+  if a[0] != b[0]:
+    return False
+  if isinstance(a[1], float) and isinstance(b[1], float):
+    return a[1].hex() == b[1].hex()
+  return a[1] == b[1]
+
+# apply operations to instance rows, returning the (valueType, value) of each key, as the
+# device ends up after the patch. For host side tools and tests, a new flow's rows equal the old flow's rows with
+# the delta applied
+def applyFlowDelta(oldRows, operations, typeNames):
+  index = _indexRows(oldRows, typeNames)
+  for operation in operations:
+    key = parsePath(operation["path"])
+    if len(key) == 2:
+      objectKeys = [ existing for existing in index if existing[:2] == key ]
+      if operation["op"] == "create" and objectKeys or operation["op"] != "create" and not objectKeys:
+        print("Can't", operation["op"], "object", operation["path"])
+        raise ValueError(operation["path"])
+      for existing in objectKeys:
+        del index[existing]
+    elif operation["op"] == "delete":
+      if key not in index:
+        print("Can't delete resource", operation["path"])
+        raise ValueError(operation["path"])
+      del index[key]
+    else:
+      if (operation["op"] == "create") == (key in index):
+        print("Can't", operation["op"], "resource", operation["path"])
+        raise ValueError(operation["path"])
+      index[key] = (operation["type"], _cValue(operation["type"], operation["value"]))
+  return index
+
+# pack operations into a binary patch for a target ABI, base is the instance image of the old flow, see
+# instanceimage.py, whose CRC-32 goes into the header
+def packFlowPatch(operations, abi, base=b""):
+  formats = instanceimage._formats(abi)
+  prefix = formats["prefix"]
+  if len(operations) > 0xFFFF:
+    print("Too many operations for a patch:", len(operations))
+    raise ValueError(len(operations))
+  flags = 0
+  if abi["byteOrder"] == "big":
+    flags |= FLAG_BIG_ENDIAN
+  if abi["doubleSize"] == 4:
+    flags |= FLAG_FLOAT_DOUBLE
+  patch = bytearray( struct.pack( prefix + PATCH_HEADER, PATCH_MAGIC, PATCH_VERSION, flags, abi["intSize"],
+    abi["doubleSize"], len(operations), zlib.crc32(base) ) )
+
+  for operation in operations:
+    key = parsePath(operation["path"])
+    code = OPERATIONS[operation["op"]] | (RESOURCE_PATH if len(key) == 4 else 0)
+    patch += struct.pack( prefix + "B" + "H" * len(key), code, *key )
+    if len(key) == 2 or operation["op"] == "delete":
+      continue
+    valueType = operation["type"]
+    if valueType not in instanceimage.VALUE_TYPES:
+      print("Unimplemented resource type:", valueType)
+      raise ValueError(valueType)
+    patch += struct.pack( "B", instanceimage.VALUE_TYPES.index(valueType) )
+    value = operation["value"]
+    if valueType == "booleanType":
+      patch += struct.pack( "B", 1 if value else 0 )
+    elif valueType == "integerType":
+      patch += struct.pack( formats["int"], value )
+    elif valueType == "floatType":
+      patch += struct.pack( formats["double"], value )
+    elif valueType == "stringType":
+      text = str(value).encode("utf-8")
+      patch += struct.pack( prefix + "H", len(text) ) + text
+    elif valueType == "linkType":
+      patch += struct.pack( prefix + "HH", value[0], value[1] )
+    elif valueType == "timeType":
+      patch += struct.pack( prefix + "I", value )
+  return bytes(patch)
+
+# unpack a patch back to its header fields and operations, for host side tools and tests
+def unpackFlowPatch(patch):
+  if patch[:4] != PATCH_MAGIC:
+    raise ValueError("not an ObjectFlow flow patch")
+  flags = patch[5]
+  prefix = ">" if flags & FLAG_BIG_ENDIAN else "<"
+  fields = struct.unpack_from( prefix + PATCH_HEADER, patch, 0 )
+  header = dict( zip( [ "magic", "version", "flags", "intSize", "doubleSize", "operationCount", "baseCRC" ], fields ) )
+  formats = instanceimage._formats( { "byteOrder": "big" if flags & FLAG_BIG_ENDIAN else "little",
+    "intSize": header["intSize"], "doubleSize": header["doubleSize"] } )
+  names = { code: name for name, code in OPERATIONS.items() }
+
+  operations = []
+  offset = struct.calcsize(prefix + PATCH_HEADER)
+  for count in range(header["operationCount"]):
+    code = patch[offset]
+    fieldCount = 4 if code & RESOURCE_PATH else 2
+    key = struct.unpack_from( prefix + "H" * fieldCount, patch, offset + 1 )
+    offset += 1 + 2 * fieldCount
+    operation = { "op": names[code & ~RESOURCE_PATH], "path": lwm2mPath(key) }
+    operations.append(operation)
+    if fieldCount == 2 or operation["op"] == "delete":
+      continue
+    valueType = instanceimage.VALUE_TYPES[ patch[offset] ]
+    offset += 1
+    if valueType == "booleanType":
+      value = bool(patch[offset])
+      offset += 1
+    elif valueType == "integerType":
+      value = struct.unpack_from( formats["int"], patch, offset )[0]
+      offset += struct.calcsize(formats["int"])
+    elif valueType == "floatType":
+      value = struct.unpack_from( formats["double"], patch, offset )[0]
+      offset += struct.calcsize(formats["double"])
+    elif valueType == "stringType":
+      length = struct.unpack_from( prefix + "H", patch, offset )[0]
+      value = patch[offset + 2:offset + 2 + length].decode("utf-8")
+      offset += 2 + length
+    elif valueType == "linkType":
+      value = list( struct.unpack_from( prefix + "HH", patch, offset ) )
+      offset += 4
+    elif valueType == "timeType":
+      value = struct.unpack_from( prefix + "I", patch, offset )[0]
+      offset += 4
+    operation["type"] = valueType
+    operation["value"] = value
+  return header, operations
+
+# count the operations of each kind, for the build console
+def deltaSummary(operations, patchSize=None):
+  counts = { name: 0 for name in OPERATIONS }
+  for operation in operations:
+    counts[operation["op"]] += 1
+  text = ", ".join( "%d %s" % (counts[name], name) for name in OPERATIONS )
+  if patchSize is not None:
+    text += ", %d byte patch" % patchSize
+  return text
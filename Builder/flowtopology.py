@@ -0,0 +1,155 @@
+
+import heapq
+
+
+# ObjectFlow flow topology
+#
+# the link graph of a resolved flow. Nodes are the flow objects, and there is an edge from producer to consumer for
+# each link resource: an OutputLink points from its object to the consumer, an InputLink points from its object
+# back to the producer it reads from
+#
+# flowObjects is the resolved /sdfThing/Flow/sdfObject map, after the flow spec values are applied. Link targets
+# are the InstancePointer values, which must be flowBasePath + "/" + the name of another flow object. Links whose
+# pointer doesn't name a flow object are dangling, and are left out of the graph
+#
+# The topological order puts producers before consumers. Objects on a cycle have no such order, so each strongly
+# connected component is placed as a unit, and ties are broken by flow spec order to keep the order stable
+#
+class FlowTopology():
+  def __init__(self, flowObjects, flowBasePath, inputLinkTypeID):
+    self._objects = list(flowObjects)
+    self._position = { name: index for index, name in enumerate(self._objects) }
+    self._successors = { name: [] for name in self._objects }
+    self._predecessors = { name: [] for name in self._objects }
+    self._links = [] # (object, resource, target object)
+    self._dangling = [] # (object, resource, pointer)
+    prefix = flowBasePath + "/"
+
+    for flowObject in self._objects:
+      resources = flowObjects[flowObject]["sdfProperty"]
+      for resource in resources:
+        meta = resources[resource].get("flo:meta", {})
+        if "InstanceGraphLink" not in meta:
+          continue
+        pointer = meta["InstanceGraphLink"]["properties"]["InstancePointer"].get("const")
+        if pointer is None:
+          continue # link resource without a value in the flow spec
+        target = pointer[len(prefix):] if pointer.startswith(prefix) else None
+        if target not in self._position:
+          self._dangling.append( (flowObject, resource, pointer) )
+          continue
+        self._links.append( (flowObject, resource, target) )
+        if resources[resource].get("oma:id", {}).get("const") == inputLinkTypeID:
+          producer, consumer = target, flowObject
+        else:
+          producer, consumer = flowObject, target
+        self._successors[producer].append(consumer)
+        self._predecessors[consumer].append(producer)
+
+    self._components = self._stronglyConnected()
+    self._order = self._topologicalOrder()
+
+  def objects(self):
+    return list(self._objects)
+
+  def links(self):
+    # (object, resource, target object) for each resolved link, in flow order
+    return list(self._links)
+
+  def successors(self, flowObject):
+    # the consumers of the values of a flow object
+    return list(self._successors[flowObject])
+
+  def predecessors(self, flowObject):
+    # the producers of the values used by a flow object
+    return list(self._predecessors[flowObject])
+
+  def danglingLinks(self):
+    # (object, resource, pointer) for each link that doesn't point to a flow object
+    return list(self._dangling)
+
+  def cycles(self):
+    # the objects of each link cycle, one list per strongly connected component, in flow order
+    return [ component for component in self._components
+      if len(component) > 1 or component[0] in self._successors[component[0]] ]
+
+  def order(self):
+    # flow object names with producers before consumers
+    return list(self._order)
+
+  def _stronglyConnected(self):
+    # components with their members in flow order, in the flow order of their first members
+    components = [ sorted(component, key=self._position.get) for component in stronglyConnectedComponents(self._objects, self._successors) ]
+    return sorted(components, key=lambda component: self._position[component[0]])
+
+  # Kahn's algorithm over the components, taking the ready component that comes first in the flow
+  def _topologicalOrder(self):
+    componentOf = {}
+    for componentIndex, component in enumerate(self._components):
+      for member in component:
+        componentOf[member] = componentIndex
+    successors = [ set() for component in self._components ]
+    inDegree = [ 0 ] * len(self._components)
+    for producer in self._objects:
+      for consumer in self._successors[producer]:
+        source, target = componentOf[producer], componentOf[consumer]
+        if source != target and target not in successors[source]:
+          successors[source].add(target)
+          inDegree[target] += 1
+    ready = [ componentIndex for componentIndex in range(len(self._components)) if inDegree[componentIndex] == 0 ]
+    heapq.heapify(ready) # components are numbered in flow order
+    order = []
+    while ready:
+      componentIndex = heapq.heappop(ready)
+      order.extend(self._components[componentIndex])
+      for target in successors[componentIndex]:
+        inDegree[target] -= 1
+        if inDegree[target] == 0:
+          heapq.heappush(ready, target)
+    return order
+
+# Tarjan's algorithm with an explicit stack, so long chains can't hit the recursion limit
+# nodes is a list of hashable nodes, successors maps each node to a list of nodes. Returns a list of components,
+# each a list of nodes, in reverse topological order of the components
+def stronglyConnectedComponents(nodes, successors):
+  index = {}
+  lowlink = {}
+  onStack = set()
+  stack = []
+  components = []
+  counter = 0
+  for root in nodes:
+    if root in index:
+      continue
+    work = [ (root, 0) ]
+    while work:
+      node, edge = work.pop()
+      if edge == 0:
+        index[node] = lowlink[node] = counter
+        counter += 1
+        stack.append(node)
+        onStack.add(node)
+      nodeSuccessors = successors[node]
+      while edge < len(nodeSuccessors):
+        successor = nodeSuccessors[edge]
+        edge += 1
+        if successor not in index:
+          work.append( (node, edge) )
+          work.append( (successor, 0) )
+          break
+        if successor in onStack:
+          lowlink[node] = min(lowlink[node], index[successor])
+      else:
+        if lowlink[node] == index[node]:
+          component = []
+          while True:
+            member = stack.pop()
+            onStack.discard(member)
+            component.append(member)
+            if member == node:
+              break
+          components.append(component)
+        if work:
+          parent = work[-1][0]
+          lowlink[parent] = min(lowlink[parent], lowlink[node])
+  return components
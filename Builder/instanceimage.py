@@ -0,0 +1,212 @@
+
+import struct
+
+
+# ObjectFlow instance image
+#
+# A packed binary copy of the instanceList table from instances.h, laid out like ObjectFlow::InstanceTemplate
+# and AnyValueType in objectflow.h for a chosen target ABI, so that provisioning tools and host tests can map
+# and patch instance tables directly, and configurations can be sent to devices as a blob
+#
+#   struct InstanceTemplate {        union AnyValueType {
+#     uint16_t objectTypeID;           bool booleanType;
+#     uint16_t objectInstanceID;       int integerType;
+#     uint16_t resourceTypeID;         double floatType;
+#     uint16_t resourceInstanceID;     char* stringType;
+#     ValueType valueType;             InstanceLink linkType;
+#     AnyValueType value;              time_t timeType;     // uint32_t
+#   };                               };
+#
+# Image layout, all fields in the target byte order:
+#
+#   header        magic "OFIT", format version, flags, ABI sizes, and the offsets and counts of the tables below
+#   object index  one entry per object: objectTypeID, objectInstanceID (uint16), first entry, entry count (uint32)
+#   entries       InstanceTemplate array, aligned for the target
+#   strings       NUL terminated strings; a stringType value holds the offset of its string from the image start,
+#                 to be relocated to an address by whoever loads the image
+#
+IMAGE_MAGIC = b"OFIT"
+IMAGE_VERSION = 1
+IMAGE_HEADER = "4sHBBBBBBHHIIIIII"
+FLAG_BIG_ENDIAN = 0x01
+FLAG_FLOAT_DOUBLE = 0x02 # double is 32 bits on the target
+FLAG_STRING_OFFSETS = 0x04 # stringType values are image offsets
+
+# enum ValueType in objectflow.h, in declaration order
+VALUE_TYPES = [ "booleanType", "integerType", "floatType", "stringType", "linkType", "timeType" ]
+
+# target ABI profiles
+# byteOrder is "little" or "big", sizes are in bytes, maxAlign caps the alignment of any type
+TARGET_ABI = {
+  "avr": { "byteOrder": "little", "intSize": 2, "enumSize": 2, "doubleSize": 4, "pointerSize": 2, "maxAlign": 1 },
+  "arm32": { "byteOrder": "little", "intSize": 4, "enumSize": 4, "doubleSize": 8, "pointerSize": 4, "maxAlign": 8 },
+  "esp32": { "byteOrder": "little", "intSize": 4, "enumSize": 4, "doubleSize": 8, "pointerSize": 4, "maxAlign": 8 },
+  "x86": { "byteOrder": "little", "intSize": 4, "enumSize": 4, "doubleSize": 8, "pointerSize": 4, "maxAlign": 4 },
+  "x86_64": { "byteOrder": "little", "intSize": 4, "enumSize": 4, "doubleSize": 8, "pointerSize": 8, "maxAlign": 8 },
+}
+
+def targetABI(name, **overrides):
+  # a copy of a named ABI profile with any of its fields replaced
+  abi = dict(TARGET_ABI[name])
+  for field, value in overrides.items():
+    if value is not None:
+      abi[field] = value
+  return abi
+
+def _align(offset, alignment):
+  return (offset + alignment - 1) // alignment * alignment
+
+# sizes and offsets of InstanceTemplate for a target ABI
+def instanceLayout(abi):
+  maxAlign = abi["maxAlign"]
+  def member(size):
+    return (size, min(size, maxAlign))
+  members = {
+    "booleanType": member(1),
+    "integerType": member(abi["intSize"]),
+    "floatType": member(abi["doubleSize"]),
+    "stringType": member(abi["pointerSize"]),
+    "linkType": (4, min(2, maxAlign)),
+    "timeType": member(4),
+  }
+  unionAlign = max( alignment for size, alignment in members.values() )
+  unionSize = _align( max( size for size, alignment in members.values() ), unionAlign )
+  enumAlign = min(abi["enumSize"], maxAlign)
+  valueTypeOffset = _align(8, enumAlign)
+  valueOffset = _align(valueTypeOffset + abi["enumSize"], unionAlign)
+  structAlign = max(min(2, maxAlign), enumAlign, unionAlign)
+  return {
+    "valueTypeOffset": valueTypeOffset,
+    "valueOffset": valueOffset,
+    "valueSize": unionSize,
+    "entrySize": _align(valueOffset + unionSize, structAlign),
+    "alignment": structAlign,
+  }
+
+def _formats(abi):
+  prefix = "<" if abi["byteOrder"] == "little" else ">"
+  signed = { 1: "b", 2: "h", 4: "i", 8: "q" }
+  unsigned = { 1: "B", 2: "H", 4: "I", 8: "Q" }
+  formats = {
+    "prefix": prefix,
+    "int": prefix + signed[abi["intSize"]],
+    "double": prefix + ("f" if abi["doubleSize"] == 4 else "d"),
+  }
+  # the flow patch header of flowdelta.py carries only the int and double sizes
+  if "enumSize" in abi:
+    formats["enum"] = prefix + unsigned[abi["enumSize"]]
+  if "pointerSize" in abi:
+    formats["pointer"] = prefix + unsigned[abi["pointerSize"]]
+  return formats
+
+# pack instance rows into an image
+# rows are dicts like FlowGraph.objectFlowRows(), typeNames maps the model value type name to the C++ ValueType name
+def packInstanceImage(rows, abi, typeNames):
+  layout = instanceLayout(abi)
+  formats = _formats(abi)
+  prefix = formats["prefix"]
+  rows = list(rows)
+
+  # object index, objects are contiguous in the instance list
+  objects = []
+  for index, row in enumerate(rows):
+    objectID = (row["objectTypeID"], row["objectInstanceID"])
+    if objects and objects[-1][0] == objectID and objects[-1][1] + objects[-1][2] == index:
+      objects[-1][2] += 1
+    else:
+      objects.append( [objectID, index, 1] )
+
+  headerSize = struct.calcsize(prefix + IMAGE_HEADER)
+  objectIndexOffset = _align(headerSize, 4)
+  objectIndexSize = len(objects) * struct.calcsize(prefix + "HHII")
+  entriesOffset = _align(objectIndexOffset + objectIndexSize, max(4, layout["alignment"]))
+  stringsOffset = entriesOffset + len(rows) * layout["entrySize"]
+
+  strings = bytearray()
+  stringOffsets = {}
+  entries = bytearray( len(rows) * layout["entrySize"] )
+  for index, row in enumerate(rows):
+    entryOffset = index * layout["entrySize"]
+    valueType = typeNames(row["valueType"])
+    if valueType not in VALUE_TYPES:
+      print("Unimplemented resource type:", row["valueType"])
+      raise ValueError(row["valueType"])
+    struct.pack_into( prefix + "HHHH", entries, entryOffset,
+      row["objectTypeID"], row["objectInstanceID"], row["resourceTypeID"], row["resourceInstanceID"] )
+    struct.pack_into( formats["enum"], entries, entryOffset + layout["valueTypeOffset"], VALUE_TYPES.index(valueType) )
+    valueOffset = entryOffset + layout["valueOffset"]
+    value = row["value"]
+    if valueType == "booleanType":
+      struct.pack_into( "B", entries, valueOffset, 1 if value else 0 )
+    elif valueType == "integerType":
+      struct.pack_into( formats["int"], entries, valueOffset, value )
+    elif valueType == "floatType":
+      struct.pack_into( formats["double"], entries, valueOffset, value )
+    elif valueType == "stringType":
+      text = str(value)
+      if text not in stringOffsets:
+        stringOffsets[text] = stringsOffset + len(strings)
+        strings += text.encode("utf-8") + b"\0"
+      struct.pack_into( formats["pointer"], entries, valueOffset, stringOffsets[text] )
+    elif valueType == "linkType":
+      struct.pack_into( prefix + "HH", entries, valueOffset, value[0], value[1] )
+    elif valueType == "timeType":
+      struct.pack_into( prefix + "I", entries, valueOffset, value )
+
+  flags = FLAG_STRING_OFFSETS
+  if abi["byteOrder"] == "big":
+    flags |= FLAG_BIG_ENDIAN
+  if abi["doubleSize"] == 4:
+    flags |= FLAG_FLOAT_DOUBLE
+
+  image = bytearray( struct.pack( prefix + IMAGE_HEADER, IMAGE_MAGIC, IMAGE_VERSION, flags,
+    abi["intSize"], abi["enumSize"], abi["doubleSize"], abi["pointerSize"], layout["alignment"],
+    layout["entrySize"], layout["valueOffset"], len(objects), objectIndexOffset, len(rows), entriesOffset,
+    stringsOffset, len(strings) ) )
+  image += bytes(objectIndexOffset - len(image))
+  for (objectTypeID, objectInstanceID), first, count in objects:
+    image += struct.pack( prefix + "HHII", objectTypeID, objectInstanceID, first, count )
+  image += bytes(entriesOffset - len(image))
+  image += entries
+  image += strings
+  return bytes(image)
+
+# unpack an image back to its header fields and rows, for host side tools and tests
+# row values are returned as stored; strings are read back through their image offsets
+def unpackInstanceImage(image):
+  if image[:4] != IMAGE_MAGIC:
+    raise ValueError("not an ObjectFlow instance image")
+  flags = image[6]
+  prefix = ">" if flags & FLAG_BIG_ENDIAN else "<"
+  fields = struct.unpack_from( prefix + IMAGE_HEADER, image, 0 )
+  header = dict( zip( [ "magic", "version", "flags", "intSize", "enumSize", "doubleSize", "pointerSize", "alignment",
+    "entrySize", "valueOffset", "objectCount", "objectIndexOffset", "entryCount", "entriesOffset",
+    "stringsOffset", "stringsSize" ], fields ) )
+  abi = { "byteOrder": "big" if flags & FLAG_BIG_ENDIAN else "little", "intSize": header["intSize"],
+    "enumSize": header["enumSize"], "doubleSize": header["doubleSize"], "pointerSize": header["pointerSize"],
+    "maxAlign": header["alignment"] }
+  layout = instanceLayout(abi)
+  formats = _formats(abi)
+
+  rows = []
+  for index in range(header["entryCount"]):
+    entryOffset = header["entriesOffset"] + index * header["entrySize"]
+    oid, oinst, rid, rinst = struct.unpack_from( prefix + "HHHH", image, entryOffset )
+    valueType = VALUE_TYPES[ struct.unpack_from( formats["enum"], image, entryOffset + layout["valueTypeOffset"] )[0] ]
+    valueOffset = entryOffset + header["valueOffset"]
+    if valueType == "booleanType":
+      value = bool(image[valueOffset])
+    elif valueType == "integerType":
+      value = struct.unpack_from( formats["int"], image, valueOffset )[0]
+    elif valueType == "floatType":
+      value = struct.unpack_from( formats["double"], image, valueOffset )[0]
+    elif valueType == "stringType":
+      stringOffset = struct.unpack_from( formats["pointer"], image, valueOffset )[0]
+      value = image[stringOffset:image.index(b"\0", stringOffset)].decode("utf-8")
+    elif valueType == "linkType":
+      value = list( struct.unpack_from( prefix + "HH", image, valueOffset ) )
+    else:
+      value = struct.unpack_from( prefix + "I", image, valueOffset )[0]
+    rows.append( { "objectTypeID": oid, "objectInstanceID": oinst, "resourceTypeID": rid, "resourceInstanceID": rinst,
+      "valueType": valueType, "value": value } )
+  return header, rows
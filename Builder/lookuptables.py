@@ -0,0 +1,118 @@
+
+
+# ObjectFlow lookup tables
+#
+# constant time lookup of the objects and resources of a flow by their IDs, for generated firmware that would
+# otherwise walk the Object and Resource lists in getObjectByID and getResourceByID
+#
+# Each table is a minimal perfect hash built with hash and displace: a key first hashes with seed 0 to a bucket,
+# the bucket holds a displacement, and the key hashes with the displacement as the seed to its slot. The builder
+# tries displacements for the buckets, largest bucket first, until every key of a bucket lands in a free slot.
+# Slots hold the full key, so a lookup of an ID that isn't in the flow is detected by comparing it
+#
+# The hash mixes the 16 bit fields of a key into a 32 bit state, in unsigned 32 bit arithmetic so that the
+# generated C++ gets the same slots as the builder:
+#
+#   uint32_t lookupMix(uint32_t x) { x *= 0x9E3779B1u; return x ^ (x >> 15); }
+#   hash(a, b, seed) = lookupMix(lookupMix(seed ^ a) ^ b)
+#   hash(a, b, c, seed) = lookupMix(hash(a, b, seed) ^ c)
+#
+# Object keys are (objectTypeID, objectInstanceID), resource keys are (object index, resourceTypeID,
+# resourceInstanceID). The object index is the position of the object in the instance list and the resource index
+# is the position of the resource in the instance list, which is the order buildInstances creates them in and fills
+# its Object and Resource pointer tables in. Indexes are 16 bit, with 0xFFFF marking an empty slot
+#
+MIX_MULTIPLIER = 0x9E3779B1
+BUCKET_SIZE = 4 # keys per bucket, on average
+EMPTY_SLOT = 0xFFFF
+
+def lookupMix(x):
+  x = (x * MIX_MULTIPLIER) & 0xFFFFFFFF
+  return x ^ (x >> 15)
+
+def lookupHash(fields, seed):
+  state = seed
+  for field in fields:
+    state = lookupMix(state ^ field)
+  return state
+
+# perfect hash of distinct keys, each a tuple of 16 bit fields
+# returns the displacement of each bucket, and the index of the key in each slot, None for an empty slot. There
+# are as many slots as keys, or more if no displacement below 2^16 places a bucket, which is unlikely
+def perfectHash(keys):
+  slotCount = max(1, len(keys))
+  while True:
+    displacements = _placeBuckets(keys, slotCount)
+    if displacements is not None:
+      break
+    slotCount += 1
+  bucketCount = len(displacements)
+  slots = [ None ] * slotCount
+  for index, key in enumerate(keys):
+    slots[ lookupHash(key, displacements[ lookupHash(key, 0) % bucketCount ]) % slotCount ] = index
+  return displacements, slots
+
+def _placeBuckets(keys, slotCount):
+  bucketCount = max(1, (len(keys) + BUCKET_SIZE - 1) // BUCKET_SIZE)
+  buckets = [ [] for bucket in range(bucketCount) ]
+  for key in keys:
+    buckets[ lookupHash(key, 0) % bucketCount ].append(key)
+  displacements = [ 0 ] * bucketCount
+  used = [ False ] * slotCount
+  for bucket in sorted( range(bucketCount), key=lambda bucket: -len(buckets[bucket]) ):
+    if not buckets[bucket]:
+      break
+    for displacement in range(1, 0x10000):
+      slots = { lookupHash(key, displacement) % slotCount for key in buckets[bucket] }
+      if len(slots) == len(buckets[bucket]) and not any( used[slot] for slot in slots ):
+        break
+    else:
+      return None
+    displacements[bucket] = displacement
+    for slot in slots:
+      used[slot] = True
+  return displacements
+
+# lookup tables of instance rows
+# rows are dicts like FlowGraph.objectFlowRows(), in instance list order. Returns the objects as (objectTypeID,
+# objectInstanceID, firstResource, resourceCount) by object index, the resources as (object index, resourceTypeID,
+# resourceInstanceID, offset in the object) by resource index, and a perfect hash of each
+def instanceLookupTables(rows):
+  objects = []
+  resources = []
+  objectIndex = {}
+  for row in rows:
+    objectID = (row["objectTypeID"], row["objectInstanceID"])
+    if objectID not in objectIndex:
+      objectIndex[objectID] = len(objects)
+      objects.append( [ objectID[0], objectID[1], len(resources), 0 ] )
+    entry = objects[objectIndex[objectID]]
+    if entry[2] + entry[3] != len(resources):
+      print("Object resources aren't contiguous in the instance list:", objectID)
+      raise ValueError(objectID)
+    resources.append( (objectIndex[objectID], row["resourceTypeID"], row["resourceInstanceID"], entry[3]) )
+    entry[3] += 1
+
+  if len(resources) >= EMPTY_SLOT:
+    print("Too many resources for 16 bit lookup tables:", len(resources), "of at most", EMPTY_SLOT - 1)
+    raise ValueError(len(resources))
+
+  resourceKeys = [ resource[:3] for resource in resources ]
+  if len(set(resourceKeys)) != len(resourceKeys):
+    duplicates = sorted( key for key in set(resourceKeys) if resourceKeys.count(key) > 1 )
+    print("Duplicate resource IDs in an object:", duplicates)
+    raise ValueError(duplicates)
+  return {
+    "objects": [ tuple(entry) for entry in objects ],
+    "resources": resources,
+    "objectHash": perfectHash( [ tuple(entry[:2]) for entry in objects ] ),
+    "resourceHash": perfectHash(resourceKeys),
+  }
+
+# look up a key in a perfect hash, the index of the key or None, as the generated code does
+def lookup(keys, hashTable, key):
+  displacements, slots = hashTable
+  index = slots[ lookupHash(key, displacements[ lookupHash(key, 0) % len(displacements) ]) % len(slots) ]
+  if index is None or tuple(keys[index]) != tuple(key):
+    return None
+  return index
@@ -0,0 +1,156 @@
+
+from instanceimage import instanceLayout, VALUE_TYPES, _align
+
+
+# ObjectFlow memory budget
+#
+# the flash and RAM cost of the instance tables of a flow on a target, for the instanceList table in instances.h and
+# for the compact tables, and the RAM of the objects and resources that ObjectList::buildInstances makes from them
+#
+# The instanceList table repeats objectTypeID and objectInstanceID on every resource and holds every value in an
+# AnyValueType union sized for the largest member. The compact tables in objectflow.h hold each object once, and
+# each resource as its IDs and an index into an array of values of its type, with each distinct value stored once:
+#
+#   struct InstanceObject {           struct InstanceResource {
+#     uint16_t objectTypeID;            uint16_t resourceTypeID;
+#     uint16_t objectInstanceID;        uint16_t resourceInstanceID;
+#     uint16_t firstResource;           uint16_t valueIndex;
+#     uint16_t resourceCount;           uint8_t valueType;
+#   };                                };
+#
+#   booleanValues[]  integerValues[]  floatValues[]  stringValues[]  linkValues[]  timeValues[]
+#
+# All compact tables are PROGMEM. On targets that keep const data in RAM, like AVR, the instanceList table is
+# copied to RAM at startup, and the compact tables stay in flash. Only table and heap sizes are counted, not code
+# or stack
+#
+
+# target memory profiles, for the target ABI profiles in instanceimage.TARGET_ABI
+# flash and ram are the sizes of a typical part in bytes, None for hosts. constInRAM is true for targets where const
+# data is in RAM unless it is PROGMEM, heapOverhead is the allocator header of each new
+TARGET_MEMORY = {
+  "avr": { "flash": 32768, "ram": 2048, "constInRAM": True, "heapOverhead": 2 }, # ATmega328P, Arduino Uno
+  "arm32": { "flash": 262144, "ram": 32768, "constInRAM": False, "heapOverhead": 8 }, # SAMD21, Cortex-M0+
+  "esp32": { "flash": 1310720, "ram": 327680, "constInRAM": False, "heapOverhead": 8 }, # default app partition
+  "x86": { "flash": None, "ram": None, "constInRAM": False, "heapOverhead": 8 },
+  "x86_64": { "flash": None, "ram": None, "constInRAM": False, "heapOverhead": 16 },
+}
+
+# size of a struct with members of (size, alignment), and its alignment
+def _structSize(members):
+  offset = 0
+  for size, alignment in members:
+    offset = _align(offset, alignment) + size
+  structAlign = max( alignment for size, alignment in members )
+  return _align(offset, structAlign), structAlign
+
+def _valueSizes(abi):
+  # element size of each compact value array, by ValueType name
+  return {
+    "booleanType": 1,
+    "integerType": abi["intSize"],
+    "floatType": abi["doubleSize"],
+    "stringType": abi["pointerSize"],
+    "linkType": 4,
+    "timeType": 4,
+  }
+
+# compact tables of instance rows
+# rows are dicts like FlowGraph.objectFlowRows(), typeNames maps the model value type name to the C++ ValueType name.
+# Returns the objects as (objectTypeID, objectInstanceID, firstResource, resourceCount), the resources as
+# (resourceTypeID, resourceInstanceID, valueType, valueIndex), and the distinct values of each ValueType in order
+# of first use
+def compactTables(rows, typeNames):
+  objects = []
+  resources = []
+  values = { valueType: [] for valueType in VALUE_TYPES }
+  valueIndex = { valueType: {} for valueType in VALUE_TYPES }
+  for row in rows:
+    valueType = typeNames(row["valueType"])
+    if valueType not in VALUE_TYPES:
+      print("Unimplemented resource type:", row["valueType"])
+      raise ValueError(row["valueType"])
+    objectID = (row["objectTypeID"], row["objectInstanceID"])
+    if objects and tuple(objects[-1][:2]) == objectID:
+      objects[-1][3] += 1
+    else:
+      objects.append( [ objectID[0], objectID[1], len(resources), 1 ] )
+    value = row["value"]
+    key = tuple(value) if valueType == "linkType" else value
+    if key not in valueIndex[valueType]:
+      valueIndex[valueType][key] = len(values[valueType])
+      values[valueType].append(value)
+    resources.append( (row["resourceTypeID"], row["resourceInstanceID"], valueType, valueIndex[valueType][key]) )
+  return {
+    "objects": [ tuple(entry) for entry in objects ],
+    "resources": resources,
+    "values": values,
+  }
+
+def _stringBytes(strings):
+  # NUL terminated, with identical literals merged by the compiler
+  return sum( len(str(text).encode("utf-8")) + 1 for text in set( str(text) for text in strings ) )
+
+# the budget of the instance tables of rows on a target
+# abi is a target ABI profile and memory a target memory profile. Returns the flash and RAM of each part, for the
+# instanceList table and for the compact tables, in bytes
+def memoryBudget(rows, abi, memory, typeNames):
+  rows = list(rows)
+  tables = compactTables(rows, typeNames)
+  pointer = (abi["pointerSize"], min(abi["pointerSize"], abi["maxAlign"]))
+  halfword = (2, min(2, abi["maxAlign"]))
+  layout = instanceLayout(abi)
+  strings = [ row["value"] for row in rows if typeNames(row["valueType"]) == "stringType" ]
+
+  # the objects and resources made by buildInstances, with the vtable pointer of Object
+  objectSize = _structSize( [ pointer, halfword, halfword, pointer, pointer, pointer ] )[0]
+  resourceSize = _structSize( [ halfword, halfword, pointer, (abi["enumSize"], min(abi["enumSize"], abi["maxAlign"])),
+    (layout["valueSize"], layout["alignment"]) ] )[0]
+  heap = len(tables["objects"]) * (objectSize + memory["heapOverhead"]) + len(rows) * (resourceSize + memory["heapOverhead"])
+
+  instanceTable = len(rows) * layout["entrySize"] + _stringBytes(strings)
+  standard = {
+    "instance table": { "flash": instanceTable, "ram": instanceTable if memory["constInRAM"] else 0 },
+    "objects and resources": { "flash": 0, "ram": heap },
+  }
+
+  # the compact loader copies strings out of flash on targets where PROGMEM isn't addressable as data
+  objectEntry = _structSize( [ halfword ] * 4 )[0]
+  resourceEntry = _structSize( [ halfword ] * 3 + [ (1, 1) ] )[0]
+  valueSizes = _valueSizes(abi)
+  valueArrays = sum( max(1, len(tables["values"][valueType])) * valueSizes[valueType] for valueType in VALUE_TYPES )
+  compactStrings = _stringBytes(tables["values"]["stringType"])
+  stringCopies = sum( len(str(text).encode("utf-8")) + 1 + memory["heapOverhead"] for text in strings ) if memory["constInRAM"] else 0
+  compact = {
+    "object table": { "flash": len(tables["objects"]) * objectEntry, "ram": 0 },
+    "resource table": { "flash": len(rows) * resourceEntry, "ram": 0 },
+    "value arrays": { "flash": valueArrays + compactStrings, "ram": 0 },
+    "objects and resources": { "flash": 0, "ram": heap + stringCopies },
+  }
+
+  def totals(parts):
+    return { "flash": sum( part["flash"] for part in parts.values() ), "ram": sum( part["ram"] for part in parts.values() ) }
+
+  return {
+    "target": { "flash": memory["flash"], "ram": memory["ram"] },
+    "counts": { "objects": len(tables["objects"]), "resources": len(rows),
+      "values": sum( len(tables["values"][valueType]) for valueType in VALUE_TYPES ) },
+    "standard": { "parts": standard, "total": totals(standard) },
+    "compact": { "parts": compact, "total": totals(compact) },
+  }
+
+# the budget as a table, for the console
+def budgetSummary(budget):
+  target = budget["target"]
+  counts = budget["counts"]
+  lines = [ "%d objects, %d resources, %d distinct values" % (counts["objects"], counts["resources"], counts["values"]),
+    "%-32s %10s %10s" % ("Tables", "Flash", "RAM") ]
+  for mode in ("standard", "compact"):
+    for name, part in budget[mode]["parts"].items():
+      lines.append( "%-32s %10d %10d" % (mode + " " + name, part["flash"], part["ram"]) )
+    total = budget[mode]["total"]
+    lines.append( "%-32s %10d %10d" % (mode + " total", total["flash"], total["ram"]) )
+    if target["flash"] and target["ram"]:
+      lines.append( "%-32s %9.1f%% %9.1f%%" % (mode + " of target", 100.0 * total["flash"] / target["flash"],
+        100.0 * total["ram"] / target["ram"]) )
+  return "\n".join(lines)
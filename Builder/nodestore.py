@@ -0,0 +1,123 @@
+
+
+# Interned node store
+#
+# hash-consing for JSON trees of dicts and lists: intern() returns a tree where every subtree that is structurally
+# identical to one already in the store is replaced by the stored node, so identical subtrees are held once and
+# shared, and two interned subtrees are equal exactly when they are the same object
+#
+# Interned nodes are shared, so they must not be changed in place. assignPaths() sets values inside a tree by
+# copying only the dicts on the paths to the values, leaving the rest of the tree shared, and the result can be
+# interned again. Interning stops at nodes that are already interned, so re-interning after a change only visits
+# the copied paths
+#
+# Dicts are identical when they have the same keys in the same order with identical values, since the order is
+# kept in the JSON output. Leaf values are compared with their type, so that 1, 1.0 and true stay distinct
+#
+class NodeStore():
+  def __init__(self):
+    self._nodes = {} # structural key: interned node
+    self._keys = {} # id of interned node: structural key, the interned nodes are kept alive by _nodes
+    self._stats = { "nodes": 0, "shared": 0 }
+
+  def intern(self, node):
+    if not isinstance(node, (dict, list)) or id(node) in self._keys:
+      return node
+    return self._internNode(node)
+
+  # intern the children, then the node, reusing the node when none of its children were replaced
+  # recursive like copyTree, the depth is the depth of the tree
+  def _internNode(self, node):
+    keys = self._keys
+    isDict = isinstance(node, dict)
+    # the structure is one flat tuple: the container type, then for each item its key if a dict, the type of its
+    # value and the value, where an interned child stands for itself by id, as identity is structure for them
+    structure = [ dict if isDict else list ]
+    items = []
+    changed = False
+    for key, value in (node.items() if isDict else enumerate(node)):
+      if isDict:
+        structure.append(key)
+      if isinstance(value, (dict, list)):
+        if id(value) not in keys:
+          interned = self._internNode(value)
+          changed = changed or interned is not value
+          value = interned
+        structure.append(NodeStore)
+        structure.append(id(value))
+      else:
+        structure.append(type(value)) # keeps 1, 1.0 and true apart
+        structure.append(value.hex() if type(value) is float else value) # keeps -0.0 apart from 0.0, and lets nan match itself
+      items.append( (key, value) )
+    structure = tuple(structure)
+    existing = self._nodes.get(structure)
+    if existing is not None:
+      self._stats["shared"] += 1
+      return existing
+    if changed:
+      node = dict(items) if isDict else [ value for key, value in items ]
+    self._nodes[structure] = node
+    keys[id(node)] = structure
+    self._stats["nodes"] += 1
+    return node
+
+  def interned(self, node):
+    return id(node) in self._keys
+
+  def equal(self, a, b):
+    # structural equality, by identity when both nodes are interned
+    if self.interned(a) and self.interned(b):
+      return a is b
+    return a == b
+
+  # drop the interned nodes that can't be reached from roots, returning how many were dropped
+  # the store keeps every node it interned alive, so a tree that is changed and interned again over and over, as in
+  # the resident builder, holds all of its old versions until they are dropped
+  def retain(self, roots):
+    keys = self._keys
+    reachable = set()
+    stack = [ root for root in roots if id(root) in keys ]
+    while stack:
+      node = stack.pop()
+      if id(node) in reachable:
+        continue
+      reachable.add(id(node))
+      for value in (node.values() if isinstance(node, dict) else node):
+        if isinstance(value, (dict, list)) and id(value) in keys:
+          stack.append(value)
+    dropped = len(keys) - len(reachable)
+    self._nodes = { structure: node for structure, node in self._nodes.items() if id(node) in reachable }
+    self._keys = { key: structure for key, structure in keys.items() if key in reachable }
+    self._stats["nodes"] = len(self._nodes)
+    return dropped
+
+  def stats(self):
+    # interned nodes held by the store, and the nodes replaced by a node already held
+    return dict(self._stats)
+
+# set values inside a tree, each assignment is a tuple of keys down from the root and the value to set there
+# missing dicts on the paths are made. With copyOnWrite the tree isn't changed, the dicts on the paths are copied
+# once each and the new root is returned, otherwise the tree is changed in place and the root is returned
+def assignPaths(root, assignments, copyOnWrite=False):
+  if not copyOnWrite:
+    for keys, value in assignments:
+      node = root
+      for key in keys[:-1]:
+        if not isinstance(node.get(key), dict):
+          node[key] = {}
+        node = node[key]
+      node[keys[-1]] = value
+    return root
+  newRoot = dict(root)
+  copies = { (): newRoot }
+  for keys, value in assignments:
+    node = newRoot
+    for depth in range(len(keys) - 1):
+      path = tuple(keys[:depth + 1])
+      if path not in copies:
+        child = node.get(keys[depth])
+        copies[path] = dict(child) if isinstance(child, dict) else {}
+        node[keys[depth]] = copies[path]
+      node = copies[path]
+    node[keys[-1]] = value
+  return newRoot
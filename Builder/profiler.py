@@ -0,0 +1,165 @@
+
+import json
+import os
+import time
+import tracemalloc
+
+
+# ObjectFlow Builder profiler
+#
+# records the wall time and peak traced memory of each builder phase, and counts of hot operations
+#
+# The builder reports to profiler.active, which is a NullProfiler that does nothing until profiling is enabled:
+#
+#   import profiler
+#   with profiler.profiling() as profile:
+#     model = ModelGraph(...)
+#   profile.writeJSON("profile.json")
+#   profile.writeTrace("profile.trace.json")
+#
+# Phases nest, and each one is recorded as a complete event in the Chrome trace event format, which can be loaded
+# in chrome://tracing, Perfetto or speedscope as a flame graph. Peak memory is the peak of the memory allocated by
+# Python while the phase ran, relative to the start of the phase, measured with tracemalloc
+#
+class _NullPhase():
+  def __enter__(self):
+    return self
+  def __exit__(self, *exc):
+    return False
+
+_NULL_PHASE = _NullPhase()
+
+class NullProfiler():
+  enabled = False
+  def phase(self, name, **args):
+    return _NULL_PHASE
+  def count(self, name, n=1):
+    pass
+  def start(self):
+    pass
+  def stop(self):
+    pass
+
+class _Phase():
+  def __init__(self, profiler, name, args):
+    self._profiler = profiler
+    self._name = name
+    self._args = args
+  def __enter__(self):
+    self._profiler._enter(self)
+    return self
+  def __exit__(self, *exc):
+    self._profiler._exit(self)
+    return False
+
+class Profiler():
+  enabled = True
+  def __init__(self, memory=True):
+    self._memory = memory
+    self._startTime = None
+    self._stack = []
+    self._events = []
+    self._phases = {}
+    self._counters = {}
+    self._startedTracing = False
+
+  def start(self):
+    self._startTime = time.perf_counter()
+    if self._memory and not tracemalloc.is_tracing():
+      tracemalloc.start()
+      self._startedTracing = True
+
+  def stop(self):
+    if self._startedTracing:
+      tracemalloc.stop()
+      self._startedTracing = False
+
+  def phase(self, name, **args):
+    # context manager that records a phase, args are added to the trace event
+    return _Phase(self, name, args)
+
+  def count(self, name, n=1):
+    self._counters[name] = self._counters.get(name, 0) + n
+
+  def _tracedMemory(self):
+    if self._memory and tracemalloc.is_tracing():
+      return tracemalloc.get_traced_memory()
+    return (0, 0)
+
+  def _enter(self, phase):
+    current, peak = self._tracedMemory()
+    if self._stack: # the peak so far belongs to the enclosing phase
+      self._stack[-1]._peak = max(self._stack[-1]._peak, peak)
+    if self._memory and tracemalloc.is_tracing():
+      tracemalloc.reset_peak()
+    phase._baseMemory = current
+    phase._peak = current
+    phase._start = time.perf_counter()
+    self._stack.append(phase)
+
+  def _exit(self, phase):
+    end = time.perf_counter()
+    current, peak = self._tracedMemory()
+    phase._peak = max(phase._peak, peak)
+    self._stack.pop()
+    if self._stack:
+      self._stack[-1]._peak = max(self._stack[-1]._peak, phase._peak)
+    seconds = end - phase._start
+    peakBytes = phase._peak - phase._baseMemory
+
+    totals = self._phases.setdefault(phase._name, { "calls": 0, "seconds": 0.0, "peakBytes": 0 })
+    totals["calls"] += 1
+    totals["seconds"] += seconds
+    totals["peakBytes"] = max(totals["peakBytes"], peakBytes)
+
+    event = { "name": phase._name, "ph": "X", "ts": (phase._start - self._startTime) * 1e6, "dur": seconds * 1e6,
+      "pid": os.getpid(), "tid": 0, "args": dict(phase._args, peakBytes=peakBytes) }
+    self._events.append(event)
+
+  def report(self):
+    # totals of each phase by name, in the order the phases first finished, and the counters
+    return { "phases": { name: dict(totals) for name, totals in self._phases.items() }, "counters": dict(self._counters) }
+
+  def writeJSON(self, path):
+    with open(path, "w") as outfile:
+      json.dump(self.report(), outfile, indent=2)
+
+  def writeTrace(self, path):
+    with open(path, "w") as outfile:
+      json.dump( { "traceEvents": self._events, "displayTimeUnit": "ms" }, outfile )
+
+  def summary(self):
+    # the report as a table, for the console
+    lines = [ "%-32s %8s %10s %12s" % ("Phase", "Calls", "Seconds", "Peak KiB") ]
+    for name, totals in self._phases.items():
+      lines.append( "%-32s %8d %10.4f %12.1f" % (name, totals["calls"], totals["seconds"], totals["peakBytes"] / 1024) )
+    for name, value in self._counters.items():
+      lines.append( "%-32s %8d" % (name, value) )
+    return "\n".join(lines)
+
+active = NullProfiler()
+
+def enable(profiler=None):
+  # make a profiler the active one and start it, returns the profiler
+  global active
+  active = profiler if profiler is not None else Profiler()
+  active.start()
+  return active
+
+def disable():
+  # stop the active profiler and go back to the null profiler, returns the stopped profiler
+  global active
+  stopped = active
+  stopped.stop()
+  active = NullProfiler()
+  return stopped
+
+class profiling():
+  # with profiling() as profile: ... enables a profiler for the block
+  def __init__(self, profiler=None):
+    self._profiler = profiler
+  def __enter__(self):
+    return enable(self._profiler)
+  def __exit__(self, *exc):
+    disable()
+    return False
@@ -0,0 +1,326 @@
+
+import time
+import numpy
+
+
+# ObjectFlow host simulator
+#
+# runs the event semantics of a resolved flow on the host, for many instances of the flow at once, so that a flow
+# can be exercised and its scaling parameters checked before it is flashed. Each resource of each flow object is a
+# NumPy array with one element per flow instance, and each event is applied to all the instances it reaches in one
+# vectorized step, with a mask selecting the instances where it fires
+#
+#   model = ModelGraph("../Model/")
+#   flow = FlowGraph(model, "../Flow/")
+#   simulation = FlowSimulator.fromFlowGraph(flow, model, instances=10000)
+#   simulation.setValues("MapToCelsius", "InputHighReference", 1023)
+#   simulation.run(ticks=600, step=100)
+#   print(simulation.summary())
+#
+# The events follow ObjectFlow::Object in objectflow.cpp and the sdfAction descriptions in the model:
+#
+#   clock               each tick calls updateCurrentTime(now) on every TimeSource object
+#   updateCurrentTime   CurrentTime = now, and if now - LastActivationTime >= IntervalTime, in time_t arithmetic
+#                       that wraps at 2^32, LastActivationTime = now and onInterval
+#   syncToOutput        updateDefaultValue(readDefaultValue()) on each OutputLink target. readDefaultValue reads
+#                       OutputValue, CurrentValue or InputValue and updateDefaultValue sets InputValue, CurrentValue
+#                       or OutputValue, the first one the object has, then calls onDefaultValueUpdate
+#   TimeSource          onInterval: OutputTime = now, and updateCurrentTime(now) on each OutputLink target
+#   AnalogInput         onInterval: CurrentValue = a sample of PinID, syncToOutput
+#   BinaryInput         onInterval: CurrentValue = a sample of PinID, syncToOutput
+#   ValueMap            onDefaultValueUpdate: CurrentValue = InputValue mapped from the input references to the
+#                       current references, clipped to CurrentValueMinimum..CurrentValueMaximum, syncToOutput
+#   Publisher           onDefaultValueUpdate: publish the default value
+#
+# Other object types take the values they are sent and do nothing else. Values are converted to the value type of
+# the resource they are written to, where the device copies the AnyValueType union. An event still propagating
+# after it has passed through as many links as there are objects is on a link cycle, and is dropped and counted
+#
+
+# NumPy element types for the model value types, like AnyValueType on a 32 bit target
+VALUE_DTYPES = {
+  "BooleanType": numpy.bool_,
+  "IntegerType": numpy.int32,
+  "FloatType": numpy.float64,
+  "TimeType": numpy.uint32,
+}
+
+# resources each object type needs for its event handlers
+REQUIRED_RESOURCES = {
+  "TimeSource": [ "CurrentTime", "IntervalTime", "LastActivationTime", "OutputValue" ],
+  "AnalogInput": [ "CurrentValue", "PinID" ],
+  "BinaryInput": [ "CurrentValue", "PinID" ],
+  "ValueMap": [ "InputValue", "CurrentValue", "InputLowReference", "InputHighReference", "CurrentLowReference",
+    "CurrentHighReference", "CurrentValueMinimum", "CurrentValueMaximum" ],
+  "Publisher": [],
+}
+
+_TIME_EVENT = 0
+_VALUE_EVENT = 1
+
+# pin readings for the input objects: 10 bit ADC counts for analog pins, and coin flips for binary pins
+class RandomSampler():
+  def __init__(self, seed=None, maximum=1023):
+    self._rng = numpy.random.default_rng(seed)
+    self._maximum = maximum
+
+  def __call__(self, now, objectName, pinIDs, dtype):
+    if dtype == numpy.bool_:
+      return self._rng.random(len(pinIDs)) < 0.5
+    return self._rng.integers(0, self._maximum + 1, len(pinIDs))
+
+class _SimulatedObject():
+  def __init__(self, name, typeName, typeID, instanceID):
+    self.name = name
+    self.typeName = typeName
+    self.typeID = typeID
+    self.instanceID = instanceID
+    self.values = {} # (resourceTypeID, resourceInstanceID): array, or the value of a string or link resource
+    self.resourceNames = {} # resource name: (resourceTypeID, resourceInstanceID)
+    self.outputLinks = [] # [TypeID, InstanceID] values, then the linked objects
+
+class FlowSimulator():
+  # rows are instance rows like FlowGraph.objectFlowRows(), objectTypes and resourceTypes map the type names of the
+  # model TypeID registry to TypeIDs, like dict(ModelGraph.objectRows()) and dict(ModelGraph.resourceRows())
+  #
+  # sampler(now, objectName, pinIDs, dtype) returns the pin readings of an input object for every flow instance,
+  # publish(now, objectName, mask, values) is called with the values of a Publisher for the instances it publishes
+  def __init__(self, rows, objectTypes, resourceTypes, instances=1, sampler=None, publish=None):
+    self._instances = instances
+    self._typeNames = { typeID: name for name, typeID in objectTypes.items() }
+    self._resourceTypes = resourceTypes
+    self._sampler = sampler if sampler is not None else RandomSampler()
+    self._publish = publish
+    self._objects = []
+    self._objectByName = {}
+    self._objectByID = {}
+    self._all = numpy.ones(instances, dtype=numpy.bool_)
+    self.now = 0
+    self.ticks = 0
+    self.events = 0
+    self.dropped = 0
+
+    for row in rows:
+      objectID = (row["objectTypeID"], row["objectInstanceID"])
+      if row["objectName"] not in self._objectByName:
+        if objectID in self._objectByID:
+          print("Duplicate object ID:", objectID, row["objectName"], self._objectByID[objectID].name)
+          raise ValueError(objectID)
+        simulatedObject = _SimulatedObject(row["objectName"], self._typeNames.get(row["objectTypeID"]), *objectID)
+        self._objects.append(simulatedObject)
+        self._objectByName[simulatedObject.name] = simulatedObject
+        self._objectByID[objectID] = simulatedObject
+      simulatedObject = self._objectByName[row["objectName"]]
+      key = (row["resourceTypeID"], row["resourceInstanceID"])
+      simulatedObject.resourceNames[row["resourceName"]] = key
+      if row["valueType"] in VALUE_DTYPES:
+        simulatedObject.values[key] = numpy.full(instances, row["value"], dtype=VALUE_DTYPES[row["valueType"]])
+      else:
+        simulatedObject.values[key] = row["value"]
+      if row["valueType"] == "InstanceLinkType" and row["resourceTypeID"] == resourceTypes["OutputLink"]:
+        simulatedObject.outputLinks.append(row["value"])
+
+    for simulatedObject in self._objects:
+      for link in simulatedObject.outputLinks:
+        if tuple(link) not in self._objectByID:
+          print("Link doesn't resolve to a flow object:", simulatedObject.name, "->", link)
+          raise ValueError(link)
+      simulatedObject.outputLinks = [ self._objectByID[tuple(link)] for link in simulatedObject.outputLinks ]
+      for resource in REQUIRED_RESOURCES.get(simulatedObject.typeName, []):
+        if self._resource(simulatedObject, resource) is None:
+          print("Resource needed for simulation not in flow object:", simulatedObject.name, resource)
+          raise ValueError(resource)
+
+    self._timeSources = [ simulatedObject for simulatedObject in self._objects if simulatedObject.typeName == "TimeSource" ]
+    self._published = { simulatedObject.name: {
+      "count": numpy.zeros(instances, dtype=numpy.int64),
+      "last": numpy.zeros(instances),
+      "minimum": numpy.full(instances, numpy.inf),
+      "maximum": numpy.full(instances, -numpy.inf),
+      "sum": numpy.zeros(instances) } for simulatedObject in self._objects if simulatedObject.typeName == "Publisher" }
+
+  @classmethod
+  def fromFlowGraph(cls, flow, model, **options):
+    # simulate a resolved flow, with the TypeIDs of its model
+    return cls(flow.objectFlowRows(), dict(model.objectRows()), dict(model.resourceRows()), **options)
+
+  def objects(self):
+    return [ simulatedObject.name for simulatedObject in self._objects ]
+
+  def values(self, objectName, resourceName):
+    # the values of a resource, one per flow instance
+    simulatedObject = self._objectByName[objectName]
+    return simulatedObject.values[simulatedObject.resourceNames[resourceName]]
+
+  def setValues(self, objectName, resourceName, values):
+    # set a resource in every flow instance, to one value or to an array of per instance values
+    simulatedObject = self._objectByName[objectName]
+    key = simulatedObject.resourceNames[resourceName]
+    if not isinstance(simulatedObject.values[key], numpy.ndarray):
+      print("Can't set a string or link resource:", objectName, resourceName)
+      raise ValueError(resourceName)
+    simulatedObject.values[key][...] = values
+
+  def published(self, objectName):
+    # publish count, last, minimum, maximum and sum of the values published by a Publisher, per flow instance
+    return self._published[objectName]
+
+  def run(self, ticks, step=1):
+    # advance the clock by ticks steps, calling the TimeSource objects at the start of each step
+    for tick in range(ticks):
+      now = numpy.uint32(self.now & 0xffffffff)
+      self._process( [ (_TIME_EVENT, timeSource, self._all, now) for timeSource in self._timeSources ] )
+      self.now += step
+      self.ticks += 1
+
+  def summary(self):
+    # published values over all flow instances, for the console
+    lines = [ "%-24s %12s %12s %12s %12s %12s" % ("Publisher", "Instances", "Published", "Minimum", "Mean", "Maximum") ]
+    for name, published in self._published.items():
+      total = int(published["count"].sum())
+      reached = published["count"] > 0
+      if total:
+        minimum, mean, maximum = published["minimum"][reached].min(), published["sum"].sum() / total, published["maximum"][reached].max()
+      else:
+        minimum = mean = maximum = numpy.nan
+      lines.append( "%-24s %12d %12d %12.4f %12.4f %12.4f" % (name, int(reached.sum()), total, minimum, mean, maximum) )
+    lines.append( "%d ticks, %d events, %d dropped on link cycles" % (self.ticks, self.events, self.dropped) )
+    return "\n".join(lines)
+
+  def _resource(self, simulatedObject, resourceTypeName, instance=0):
+    return simulatedObject.values.get( (self._resourceTypes[resourceTypeName], instance) )
+
+  # depth first, like the calls on the device: the events an event causes are processed before its siblings
+  def _process(self, events):
+    stack = [ (kind, target, mask, value, 0) for kind, target, mask, value in reversed(events) ]
+    while stack:
+      kind, target, mask, value, depth = stack.pop()
+      if not mask.any():
+        continue
+      if depth > len(self._objects):
+        self.dropped += 1
+        continue
+      self.events += 1
+      if kind == _TIME_EVENT:
+        caused = self._updateCurrentTime(target, mask, value)
+      else:
+        caused = self._updateDefaultValue(target, mask, value)
+      stack.extend( (kind, target, mask, value, depth + 1) for kind, target, mask, value in reversed(caused) )
+
+  def _updateCurrentTime(self, simulatedObject, mask, now):
+    currentTime = self._resource(simulatedObject, "CurrentTime")
+    intervalTime = self._resource(simulatedObject, "IntervalTime")
+    lastActivationTime = self._resource(simulatedObject, "LastActivationTime")
+    if currentTime is None or intervalTime is None or lastActivationTime is None:
+      return []
+    currentTime[mask] = now
+    fire = mask & (now - lastActivationTime >= intervalTime)
+    lastActivationTime[fire] = now
+    return self._onInterval(simulatedObject, fire, now)
+
+  def _onInterval(self, simulatedObject, mask, now):
+    if simulatedObject.typeName == "TimeSource":
+      self._resource(simulatedObject, "OutputValue")[mask] = now
+      return [ (_TIME_EVENT, target, mask, now) for target in simulatedObject.outputLinks ]
+    if simulatedObject.typeName in ("AnalogInput", "BinaryInput"):
+      currentValue = self._resource(simulatedObject, "CurrentValue")
+      pinIDs = self._resource(simulatedObject, "PinID")
+      numpy.copyto(currentValue, self._sampler(self.now, simulatedObject.name, pinIDs, currentValue.dtype), casting="unsafe", where=mask)
+      return self._syncToOutput(simulatedObject, mask)
+    return []
+
+  def _readDefaultValue(self, simulatedObject):
+    for resource in ("OutputValue", "CurrentValue", "InputValue"):
+      value = self._resource(simulatedObject, resource)
+      if value is not None:
+        return value.copy()
+    print("readDefault couldn't find a candidate resource:", simulatedObject.name)
+    raise ValueError(simulatedObject.name)
+
+  def _syncToOutput(self, simulatedObject, mask):
+    if not simulatedObject.outputLinks:
+      return []
+    value = self._readDefaultValue(simulatedObject)
+    return [ (_VALUE_EVENT, target, mask, value) for target in simulatedObject.outputLinks ]
+
+  def _updateDefaultValue(self, simulatedObject, mask, value):
+    for resource in ("InputValue", "CurrentValue", "OutputValue"):
+      defaultValue = self._resource(simulatedObject, resource)
+      if defaultValue is not None:
+        numpy.copyto(defaultValue, value, casting="unsafe", where=mask)
+        return self._onDefaultValueUpdate(simulatedObject, mask)
+    print("updateDefaultValue couldn't find a candidate resource:", simulatedObject.name)
+    raise ValueError(simulatedObject.name)
+
+  def _onDefaultValueUpdate(self, simulatedObject, mask):
+    if simulatedObject.typeName == "ValueMap":
+      return self._mapValue(simulatedObject, mask)
+    if simulatedObject.typeName == "Publisher":
+      self._publishValue(simulatedObject, mask)
+    return []
+
+  # the line through (InputLowReference, CurrentLowReference) and (InputHighReference, CurrentHighReference).
+  # The model description subtracts CurrentLowReference where this adds it, the two agree when it is 0. With equal
+  # input references there is no line, and the value maps to CurrentLowReference
+  def _mapValue(self, simulatedObject, mask):
+    inputValue = self._resource(simulatedObject, "InputValue")
+    inputLow = self._resource(simulatedObject, "InputLowReference")
+    inputSpan = self._resource(simulatedObject, "InputHighReference") - inputLow
+    currentLow = self._resource(simulatedObject, "CurrentLowReference")
+    currentSpan = self._resource(simulatedObject, "CurrentHighReference") - currentLow
+    slope = numpy.divide(currentSpan, inputSpan, out=numpy.zeros(self._instances), where=inputSpan != 0)
+    mapped = currentLow + (inputValue - inputLow) * slope
+    mapped = numpy.minimum( numpy.maximum(mapped, self._resource(simulatedObject, "CurrentValueMinimum")),
+      self._resource(simulatedObject, "CurrentValueMaximum") )
+    numpy.copyto(self._resource(simulatedObject, "CurrentValue"), mapped, casting="unsafe", where=mask)
+    return self._syncToOutput(simulatedObject, mask)
+
+  def _publishValue(self, simulatedObject, mask):
+    value = self._readDefaultValue(simulatedObject).astype(numpy.float64)
+    published = self._published[simulatedObject.name]
+    published["count"][mask] += 1
+    published["last"][mask] = value[mask]
+    published["minimum"][mask] = numpy.minimum(published["minimum"][mask], value[mask])
+    published["maximum"][mask] = numpy.maximum(published["maximum"][mask], value[mask])
+    published["sum"][mask] += value[mask]
+    if self._publish is not None:
+      self._publish(self.now, simulatedObject.name, mask, value)
+
+# parse OBJECT.RESOURCE=VALUE
+def _parseSetting(setting):
+  name, value = setting.split("=", 1)
+  objectName, resourceName = name.split(".", 1)
+  return objectName, resourceName, float(value)
+
+def simulate():
+  import argparse
+  from builder import ModelGraph, FlowGraph
+  parser = argparse.ArgumentParser(description="ObjectFlow host simulator")
+  parser.add_argument("--model", default="../Model/", help="model directory")
+  parser.add_argument("--flow", default="../Flow/", help="flow spec directory or file")
+  parser.add_argument("--instances", type=int, default=1000, help="number of flow instances to simulate")
+  parser.add_argument("--ticks", type=int, default=1000, help="number of clock ticks to run")
+  parser.add_argument("--step", type=int, default=10, help="clock step in time units (milliseconds on the device)")
+  parser.add_argument("--start", type=int, default=0, help="clock time at the first tick")
+  parser.add_argument("--seed", type=int, help="random seed for the pin readings")
+  parser.add_argument("--set", action="append", default=[], metavar="OBJECT.RESOURCE=VALUE",
+    help="set a resource in every instance before the run, e.g. MapToCelsius.InputHighReference=1023")
+  args = parser.parse_args()
+
+  model = ModelGraph(args.model)
+  flow = FlowGraph(model, args.flow)
+  simulation = FlowSimulator.fromFlowGraph(flow, model, instances=args.instances, sampler=RandomSampler(args.seed))
+  for setting in args.set:
+    simulation.setValues(*_parseSetting(setting))
+  simulation.now = args.start
+
+  start = time.perf_counter()
+  simulation.run(args.ticks, args.step)
+  seconds = time.perf_counter() - start
+  print( simulation.summary() )
+  print( "%d instances x %d ticks in %.3f s, %.0f instance ticks/s" % (args.instances, args.ticks, seconds,
+    args.instances * args.ticks / seconds if seconds else 0) )
+  return simulation
+
+if __name__ == '__main__':
+  simulate()
@@ -0,0 +1,37 @@
+import json
+import os
+import tempfile
+import unittest
+from builder import BUILDER_VERSION, MODEL_BUNDLE_FORMAT, ModelGraph
+
+
+# regression tests for model bundles, run from the Builder directory with
+#   python3 -m unittest test_bundle
+class ModelBundleTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.TemporaryDirectory()
+
+  def tearDown(self):
+    self.directory.cleanup()
+
+  def writeBundle(self, builderVersion, graph):
+    bundlePath = os.path.join(self.directory.name, "model.json")
+    with open(bundlePath, "w") as bundlefile:
+      json.dump( { "format": MODEL_BUNDLE_FORMAT, "builderVersion": builderVersion, "graph": graph }, bundlefile )
+    return bundlePath
+
+  def test_current_bundle_loads(self):
+    graph = { "sdfObject": { "Object": { "sdfProperty": { "Value": { "type": "number" } } } } }
+    model = ModelGraph( self.writeBundle(BUILDER_VERSION, graph) )
+    self.assertEqual( model.graph(), graph )
+    self.assertEqual( model.errors(), 0 )
+
+  def test_older_bundle_is_refused(self):
+    # bundles load unchecked, an sdfRef cycle from a builder without the cycle check would get through
+    graph = { "sdfObject": { "LoopA": { "sdfRef": "#/sdfObject/LoopB" }, "LoopB": { "sdfRef": "#/sdfObject/LoopA" } } }
+    with self.assertRaises(ValueError):
+      ModelGraph( self.writeBundle("0.4", graph) )
+
+if __name__ == '__main__':
+  unittest.main()
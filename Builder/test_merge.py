@@ -0,0 +1,60 @@
+import unittest
+from builder import Graph, copyTree, mergePatch
+
+
+# regression tests for the merge engine, run from the Builder directory with
+#   python3 -m unittest test_merge
+class MergePatchTest(unittest.TestCase):
+
+  def test_lists_merge_in_order(self):
+    # an ordered union with the base items first, the old set() merge reordered them from run to run
+    merged = mergePatch( { "sdfRequired": [ "c", "a", "b" ] }, { "sdfRequired": [ "d", "a", "e" ] } )
+    self.assertEqual( merged["sdfRequired"], [ "c", "a", "b", "d", "e" ] )
+
+  def test_lists_of_unhashable_items(self):
+    # dicts and lists in lists are compared by value, the old set() merge raised TypeError on them
+    merged = mergePatch( { "items": [ { "id": 1 }, [ 1, 2 ] ] }, { "items": [ { "id": 1 }, { "id": 2 }, [ 1, 2 ] ] } )
+    self.assertEqual( merged["items"], [ { "id": 1 }, [ 1, 2 ], { "id": 2 } ] )
+
+  def test_lists_keep_items_of_other_types(self):
+    # 1, 1.0 and True are equal in Python but are different JSON values
+    merged = mergePatch( { "items": [ 1, { "a": 1 } ] }, { "items": [ True, 1.0, 1, { "a": True } ] } )
+    self.assertEqual( [ (type(item), item) for item in merged["items"] ],
+      [ (int, 1), (dict, { "a": 1 }), (bool, True), (float, 1.0), (dict, { "a": True }) ] )
+
+  def test_long_lists_merge_in_order(self):
+    # long lists are hashed instead of searched
+    merged = mergePatch( { "enum": list(range(20)) }, { "enum": [ 25, 5, True, 5.0, 20 ] } )
+    self.assertEqual( merged["enum"], list(range(20)) + [ 25, True, 5.0, 20 ] )
+    self.assertIs( type(merged["enum"][21]), bool )
+
+  def test_deep_trees_merge(self):
+    # trees deeper than the recursion limit are merged through the explicit stack
+    base = patch = None
+    for depth in range(3000):
+      base = { "node": base } if base else { "value": 1 }
+      patch = { "node": patch } if patch else { "other": 2 }
+    merged = mergePatch(base, patch)
+    for depth in range(2999):
+      merged = merged["node"]
+    self.assertEqual( merged, { "value": 1, "other": 2 } )
+
+  def test_graph_add_keeps_merged_list(self):
+    # Graph._mergeObject dropped the merged list and kept the base list
+    graph = Graph( { "sdfObject": { "Object": { "sdfRequired": [ "a" ] } } } )
+    graph.add( { "sdfObject": { "Object": { "sdfRequired": [ "b" ] } } } )
+    self.assertEqual( graph.graph()["sdfObject"]["Object"]["sdfRequired"], [ "a", "b" ] )
+
+  def test_refine_replaces_sdfChoice(self):
+    # the merge changes the base in place, so each merge gets its own copies
+    base = { "sdfProperty": { "Value": { "sdfChoice": { "IntegerType": {}, "FloatType": {} }, "description": "base" } } }
+    patch = { "sdfProperty": { "Value": { "sdfChoice": { "FloatType": { "default": 0 } }, "description": "patch" } } }
+    refined = mergePatch( copyTree(base), copyTree(patch), refine=True )
+    self.assertEqual( refined["sdfProperty"]["Value"]["sdfChoice"], { "FloatType": { "default": 0 } } )
+    self.assertEqual( refined["sdfProperty"]["Value"]["description"], "base" ) # descriptions aren't refined
+    merged = mergePatch( copyTree(base), copyTree(patch) )
+    self.assertEqual( merged["sdfProperty"]["Value"]["sdfChoice"], { "IntegerType": {}, "FloatType": { "default": 0 } } )
+    self.assertEqual( merged["sdfProperty"]["Value"]["description"], "patch" )
+
+if __name__ == '__main__':
+  unittest.main()
@@ -6,6 +6,28 @@
 
 using namespace ObjectFlow;
 
+#ifdef OBJECTFLOW_LOOKUP_TABLES
+/* Object and Resource pointers in instance list order, filled by buildInstances, so that objects and resources
+   in the instance list are found in constant time through the perfect hash tables in lookup-tables.h */
+/* Other objects are found by walking the object list. Resources added to an instance list object after
+   buildInstances aren't in the tables and aren't found by ID */
+static Object* objectTable[lookupObjectCount];
+static Resource* resourceTable[lookupResourceCount];
+
+// enter a resource made from the instance list, and its object, in the pointer tables
+static void addToTables(Object* object, Resource* resource) {
+  int objectIndex = objectIndexByID(object -> typeID, object -> instanceID);
+  if (objectIndex < 0) {
+    return;
+  }
+  objectTable[objectIndex] = object;
+  int resourceIndex = resourceIndexByID(objectIndex, resource -> typeID, resource -> instanceID);
+  if (resourceIndex >= 0) {
+    resourceTable[resourceIndex] = resource;
+  }
+};
+#endif
+
 /* Resource: expose values and chain together into a linked list for each object*/
 
 Resource::Resource(uint16_t type, uint16_t instance, ValueType vtype) {
@@ -49,6 +71,18 @@ Resource* Object::newResource(uint16_t type, uint16_t instance, ValueType vtype)
 
 // return a pointer to the first resource in this object that matches the type and instance
 Resource* Object::getResourceByID(uint16_t type, uint16_t instance) {
+#ifdef OBJECTFLOW_LOOKUP_TABLES
+  int objectIndex = objectIndexByID(typeID, instanceID);
+  if (objectIndex >= 0 && objectTable[objectIndex] == this) {
+    int resourceIndex = resourceIndexByID(objectIndex, type, instance);
+    if (resourceIndex < 0) {
+      return NULL; // not in this object
+    }
+    if (resourceTable[resourceIndex] != NULL) {
+      return resourceTable[resourceIndex];
+    }
+  }
+#endif
   Resource* resource = firstResource;
   while ( (resource != NULL) && (resource -> typeID != type || resource -> instanceID != instance) ) {
     resource = resource -> nextResource;
@@ -58,6 +92,12 @@ Resource* Object::getResourceByID(uint16_t type, uint16_t instance) {
 
 // return a pointer to the first object in the Object list that matches the type and instance
 Object* Object::getObjectByID(uint16_t type, uint16_t instance) {
+#ifdef OBJECTFLOW_LOOKUP_TABLES
+  int objectIndex = objectIndexByID(type, instance);
+  if (objectIndex >= 0 && objectTable[objectIndex] != NULL && objectTable[objectIndex] -> firstObject == firstObject) {
+    return objectTable[objectIndex];
+  }
+#endif
   Object* object = firstObject;
   while (object != NULL && (object -> typeID != type || object -> instanceID != instance)) {
     object = object -> nextObject;
@@ -275,6 +315,12 @@ Object* ObjectList::applicationObject(uint16_t type, uint16_t instance, Object*
 
 // return a pointer to the first object that matches the type and instance
 Object* ObjectList::getObjectByID(uint16_t type, uint16_t instance) {
+#ifdef OBJECTFLOW_LOOKUP_TABLES
+  int objectIndex = objectIndexByID(type, instance);
+  if (objectIndex >= 0 && objectTable[objectIndex] != NULL && objectTable[objectIndex] -> firstObject == firstObject) {
+    return objectTable[objectIndex];
+  }
+#endif
   Object* object = firstObject;
   while (object != NULL && (object -> typeID != type || object -> instanceID != instance)) {
     object = object -> nextObject;
@@ -283,6 +329,48 @@ Object* ObjectList::getObjectByID(uint16_t type, uint16_t instance) {
 };
 
 // build all of the objects and resources that appear in instances.h
+#ifdef OBJECTFLOW_COMPACT_INSTANCES
+// compact tables, each entry is copied out of program memory before it is used
+void ObjectList::buildInstances() {
+  for(unsigned int objectIndex=0; objectIndex < sizeof(instanceObjects)/sizeof(InstanceObject); objectIndex++){
+    InstanceObject instanceObject;
+    memcpy_P(&instanceObject, &instanceObjects[objectIndex], sizeof(InstanceObject));
+    Object* object = newObject(instanceObject.objectTypeID, instanceObject.objectInstanceID);
+    for(uint16_t index=instanceObject.firstResource; index < instanceObject.firstResource + instanceObject.resourceCount; index++){
+      InstanceResource instanceResource;
+      memcpy_P(&instanceResource, &instanceResources[index], sizeof(InstanceResource));
+      ValueType valueType = (ValueType)instanceResource.valueType;
+      AnyValueType value;
+      switch(valueType) {
+        case booleanType: memcpy_P(&value.booleanType, &booleanValues[instanceResource.valueIndex], sizeof(bool)); break;
+        case integerType: memcpy_P(&value.integerType, &integerValues[instanceResource.valueIndex], sizeof(int)); break;
+        case floatType: memcpy_P(&value.floatType, &floatValues[instanceResource.valueIndex], sizeof(double)); break;
+        case linkType: memcpy_P(&value.linkType, &linkValues[instanceResource.valueIndex], sizeof(InstanceLink)); break;
+        case timeType: memcpy_P(&value.timeType, &timeValues[instanceResource.valueIndex], sizeof(time_t)); break;
+        case stringType: {
+          const char* text;
+          memcpy_P(&text, &stringValues[instanceResource.valueIndex], sizeof(char*));
+#ifdef __AVR__
+          // resources hold RAM strings, copy the string out of program memory
+          char* copy = new char[strlen_P(text) + 1];
+          strcpy_P(copy, text);
+          value.stringType = copy;
+#else
+          value.stringType = (char*)text;
+#endif
+          break;
+        }
+      }
+#ifdef OBJECTFLOW_LOOKUP_TABLES
+      addToTables(object, object -> newResource(instanceResource.resourceTypeID, instanceResource.resourceInstanceID, valueType));
+#else
+      object -> newResource(instanceResource.resourceTypeID, instanceResource.resourceInstanceID, valueType);
+#endif
+      object -> updateValueByID(instanceResource.resourceTypeID, instanceResource.resourceInstanceID, value);
+    };
+  };
+};
+#else
 void ObjectList::buildInstances() {
   Object* object;
   for(int instance=0; instance < sizeof(instanceList)/sizeof(InstanceTemplate);instance++){
@@ -290,10 +378,15 @@ void ObjectList::buildInstances() {
     if (NULL == object) {
       object = newObject(instanceList[instance].objectTypeID, instanceList[instance].objectInstanceID);
     }
+#ifdef OBJECTFLOW_LOOKUP_TABLES
+    addToTables(object, object -> newResource(instanceList[instance].resourceTypeID, instanceList[instance].resourceInstanceID, instanceList[instance].valueType));
+#else
     object -> newResource(instanceList[instance].resourceTypeID, instanceList[instance].resourceInstanceID, instanceList[instance].valueType);
+#endif
     object -> updateValueByID(instanceList[instance].resourceTypeID, instanceList[instance].resourceInstanceID, instanceList[instance].value);
   };
 };
+#endif
 
 void ObjectList::displayObjects() {
   Object* object = firstObject;
@@ -7,6 +7,17 @@
 #define true 1
 #define false 0
 
+// read-only data in program memory, on targets that have a separate address space for it
+#ifdef __AVR__
+#include <avr/pgmspace.h>
+#else
+#include <string.h>
+#define PROGMEM
+#define memcpy_P memcpy
+#define strlen_P strlen
+#define strcpy_P strcpy
+#endif
+
 /* 
 Well-known reusable Resource Types
 Free resource range 26231-32768
@@ -57,6 +68,23 @@ namespace ObjectFlow
     AnyValueType value;
   };
 
+  /* compact instance tables, generated with the builder --compact option, all in PROGMEM */
+  /* each object once, with its resources in a run of the resource table */
+  struct InstanceObject {
+    uint16_t objectTypeID;
+    uint16_t objectInstanceID;
+    uint16_t firstResource;
+    uint16_t resourceCount;
+  };
+
+  /* the value is valueIndex in the value array of valueType, booleanValues, integerValues, etc. */
+  struct InstanceResource {
+    uint16_t resourceTypeID;
+    uint16_t resourceInstanceID;
+    uint16_t valueIndex;
+    uint8_t valueType;
+  };
+
   /* base classes */
 
   /* Resource: expose values and chain together into a linked list for each object */